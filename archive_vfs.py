@@ -0,0 +1,264 @@
+# archive_vfs.py
+import hashlib
+import io
+import os
+import tarfile
+import zipfile
+from typing import Callable, Dict, List, Optional, Tuple
+
+import py7zr
+import rarfile
+
+from file_collector import FileCollector, SubmissionManifest, classify
+from tools.extract import ExtractBudget, ExtractLimits, configure_rar_tool
+
+# 巢狀壓縮檔需要整個讀進記憶體才能開啟，超過這個大小就不在記憶體中展開
+MAX_NESTED_ARCHIVE_BYTES = 64 * 1024 * 1024
+
+
+class VirtualSubmission:
+    """直接從班級壓縮檔讀出的單一學生作業，不落地到磁碟"""
+
+    def __init__(self, name: str, manifest: SubmissionManifest, budget: ExtractBudget):
+        self.name = name
+        self.manifest = manifest
+        # 與磁碟模式相同的解壓縮額度（所有巢狀壓縮檔共用），超過上限的成員不會讀進記憶體
+        self.budget = budget
+        # 無法在記憶體中讀取的巢狀壓縮檔與原因，以及超過解壓縮上限而略過的檔案
+        self.errors: List[str] = []
+
+
+def _split_member(name: str) -> List[str]:
+    return [part for part in name.replace('\\', '/').split('/') if part]
+
+
+def _strip_common_root(names: List[str]) -> int:
+    """與磁碟模式相同：若整個壓縮檔只有一個最上層資料夾，就一路往下，回傳要略過的層數"""
+    parts = [_split_member(n) for n in names]
+    depth = 0
+    while True:
+        heads = {p[depth] for p in parts if len(p) > depth}
+        if len(heads) != 1 or not any(len(p) > depth + 1 for p in parts):
+            return depth
+        depth += 1
+
+
+def fingerprint_class_archive(zip_path: str) -> Dict[str, str]:
+    """
+    不解壓縮也不讀取成員內容，只用 zip 中央目錄的成員路徑、CRC32 與大小計算每位學生作業的內容雜湊。
+    學生資料夾的命名與 ArchiveReader 及磁碟模式相同；巢狀壓縮檔的內容改變時 CRC 也會改變。
+    """
+    with zipfile.ZipFile(zip_path, 'r') as archive:
+        infos = archive.infolist()
+    skip = _strip_common_root([info.filename for info in infos])
+    digests = {}
+    for info in sorted(infos, key=lambda i: i.filename):
+        parts = _split_member(info.filename)[skip:]
+        if not parts or info.is_dir():
+            continue
+        if len(parts) == 1:
+            if classify(parts[0]) != 'archive':
+                continue
+            student = os.path.splitext(parts[0])[0]
+        else:
+            student = parts[0]
+        digest = digests.setdefault(student, hashlib.sha256())
+        digest.update(f"{'/'.join(parts[1:]) or parts[0]}\0{info.CRC:08x}\0{info.file_size}\n".encode('utf-8'))
+    return {student: digest.hexdigest() for student, digest in digests.items()}
+
+
+class ArchiveReader:
+    """
+    以唯讀方式走訪班級壓縮檔與其中的巢狀壓縮檔（zip / 7z / tar / rar），
+    把每位學生的檔案直接交給 FileCollector，只有評分報告會寫到磁碟。
+    """
+
+    def __init__(self, collector_factory: Callable[[], FileCollector], max_depth: int = 3,
+                 limits: Optional[ExtractLimits] = None):
+        self.collector_factory = collector_factory
+        self.max_depth = max_depth
+        self.limits = limits or ExtractLimits()
+
+    def read_class_archive(self, zip_path: str, virtual_root: str) -> List[Tuple[VirtualSubmission, FileCollector]]:
+        """
+        Args:
+            zip_path: 班級作業壓縮檔
+            virtual_root: 對應的（虛擬）解壓縮目錄，學生的 manifest.root 會是 virtual_root/<學生資料夾>
+        """
+        submissions: Dict[str, Tuple[VirtualSubmission, FileCollector]] = {}
+        with zipfile.ZipFile(zip_path, 'r') as outer:
+            infos = outer.infolist()
+            skip = _strip_common_root([info.filename for info in infos])
+            for info in infos:
+                parts = _split_member(info.filename)[skip:]
+                if not parts:
+                    continue
+                if len(parts) == 1 and not info.is_dir():
+                    # 班級壓縮檔最上層直接放了學生的壓縮檔（例如 學號_姓名.zip），以去掉副檔名的名稱作為學生資料夾
+                    if classify(parts[0]) != 'archive':
+                        continue
+                    student = os.path.splitext(parts[0])[0]
+                    rel_parts = []
+                else:
+                    student, rel_parts = parts[0], parts[1:]
+                if student not in submissions:
+                    collector = self.collector_factory()
+                    manifest = SubmissionManifest(os.path.join(virtual_root, student))
+                    submissions[student] = (VirtualSubmission(student, manifest, self.limits.budget()), collector)
+                submission, collector = submissions[student]
+                if not info.is_dir() and not _charge(submission.budget, zip_path, info.filename, info.file_size, info.compress_size):
+                    continue
+                if not rel_parts:
+                    if not info.is_dir():
+                        self._add_archive(submission, collector, parts[0], [], info.file_size,
+                                          lambda i=info: outer.read(i), 1)
+                    continue
+                self._add_member(submission, collector, rel_parts, info.is_dir(), info.file_size,
+                                 lambda limit, i=info: self._read_member(outer, i, limit), 1)
+        for submission, _ in submissions.values():
+            budget = submission.budget
+            submission.errors += budget.skipped
+            if budget.skipped_count > len(budget.skipped):
+                submission.errors.append(f"另有 {budget.skipped_count - len(budget.skipped)} 個檔案超過解壓縮上限而略過")
+        return [submissions[name] for name in sorted(submissions)]
+
+    @staticmethod
+    def _read_member(archive: zipfile.ZipFile, info: zipfile.ZipInfo, limit: int) -> bytes:
+        """zip 或 rar（rarfile 與 zipfile 有相同的介面）的成員，最多讀取 limit 個位元組"""
+        with archive.open(info) as f:
+            return f.read(limit)
+
+    def _add_member(self, submission: VirtualSubmission, collector: FileCollector, rel_parts: List[str],
+                    is_dir: bool, size: int, read: Callable[[int], bytes], depth: int) -> None:
+        manifest = submission.manifest
+        rel_path = os.path.join(*rel_parts)
+        # 補上隱含的上層資料夾，讓檔案結構與磁碟模式一致
+        for index in range(1, len(rel_parts) if not is_dir else len(rel_parts) + 1):
+            parent = os.path.join(*rel_parts[:index])
+            if parent not in manifest.dirs:
+                manifest.dirs.append(parent)
+        if is_dir:
+            return
+        if '__MACOSX' in rel_parts[:-1]:
+            return
+        name = rel_parts[-1]
+        if classify(name) == 'archive' and depth <= self.max_depth and not name.startswith('._'):
+            # 成員放在與壓縮檔同名（去掉副檔名）的資料夾下，與磁碟模式的遞迴解壓縮一致
+            base_parts = rel_parts[:-1] + [os.path.splitext(name)[0]]
+            self._add_archive(submission, collector, rel_path, base_parts, size,
+                              lambda: read(MAX_NESTED_ARCHIVE_BYTES + 1), depth)
+            return
+        collector.add_file(manifest, rel_path, size, read)
+
+    def _add_archive(self, submission: VirtualSubmission, collector: FileCollector, rel_path: str,
+                     base_parts: List[str], size: int, read_all: Callable[[], bytes], depth: int) -> None:
+        """在記憶體中展開巢狀壓縮檔，成員的路徑以 base_parts 為前綴；無法展開時只把壓縮檔本身列入檔案清單"""
+        manifest = submission.manifest
+        if size > MAX_NESTED_ARCHIVE_BYTES:
+            submission.errors.append(f"{rel_path}：壓縮檔過大（{size} 位元組），未在記憶體中展開")
+            collector.add_file(manifest, rel_path, size, lambda limit: b'')
+            return
+        try:
+            data = read_all()
+            members = list(self._iter_archive(rel_path, data, submission.budget))
+        except Exception as e:
+            submission.errors.append(f"{rel_path}：{e}")
+            collector.add_file(manifest, rel_path, size, lambda limit: b'')
+            return
+        # 與磁碟模式展開後刪除壓縮檔相同，歸還壓縮檔本身佔用的大小
+        submission.budget.written = max(0, submission.budget.written - size)
+        if base_parts:
+            base = os.path.join(*base_parts)
+            if base not in manifest.dirs:
+                manifest.dirs.append(base)
+        for member_parts, is_dir, member_size, read in members:
+            if member_parts:
+                self._add_member(submission, collector, base_parts + member_parts, is_dir, member_size, read, depth + 1)
+
+    @staticmethod
+    def _iter_archive(name: str, data: bytes, budget: ExtractBudget):
+        """
+        依副檔名開啟記憶體中的壓縮檔，逐一產生 (路徑片段, 是否為資料夾, 大小, 讀取函式)。
+        每個檔案先以宣告的大小、壓縮比與檔案數量計入 budget，超過上限的檔案略過並記錄，不會讀進記憶體；
+        讀取函式 read(limit) 最多只讀 limit 個位元組。
+        """
+        lower = name.lower()
+        buffer = io.BytesIO(data)
+        if lower.endswith('.zip'):
+            archive = zipfile.ZipFile(buffer)
+            for info in archive.infolist():
+                if info.is_dir() or _charge(budget, name, info.filename, info.file_size, info.compress_size):
+                    yield (_split_member(info.filename), info.is_dir(), info.file_size,
+                           lambda limit, i=info: ArchiveReader._read_member(archive, i, limit))
+        elif lower.endswith('.7z'):
+            with py7zr.SevenZipFile(buffer, 'r') as archive:
+                entries = archive.list()
+                # py7zr 在記憶體中解壓縮整個固實區塊，沒有要讀取的檔案也會被解壓縮，
+                # 因此解壓縮後的總大小要在 MAX_NESTED_ARCHIVE_BYTES 以內，而且每個檔案都要在額度內
+                total = sum(info.uncompressed or 0 for info in entries)
+                if total > MAX_NESTED_ARCHIVE_BYTES:
+                    raise ValueError(f"解壓縮後過大（{total} 位元組），未在記憶體中展開")
+                infos = [info for info in entries
+                         # 固實壓縮 (solid) 沒有個別檔案壓縮後的大小，以整個壓縮檔的大小計算壓縮比
+                         if info.is_directory or _charge(budget, name, info.filename, info.uncompressed or 0, info.compressed or len(data))]
+                if len(infos) < len(entries):
+                    for info in infos:
+                        if not info.is_directory:
+                            budget.refund(info.uncompressed or 0)
+                    raise ValueError("有檔案超過解壓縮上限，固實壓縮無法只解壓縮其餘的檔案，未在記憶體中展開")
+                contents = _read_7z(archive, [info.filename for info in infos if not info.is_directory])
+            for info in infos:
+                content = contents.get(info.filename, b'')
+                yield (_split_member(info.filename), info.is_directory, info.uncompressed or 0,
+                       lambda limit, c=content: c[:limit])
+        elif lower.endswith('.tar'):
+            # tar 可能再以 gzip 等壓縮，沒有個別檔案壓縮後的大小，以整個壓縮檔的大小計算壓縮比
+            archive = tarfile.open(fileobj=buffer, mode='r:*')
+            for info in archive.getmembers():
+                if not (info.isfile() or info.isdir()):
+                    budget.skip(name, info.name, "不是一般檔案")
+                elif info.isdir() or _charge(budget, name, info.name, info.size, len(data)):
+                    yield (_split_member(info.name), info.isdir(), info.size,
+                           lambda limit, i=info: ArchiveReader._read_tar_member(archive, i, limit))
+        elif lower.endswith('.rar'):
+            configure_rar_tool()
+            archive = rarfile.RarFile(buffer)
+            for info in archive.infolist():
+                if info.is_dir() or _charge(budget, name, info.filename, info.file_size, info.compress_size):
+                    yield (_split_member(info.filename), info.is_dir(), info.file_size,
+                           lambda limit, i=info: ArchiveReader._read_member(archive, i, limit))
+        else:
+            raise ValueError(f"不支援的壓縮檔格式 {os.path.splitext(name)[1]}")
+
+    @staticmethod
+    def _read_tar_member(archive: tarfile.TarFile, info: tarfile.TarInfo, limit: int) -> bytes:
+        source = archive.extractfile(info)
+        return source.read(limit) if source is not None else b''
+
+
+def _charge(budget: ExtractBudget, archive: str, name: str, size: int, compressed: int) -> bool:
+    """以宣告的大小計入解壓縮額度（與磁碟模式相同的檢查），超過上限時記錄並回傳 False"""
+    reason = budget.charge(size, compressed)
+    if reason:
+        budget.skip(archive, name, reason)
+    return not reason
+
+
+def _read_7z(archive: py7zr.SevenZipFile, targets: List[str]) -> Dict[str, bytes]:
+    """
+    只讀出 7z 中 targets 的內容，每個檔案最多 MAX_NESTED_ARCHIVE_BYTES + 1 個位元組
+    （巢狀壓縮檔超過這個大小也不會展開），相容舊版 (read) 與新版 (WriterFactory) 的 py7zr
+    """
+    if not targets:
+        return {}
+    limit = MAX_NESTED_ARCHIVE_BYTES + 1
+    if hasattr(archive, 'readall'):
+        return {name: bio.read(limit) for name, bio in (archive.read(targets) or {}).items()}
+    from py7zr.io import BytesIOFactory
+    factory = BytesIOFactory(limit)
+    archive.extract(targets=targets, factory=factory)
+    contents = {}
+    for name, product in factory.products.items():
+        product.seek(0)
+        contents[name] = product.read(limit)
+    return contents
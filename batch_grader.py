@@ -0,0 +1,106 @@
+# batch_grader.py
+import json
+import re
+from typing import Any, Dict, List, Optional
+
+from prompt_builder import BuiltPrompt
+
+# 批次評分時附加在所有學生內容之前的指令：不調用工具，只輸出每位學生一筆的 JSON 陣列
+BATCH_INSTRUCTIONS = """以下共有 {count} 位學生的作業，請依評分標準分別評分。
+這次請不要調用任何工具，只輸出一個 JSON 陣列，每位學生一筆，格式如下：
+[{{"student_id": "學號", "student_name": "姓名", "score": 分數, "comments": "詳細評語與改進建議"}}]
+student_id 必須與題目中的學號完全相同，不要遺漏任何一位學生，也不要輸出 JSON 以外的文字。
+"""
+
+# 每筆評分紀錄必須包含的欄位
+RECORD_FIELDS = ("student_id", "score", "comments")
+
+
+class BatchItem:
+    """批次中的單一學生：已組合好的提示內容、報告輸出路徑與評分快取鍵"""
+
+    def __init__(self, student_id: str, student_name: str, output_path: str, prompt: BuiltPrompt,
+                 cache_key: Optional[str] = None):
+        self.student_id = student_id
+        self.student_name = student_name
+        self.output_path = output_path
+        self.prompt = prompt
+        self.cache_key = cache_key
+
+
+def build_batch_prompt(items: List[BatchItem]) -> str:
+    """把多位學生的內容依序串在一起，每位學生以學號分隔"""
+    sections = [BATCH_INSTRUCTIONS.format(count=len(items))]
+    for index, item in enumerate(items, 1):
+        sections.append(f"===== 第 {index} 位學生（學號：{item.student_id}）=====\n{item.prompt.text.strip()}")
+    return "\n\n".join(sections)
+
+
+def _extract_json(text: str) -> Any:
+    """從回應中取出 JSON：允許外層有 ```json 區塊或前後的說明文字"""
+    text = (text or "").strip()
+    fenced = re.search(r"```(?:json)?\s*(.*?)```", text, re.S)
+    if fenced:
+        text = fenced.group(1).strip()
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        pass
+    start, end = text.find('['), text.rfind(']')
+    if start == -1 or end <= start:
+        raise ValueError("回應中找不到 JSON 陣列")
+    return json.loads(text[start:end + 1])
+
+
+def _validate_record(record: Any) -> Optional[Dict[str, Any]]:
+    """檢查單筆評分紀錄，格式錯誤時回傳 None"""
+    if not isinstance(record, dict) or any(field not in record for field in RECORD_FIELDS):
+        return None
+    try:
+        score = float(record["score"])
+    except (TypeError, ValueError):
+        return None
+    if not 0 <= score <= 100:
+        return None
+    comments = record["comments"]
+    if not isinstance(comments, str) or not comments.strip():
+        return None
+    return {
+        "student_id": str(record["student_id"]).strip(),
+        "student_name": str(record.get("student_name") or ""),
+        "score": int(score) if score.is_integer() else score,
+        "comments": comments,
+    }
+
+
+def parse_batch_response(response: Any, items: List[BatchItem]) -> Dict[str, Dict[str, Any]]:
+    """
+    解析批次回應，回傳 {學號: write_grading_report 的參數}。
+    只保留格式正確且學號屬於這個批次的紀錄；模型若改用 write_grading_report 工具回應也一併接受。
+    缺少或格式錯誤的學生不會出現在結果中，由呼叫端改為單獨評分。
+    """
+    if isinstance(response, list) or "response" not in response:
+        # 後端已經把 JSON 回應解析好（例如 AgentGemini 直接回傳 json.loads 的結果）
+        records = response if isinstance(response, list) else [response]
+    else:
+        records = [dict(tool_call["parameters"]) for tool_call in response.get("tool_calls") or []
+                   if tool_call.get("tool") == "write_grading_report"]
+    if not records and isinstance(response, dict) and "response" in response:
+        try:
+            parsed = _extract_json(response.get("response", ""))
+        except ValueError as e:
+            print(f"無法解析批次評分結果：{e}")
+            return {}
+        records = parsed if isinstance(parsed, list) else [parsed]
+
+    by_id = {item.student_id: item for item in items}
+    results = {}
+    for record in records:
+        valid = _validate_record(record)
+        if valid is None or valid["student_id"] not in by_id or valid["student_id"] in results:
+            continue
+        item = by_id[valid["student_id"]]
+        valid["student_name"] = item.student_name
+        valid["output_path"] = item.output_path
+        results[item.student_id] = valid
+    return results
@@ -0,0 +1,97 @@
+# benchmarks/fake_backend.py
+import asyncio
+import json
+import os
+import random
+import re
+import time
+from collections import Counter
+from typing import Any, Dict, Optional
+
+from model.base import AgentBase
+
+# 批次評分提示中每位學生的分隔行，見 batch_grader.build_batch_prompt
+BATCH_SECTION = re.compile(r"（學號：(\S+?)）=====")
+
+
+class FakeAgent(AgentBase):
+    """
+    離線基準測試用的假模型後端，實作與 AgentGemini / AgentOllama 相同的介面，不需要 API 金鑰或 GPU。
+
+    每次呼叫等待 latency（加上 ±jitter 的隨機誤差）秒來模擬網路與推論時間；非串流模式再加上 tail_latency 秒，
+    模擬模型在工具調用之後繼續生成的文字（串流模式在工具調用完成時就停止，見 --stream）。回應依提示內容決定：
+        - 批次評分提示：回傳每位學生一筆的 JSON 陣列，malformed_rate 比例的紀錄會故意格式錯誤
+        - 沒有程式碼且要求解壓縮：unzip_first 時先對檔案結構中的壓縮檔調用 unzip_folder
+        - 其他：直接調用 write_grading_report
+    """
+
+    def __init__(self, latency: float = 0.3, jitter: float = 0.0, unzip_first: bool = True,
+                 malformed_rate: float = 0.0, score: int = 85, seed: int = 0, tail_latency: float = 0.0):
+        self.latency = latency
+        self.tail_latency = tail_latency
+        self.jitter = jitter
+        self.unzip_first = unzip_first
+        self.malformed_rate = malformed_rate
+        self.score = score
+        self.random = random.Random(seed)
+        self.tools = None
+        self.calls = 0
+        self.batch_calls = 0
+        self.calls_per_student: Counter = Counter()
+        self._unzipped = set()
+
+    def set_tools(self, tools: list):
+        self.tools = tools
+
+    def cache_identity(self) -> Dict[str, Any]:
+        return {"backend": "fake", "score": self.score}
+
+    def _delay(self, streaming: bool = False) -> float:
+        tail = 0.0 if streaming else self.tail_latency
+        return max(0.0, self.latency + tail + self.random.uniform(-self.jitter, self.jitter))
+
+    def generate_text(self, prompt: str, context: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        time.sleep(self._delay())
+        return self._respond(prompt)
+
+    async def agenerate_text(self, prompt: str, context: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        started = time.perf_counter()
+        await asyncio.sleep(self._delay(self.streaming))
+        result = self._respond(prompt)
+        if self.streaming:
+            result["usage"] = {"ttft": 0.0, "stream_seconds": round(time.perf_counter() - started, 3),
+                               "thinking_tokens": 0, "early_stop": self.tail_latency > 0}
+        return result
+
+    def _respond(self, prompt: str) -> Dict[str, Any]:
+        self.calls += 1
+        batch_ids = BATCH_SECTION.findall(prompt)
+        if batch_ids:
+            self.batch_calls += 1
+            records = []
+            for student_id in batch_ids:
+                self.calls_per_student[student_id] += 1
+                score = "格式錯誤" if self.random.random() < self.malformed_rate else self.score
+                records.append({"student_id": student_id, "student_name": "", "score": score, "comments": "基準測試"})
+            return {"response": json.dumps(records, ensure_ascii=False), "tool_calls": []}
+
+        student_id = re.search(r"學號：(\S+)", prompt).group(1)
+        self.calls_per_student[student_id] += 1
+        output_path = re.search(r"輸出路徑為：(.*grading_report\.txt)", prompt).group(1)
+        folder = re.search(r"檔案路徑為:(.*?)，", prompt)
+        if folder and self.unzip_first:
+            for archive in re.findall(r"📄 (.+?\.(?:zip|rar|7z|tar))(?: \(|$)", prompt, re.M):
+                source = os.path.join(folder.group(1), archive)
+                if source not in self._unzipped:
+                    self._unzipped.add(source)
+                    return {"response": "需要先解壓縮", "tool_calls": [{"tool": "unzip_folder", "parameters": {
+                        "source_path": source,
+                        "target_path": os.path.splitext(source)[0]
+                    }}]}
+        return {"response": "評分完成", "tool_calls": [{"tool": "write_grading_report", "parameters": {
+            "student_id": student_id,
+            "student_name": "",
+            "score": self.score if not folder else 0,
+            "comments": "基準測試",
+            "output_path": output_path
+        }}]}
@@ -0,0 +1,128 @@
+# benchmarks/ollama_stub.py
+"""
+模擬 Ollama /api/chat、/api/generate 與 /api/tags 的本機 HTTP 伺服器，不需要 GPU 就能測試多主機負載平衡、
+斷路器、串流與結構化輸出。每個請求等待 --latency 秒後回應一個 write_grading_report 工具調用
+（有 format= 時回應評分紀錄的 JSON）；--fail 讓伺服器一律回應 500，--hang 讓伺服器不回應（模擬逾時）。
+
+    python -m benchmarks.ollama_stub --port 11501 --latency 0.5
+    OLLAMA_HOSTS=http://127.0.0.1:11501,http://127.0.0.1:11502 python main.py -m ollama -z hw.zip -c 8
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubState:
+    def __init__(self, latency: float = 0.2, fail: bool = False, hang: bool = False, name: str = ""):
+        self.latency = latency
+        self.fail = fail
+        self.hang = hang
+        self.name = name
+        self.requests = 0
+        self.loads = 0
+        self.outstanding = 0
+        self.max_outstanding = 0
+        self.lock = threading.Lock()
+
+
+def _tool_call(body: dict) -> dict:
+    return {"function": {"name": "write_grading_report", "arguments": {
+        "student_id": "stub", "student_name": "", "score": 87, "comments": "stub", "output_path": "grading_report.txt"}}}
+
+
+def make_handler(state: StubState):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status: int, payload: dict) -> None:
+            data = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == "/api/tags":
+                self._send(200, {"models": [{"name": "stub"}]})
+            else:
+                self._send(404, {"error": "not found"})
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            with state.lock:
+                state.requests += 1
+                state.outstanding += 1
+                state.max_outstanding = max(state.max_outstanding, state.outstanding)
+            try:
+                if state.hang:
+                    time.sleep(3600)
+                time.sleep(state.latency)
+                if state.fail:
+                    self._send(500, {"error": "stub failure"})
+                elif self.path == "/api/generate":
+                    with state.lock:
+                        state.loads += 1
+                    self._send(200, {"model": body.get("model"), "response": "", "done": True})
+                elif self.path == "/api/chat" and body.get("stream"):
+                    self._stream(body)
+                elif self.path == "/api/chat" and body.get("format"):
+                    # 結構化輸出：回傳符合 schema 的評分紀錄
+                    self._send(200, {"model": body.get("model"), "done": True, "prompt_eval_count": 10, "eval_count": 20,
+                                     "message": {"role": "assistant", "content": json.dumps(
+                                         {"score": 87, "comments": "stub"}, ensure_ascii=False)}})
+                elif self.path == "/api/chat":
+                    self._send(200, {"model": body.get("model"), "done": True, "prompt_eval_count": 10, "eval_count": 5,
+                                     "message": {"role": "assistant", "content": "", "thinking": state.name,
+                                                 "tool_calls": [_tool_call(body)]}})
+                else:
+                    self._send(404, {"error": "not found"})
+            finally:
+                with state.lock:
+                    state.outstanding -= 1
+
+        def _stream(self, body: dict) -> None:
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            chunks = [{"message": {"role": "assistant", "content": "", "thinking": "評分中"}, "done": False},
+                      {"message": {"role": "assistant", "content": "", "tool_calls": [_tool_call(body)]}, "done": False},
+                      {"message": {"role": "assistant", "content": "後續說明"}, "done": False},
+                      {"message": {"role": "assistant", "content": ""}, "done": True, "eval_count": 3}]
+            for chunk in chunks:
+                line = (json.dumps(dict(chunk, model=body.get("model")), ensure_ascii=False) + "\n").encode('utf-8')
+                self.wfile.write(f"{len(line):x}\r\n".encode() + line + b"\r\n")
+                self.wfile.flush()
+                time.sleep(state.latency)
+            self.wfile.write(b"0\r\n\r\n")
+
+    return Handler
+
+
+def serve(port: int, state: StubState) -> ThreadingHTTPServer:
+    """在背景執行緒啟動伺服器，回傳伺服器物件（呼叫 shutdown() 停止）"""
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(state))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="模擬 Ollama API 的本機伺服器")
+    parser.add_argument("--port", type=int, default=11501)
+    parser.add_argument("--latency", type=float, default=0.2, help="每個請求（串流時每個區塊）的延遲秒數 (預設: 0.2)")
+    parser.add_argument("--fail", action="store_true", help="一律回應 500")
+    parser.add_argument("--hang", action="store_true", help="不回應，模擬逾時")
+    args = parser.parse_args()
+    server = serve(args.port, StubState(args.latency, args.fail, args.hang, name=str(args.port)))
+    print(f"Ollama 模擬伺服器：http://127.0.0.1:{args.port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,220 @@
+# benchmarks/run_benchmark.py
+"""
+離線基準測試：產生合成的班級壓縮檔，以假模型後端端到端執行 main.main，
+回報總時間、各階段時間、最高記憶體用量與每位學生的模型呼叫次數。
+
+    python -m benchmarks.run_benchmark --students 40 --depth 2 --formats zip,7z --latency 0.2 -c 8
+    python -m benchmarks.run_benchmark --json result.json --baseline baseline.json
+
+無法辨識的參數會直接傳給 main.py（例如 -c 8、--batch-size 5、--in-memory）。
+指定 --baseline 時，若總時間或每位學生的模型呼叫次數比基準差超過 --tolerance，結束代碼為 1，可用於 CI。
+"""
+import argparse
+import asyncio
+import contextlib
+import functools
+import inspect
+import io
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+try:
+    import resource
+except ImportError:  # Windows 沒有 resource 模組，不回報記憶體用量
+    resource = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# main.py 以相對路徑讀取 prompt/ 與 tools/mcp_tools.py，必須在專案根目錄執行
+os.chdir(ROOT)
+sys.path.insert(0, ROOT)
+
+import main  # noqa: E402
+from archive_vfs import ArchiveReader  # noqa: E402
+from benchmarks.fake_backend import FakeAgent  # noqa: E402
+from benchmarks.synthetic import make_class_archive  # noqa: E402
+from file_collector import FileCollector  # noqa: E402
+from mcp_client import MCPToolClient  # noqa: E402
+from prompt_builder import PromptBuilder  # noqa: E402
+
+STAGES = ("extract", "collect", "prompt_build", "model", "tool_calls")
+
+
+class StageTimer:
+    """暫時替換各階段的函數，累計每個階段花費的時間（同時批改多位學生時為各學生時間的總和）"""
+
+    def __init__(self):
+        self.totals = defaultdict(float)
+        self.counts = defaultdict(int)
+        self._patches = []
+
+    def wrap(self, owner, name: str, stage) -> None:
+        """stage 可以是階段名稱，或依呼叫參數決定階段名稱的函數"""
+        original = getattr(owner, name)
+        stage_of = stage if callable(stage) else (lambda args, kwargs: stage)
+
+        def record(args, kwargs, started):
+            label = stage_of(args, kwargs)
+            self.totals[label] += time.perf_counter() - started
+            self.counts[label] += 1
+
+        if inspect.iscoroutinefunction(original):
+            @functools.wraps(original)
+            async def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await original(*args, **kwargs)
+                finally:
+                    record(args, kwargs, started)
+        else:
+            @functools.wraps(original)
+            def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return original(*args, **kwargs)
+                finally:
+                    record(args, kwargs, started)
+        setattr(owner, name, wrapper)
+        self._patches.append((owner, name, original))
+
+    def restore(self) -> None:
+        for owner, name, original in reversed(self._patches):
+            setattr(owner, name, original)
+        self._patches.clear()
+
+
+def _tool_stage(args, kwargs) -> str:
+    tool_name = kwargs.get("tool_name", args[1] if len(args) > 1 else "")
+    return "extract" if tool_name == "unzip_folder" else "tool_calls"
+
+
+def peak_rss_mb() -> float:
+    """本程序的最高常駐記憶體 (MB)，MCP 工具伺服器是獨立的子程序，不計入"""
+    if resource is None:
+        return None
+    # Linux 的 ru_maxrss 單位為 KB，macOS 為 bytes
+    unit = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / unit, 1)
+
+
+def run_once(archive_path: str, main_args: argparse.Namespace, agent: FakeAgent, verbose: bool) -> dict:
+    timer = StageTimer()
+    timer.wrap(MCPToolClient, "call_tool", _tool_stage)
+    timer.wrap(ArchiveReader, "read_class_archive", "extract")
+    timer.wrap(main, "extract_class", "extract")
+    timer.wrap(FileCollector, "collect", "collect")
+    timer.wrap(FileCollector, "extend", "collect")
+    timer.wrap(PromptBuilder, "build", "prompt_build")
+    timer.wrap(FakeAgent, "agenerate_text", "model")
+    timer.wrap(FakeAgent, "run_batch_job", "model")
+    original_load_backend = main.load_backend
+    main.load_backend = lambda backend: (lambda: agent)
+    output = io.StringIO()
+    started = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(sys.stdout if verbose else output):
+            asyncio.run(main.main(main_args))
+    finally:
+        wall = time.perf_counter() - started
+        main.load_backend = original_load_backend
+        timer.restore()
+    return {
+        "wall_time": round(wall, 3),
+        "stages": {stage: round(timer.totals.get(stage, 0.0), 3) for stage in STAGES},
+        "stage_calls": {stage: timer.counts.get(stage, 0) for stage in STAGES},
+    }
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="以假模型後端與合成作業壓縮檔執行離線基準測試")
+    parser.add_argument("--students", type=int, default=30, help="學生人數 (預設: 30)")
+    parser.add_argument("--depth", type=int, default=1, help="學生壓縮檔的巢狀層數，0 表示不壓縮 (預設: 1)")
+    parser.add_argument("--files", type=int, default=2, help="每位學生的 .c 檔案數量 (預設: 2)")
+    parser.add_argument("--file-kb", type=int, default=2, help="每個 .c 檔案的大小 (預設: 2)")
+    parser.add_argument("--binary-kb", type=int, default=0, help="每位學生附加的截圖大小，0 表示不附加 (預設: 0)")
+    parser.add_argument("--formats", default="zip", help="學生壓縮檔格式，以逗號分隔輪流使用，例如 zip,7z (預設: zip)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0.2, help="假模型每次呼叫的延遲秒數 (預設: 0.2)")
+    parser.add_argument("--tail-latency", type=float, default=0.0,
+                        help="非串流模式下假模型在工具調用之後多生成的秒數，用來比較 --stream 的效果 (預設: 0)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="延遲的隨機誤差秒數 (預設: 0)")
+    parser.add_argument("--no-unzip-first", action="store_true", help="假模型不主動調用 unzip_folder")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="批次評分中故意格式錯誤的紀錄比例 (預設: 0)")
+    parser.add_argument("--repeat", type=int, default=1, help="重複執行次數，回報總時間的中位數 (預設: 1)")
+    parser.add_argument("--json", help="將結果寫成 JSON 檔案")
+    parser.add_argument("--baseline", help="與之前 --json 產生的結果比較")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="與基準比較時允許變差的比例 (預設: 0.25)")
+    parser.add_argument("--verbose", action="store_true", help="顯示 main.py 的輸出")
+    return parser
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> list:
+    """回傳比基準差超過 tolerance 的指標"""
+    regressions = []
+    for metric in ("wall_time", "llm_calls_per_student"):
+        before, after = baseline.get(metric), result.get(metric)
+        if before and after is not None and after > before * (1 + tolerance):
+            regressions.append(f"{metric}: {before} -> {after}")
+    return regressions
+
+
+def main_cli(argv=None) -> int:
+    args, passthrough = build_parser().parse_known_args(argv)
+    workdir = tempfile.mkdtemp(prefix="ta_bench_")
+    try:
+        archive_path = os.path.join(workdir, "class.zip")
+        shape = make_class_archive(archive_path, students=args.students, depth=args.depth,
+                                   files_per_student=args.files, file_kb=args.file_kb, binary_kb=args.binary_kb,
+                                   formats=args.formats.split(","), seed=args.seed)
+        runs = []
+        agent = None
+        for attempt in range(args.repeat):
+            output_dir = os.path.join(workdir, f"graded_{attempt}")
+            # 預設停用評分快取，每次執行都會真的呼叫（假）模型
+            main_args = main.build_parser().parse_args(["-z", archive_path, "-o", output_dir, "--no-cache"] + passthrough)
+            agent = FakeAgent(latency=args.latency, jitter=args.jitter, unzip_first=not args.no_unzip_first,
+                              malformed_rate=args.malformed_rate, seed=args.seed, tail_latency=args.tail_latency)
+            run = run_once(archive_path, main_args, agent, args.verbose)
+            run["reports"] = sum(1 for _, _, files in os.walk(output_dir) if "grading_report.txt" in files)
+            run["llm_calls"] = agent.calls
+            runs.append(run)
+            shutil.rmtree(output_dir, ignore_errors=True)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    best = min(runs, key=lambda run: run["wall_time"])
+    result = {
+        "shape": dict(shape, depth=args.depth, formats=args.formats, latency=args.latency, tail_latency=args.tail_latency),
+        "main_args": passthrough,
+        "wall_time": round(statistics.median(run["wall_time"] for run in runs), 3),
+        "wall_times": [run["wall_time"] for run in runs],
+        "stages": best["stages"],
+        "stage_calls": best["stage_calls"],
+        "peak_rss_mb": peak_rss_mb(),
+        "reports": best["reports"],
+        "llm_calls": best["llm_calls"],
+        "llm_calls_per_student": round(best["llm_calls"] / max(1, args.students), 3),
+        "max_llm_calls_for_one_student": max(agent.calls_per_student.values(), default=0),
+    }
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            regressions = compare(result, json.load(f), args.tolerance)
+        if regressions:
+            print("效能退步：\n" + "\n".join(regressions))
+            return 1
+        print("與基準相比沒有退步")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
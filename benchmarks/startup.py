@@ -0,0 +1,86 @@
+# benchmarks/startup.py
+"""
+啟動時間檢查：量測 `python main.py --help` 的總時間與 `import main` 時各模組的匯入時間 (python -X importtime)，
+超過 --budget 秒，或匯入了只應在使用時才載入的套件（模型後端 SDK、mcp），結束代碼為 1，可用於 CI。
+
+    python -m benchmarks.startup
+    python -m benchmarks.startup --budget 0.8 --repeat 5 --json startup.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# 只在選擇對應的 --model 或真的呼叫工具時才匯入的套件
+LAZY_MODULES = ("google.generativeai", "ollama", "mcp", "pydantic")
+
+
+def measure_help(repeat: int) -> list:
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, "main.py", "--help"], cwd=ROOT, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append(time.perf_counter() - started)
+    return times
+
+
+def import_times() -> dict:
+    """回傳 {模組名稱: 累計匯入時間（秒）}"""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"], cwd=ROOT, check=True,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        try:
+            modules[name.strip()] = int(cumulative) / 1e6
+        except ValueError:
+            continue  # 標題列
+    return modules
+
+
+def main_cli(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="main.py 啟動時間檢查")
+    parser.add_argument("--budget", type=float, default=1.0, help="python main.py --help 的時間上限（秒，取中位數）(預設: 1.0)")
+    parser.add_argument("--repeat", type=int, default=3, help="重複執行次數 (預設: 3)")
+    parser.add_argument("--top", type=int, default=10, help="列出匯入最久的模組數量 (預設: 10)")
+    parser.add_argument("--json", help="將結果寫成 JSON 檔案")
+    args = parser.parse_args(argv)
+
+    times = measure_help(args.repeat)
+    modules = import_times()
+    top_level = {name: seconds for name, seconds in modules.items() if "." not in name}
+    result = {
+        "help_seconds": round(statistics.median(times), 3),
+        "help_times": [round(t, 3) for t in times],
+        "import_main_seconds": round(modules.get("main", 0.0), 3),
+        "slowest_imports": [[name, round(seconds, 3)] for name, seconds in
+                            sorted(top_level.items(), key=lambda item: -item[1])[:args.top]],
+        "eager_lazy_modules": [name for name in LAZY_MODULES if name in modules],
+        "budget": args.budget,
+    }
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+    failures = []
+    if result["help_seconds"] > args.budget:
+        failures.append(f"python main.py --help 需要 {result['help_seconds']} 秒，超過 {args.budget} 秒")
+    if result["eager_lazy_modules"]:
+        failures.append("啟動時匯入了應該延遲載入的套件：" + "、".join(result["eager_lazy_modules"]))
+    if failures:
+        print("\n".join(failures))
+        return 1
+    print("啟動時間在預算內")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
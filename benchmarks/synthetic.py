@@ -0,0 +1,115 @@
+# benchmarks/synthetic.py
+import io
+import os
+import random
+import tarfile
+import zipfile
+from typing import Dict, Iterable
+
+import py7zr
+
+LAST_NAMES = ["SATO", "SUZUKI", "TAKAHASHI", "TANAKA", "ITO", "WATANABE", "YAMAMOTO", "NAKAMURA", "KOBAYASHI", "KATO"]
+FIRST_NAMES = ["TAKUMI", "YUNA", "RYOTA", "KAORI", "TAICHI", "MIFUYU", "KOTARO", "RISE", "TOKI", "HIRONOBU"]
+
+# 與作業相同的 3x3 矩陣題目，作為每個 .c 檔案的開頭
+MATRIX_PROGRAM = """#include <stdio.h>
+
+/* student {index}: 3x3 matrix multiplication */
+void multiply(int a[3][3], int b[3][3], int c[3][3]) {{
+    for (int i = 0; i < 3; i++)
+        for (int j = 0; j < 3; j++) {{
+            c[i][j] = 0;
+            for (int k = 0; k < 3; k++)
+                c[i][j] += a[i][k] * b[k][j];
+        }}
+}}
+
+int main(void) {{
+    int a[3][3], b[3][3], c[3][3];
+    for (int i = 0; i < 3; i++)
+        for (int j = 0; j < 3; j++)
+            scanf("%d", &a[i][j]);
+    for (int i = 0; i < 3; i++)
+        for (int j = 0; j < 3; j++)
+            scanf("%d", &b[i][j]);
+    multiply(a, b, c);
+    for (int i = 0; i < 3; i++)
+        printf("%d %d %d\\n", c[i][0], c[i][1], c[i][2]);
+    return 0;
+}}
+"""
+
+
+def c_source(index: int, size: int, rng: random.Random) -> bytes:
+    """產生約 size 位元組的 C 程式碼：矩陣題目加上補足長度的輔助函數"""
+    code = MATRIX_PROGRAM.format(index=index)
+    helper = 0
+    while len(code) < size:
+        helper += 1
+        code += (
+            f"\nint helper_{helper}(int x) {{\n"
+            f"    /* {rng.getrandbits(64):016x} */\n"
+            f"    return x * {rng.randint(2, 99)} + {rng.randint(0, 999)};\n"
+            f"}}\n"
+        )
+    return code.encode('utf-8')
+
+
+def pack(files: Dict[str, bytes], fmt: str) -> bytes:
+    """把 {成員路徑: 內容} 打包成 zip / 7z / tar 的位元組"""
+    buffer = io.BytesIO()
+    if fmt == 'zip':
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for name, data in files.items():
+                archive.writestr(name, data)
+    elif fmt == '7z':
+        with py7zr.SevenZipFile(buffer, 'w') as archive:
+            for name, data in files.items():
+                archive.writestr(data, name)
+    elif fmt == 'tar':
+        with tarfile.open(fileobj=buffer, mode='w') as archive:
+            for name, data in files.items():
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                archive.addfile(info, io.BytesIO(data))
+    else:
+        raise ValueError(f"不支援的壓縮檔格式：{fmt}")
+    return buffer.getvalue()
+
+
+def make_class_archive(path: str, students: int = 30, depth: int = 1, files_per_student: int = 2,
+                       file_kb: int = 2, binary_kb: int = 0, formats: Iterable[str] = ('zip',),
+                       seed: int = 0) -> Dict[str, int]:
+    """
+    產生與 hw100039334.zip 相同形狀的班級壓縮檔：每位學生一個「學號_姓名 /」資料夾。
+
+    Args:
+        depth: 程式碼外面包了幾層學生自己的壓縮檔，0 表示程式碼直接放在學生資料夾中
+        file_kb: 每個 .c 檔案的大小
+        binary_kb: 大於 0 時每位學生多附一張這個大小的截圖（二進位檔案）
+        formats: 學生壓縮檔的格式，依學生順序輪流使用
+
+    Returns:
+        產生的學生數、檔案數與壓縮檔大小
+    """
+    rng = random.Random(seed)
+    formats = list(formats)
+    file_count = 0
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as outer:
+        for index in range(students):
+            student_id = f"114B{30001 + index:05d}"
+            folder = f"{student_id}_{FIRST_NAMES[index % len(FIRST_NAMES)]} {LAST_NAMES[index // len(FIRST_NAMES) % len(LAST_NAMES)]} "
+            files = {f"hw/main{n + 1}.c" if n else "hw/main.c": c_source(index, file_kb * 1024, rng)
+                     for n in range(files_per_student)}
+            file_count += len(files)
+            fmt = formats[index % len(formats)]
+            for level in range(depth, 0, -1):
+                name = f"{student_id}_homework{level}.{fmt}"
+                files = {name: pack(files, fmt)}
+            for name, data in files.items():
+                outer.writestr(f"{folder}/{name}" if depth else f"{folder}/{os.path.basename(name)}", data)
+            if binary_kb > 0:
+                outer.writestr(f"{folder}/{student_id}_screenshot.png",
+                               b'\x89PNG\r\n\x1a\n' + rng.randbytes(binary_kb * 1024))
+                file_count += 1
+    return {"students": students, "files": file_count, "archive_bytes": os.path.getsize(path)}
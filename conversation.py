@@ -0,0 +1,91 @@
+# conversation.py
+import json
+from typing import Any, Dict, List, Optional
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    粗略估計 token 數：中日韓等非 ASCII 字元約 1 字 1 token，ASCII 約 4 字元 1 token。
+    只用來控制提示長度，不需要精確。
+    """
+    if not text:
+        return 0
+    non_ascii = sum(1 for ch in text if ord(ch) > 127)
+    return non_ascii + (len(text) - non_ascii + 3) // 4
+
+
+def _message_text(message: Dict[str, Any]) -> str:
+    text = message.get("content") or ""
+    if message.get("tool_calls"):
+        text += json.dumps(message["tool_calls"], ensure_ascii=False, default=str)
+    return text
+
+
+class Conversation:
+    """
+    單一學生的多輪對話，取代原本不斷累加的 chat_history.txt。
+
+    訊息格式與後端無關，由各個模型後端轉換成原生的對話格式：
+        {"role": "user", "content": str}
+        {"role": "assistant", "content": str, "tool_calls": [{"tool": str, "parameters": dict}]}
+        {"role": "tool", "tool": str, "content": str}
+    """
+
+    # 單一工具結果保留的最大字元數，避免解壓縮的長訊息塞滿上下文
+    max_tool_result_chars = 2000
+
+    def __init__(self, max_history_tokens: int = 4096):
+        self.messages: List[Dict[str, Any]] = []
+        self.max_history_tokens = max_history_tokens
+
+    def add_user(self, content: str) -> None:
+        self.messages.append({"role": "user", "content": content})
+
+    def add_assistant(self, content: str, tool_calls: Optional[list] = None) -> None:
+        self.messages.append({
+            "role": "assistant",
+            "content": content or "",
+            "tool_calls": [{"tool": tc["tool"], "parameters": dict(tc["parameters"])} for tc in tool_calls or []]
+        })
+
+    def add_tool_result(self, tool: str, content: str) -> None:
+        if len(content) > self.max_tool_result_chars:
+            content = content[:self.max_tool_result_chars] + "\n...（工具結果過長，已截斷）"
+        self.messages.append({"role": "tool", "tool": tool, "content": content})
+
+    def history(self) -> List[Dict[str, Any]]:
+        """
+        回傳要傳給模型的歷史訊息，總長度不超過 max_history_tokens。
+        超過時保留最近的訊息，較早的訊息以一則摘要（呼叫過的工具與結果開頭）取代。
+        """
+        kept = []
+        used = 0
+        for index in range(len(self.messages) - 1, -1, -1):
+            cost = estimate_tokens(_message_text(self.messages[index]))
+            if used + cost > self.max_history_tokens:
+                break
+            kept.append(self.messages[index])
+            used += cost
+        kept.reverse()
+
+        dropped = self.messages[:len(self.messages) - len(kept)]
+        # 工具結果必須緊接在對應的工具調用之後，不能讓它成為第一則訊息
+        while kept and kept[0]["role"] == "tool":
+            dropped.append(kept.pop(0))
+        if dropped:
+            kept.insert(0, {"role": "user", "content": self._summarize(dropped)})
+        return kept
+
+    @staticmethod
+    def _summarize(messages: List[Dict[str, Any]]) -> str:
+        lines = [f"（已省略較早的 {len(messages)} 則對話，摘要如下）"]
+        for message in messages:
+            if message["role"] == "assistant":
+                for tool_call in message["tool_calls"]:
+                    lines.append(f"- 曾調用工具 {tool_call['tool']}")
+            elif message["role"] == "tool":
+                lines.append(f"- {message['tool']} 結果：{message['content'][:200]}")
+        return "\n".join(lines)
+
+    def to_json(self) -> str:
+        return json.dumps(self.messages, ensure_ascii=False, indent=2, default=str)
@@ -0,0 +1,248 @@
+# file_collector.py
+import codecs
+import os
+from typing import Dict, List, Optional, Tuple
+
+from tracing import tracer
+
+SOURCE_EXTENSIONS = {
+    '.c': 'c',
+    '.h': 'h',
+    '.hpp': 'h',
+    '.cpp': 'cpp',
+    '.cc': 'cpp',
+    '.cxx': 'cpp',
+    '.py': 'py',
+}
+ARCHIVE_EXTENSIONS = ('.zip', '.rar', '.tar', '.7z')
+# 這些副檔名一律視為二進位檔案，完全不讀取內容
+BINARY_EXTENSIONS = {
+    '.png', '.jpg', '.jpeg', '.gif', '.bmp', '.webp', '.heic', '.ico',
+    '.pdf', '.doc', '.docx', '.ppt', '.pptx', '.xls', '.xlsx',
+    '.exe', '.dll', '.so', '.o', '.obj', '.a', '.lib', '.pyc', '.class',
+    '.mp3', '.mp4', '.mov', '.avi', '.wav',
+}
+# 只列出名稱、不進入讀取的資料夾（macOS 壓縮時產生的 __MACOSX、編譯產物、IDE 設定等）
+IGNORED_DIRS = {'__MACOSX', '__pycache__', '.git', '.vs', '.vscode', '.idea', 'node_modules'}
+CODE_KINDS = ('c', 'h', 'cpp', 'py')
+
+
+def classify(file_name: str) -> str:
+    """只依檔名判斷種類：c / h / cpp / py / makefile / archive / binary / other"""
+    lower = file_name.lower()
+    if lower.endswith('makefile'):
+        return 'makefile'
+    if lower.endswith(ARCHIVE_EXTENSIONS):
+        return 'archive'
+    extension = os.path.splitext(lower)[1]
+    if extension in SOURCE_EXTENSIONS:
+        return SOURCE_EXTENSIONS[extension]
+    if extension in BINARY_EXTENSIONS or file_name.startswith('._'):
+        return 'binary'
+    return 'other'
+
+
+def looks_binary(sample: bytes) -> bool:
+    """以開頭的位元組判斷是否為二進位檔案：含 NUL 或控制字元比例過高"""
+    if not sample:
+        return False
+    if b'\0' in sample:
+        return True
+    control = sum(1 for b in sample if b < 32 and b not in (9, 10, 12, 13, 8, 27))
+    return control / len(sample) > 0.1
+
+
+def _decodes(sample: bytes, encoding: str) -> Optional[str]:
+    # 使用 incremental decoder，樣本尾端被截斷的多位元組字元不會被當成錯誤
+    try:
+        return codecs.getincrementaldecoder(encoding)().decode(sample, final=False)
+    except UnicodeDecodeError:
+        return None
+
+
+def detect_encoding(sample: bytes) -> str:
+    """
+    從樣本判斷文字編碼，依序嘗試 UTF-8、CP950（Big5）、Shift-JIS。
+    CP950 與 Shift-JIS 的位元組範圍重疊，兩者都能解碼時，以 Shift-JIS 解出假名的情況判定為 Shift-JIS。
+    """
+    if sample.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    if _decodes(sample, 'utf-8') is not None:
+        return 'utf-8'
+    as_sjis = _decodes(sample, 'shift_jis')
+    as_big5 = _decodes(sample, 'cp950')
+    if as_sjis is not None and (as_big5 is None or any('぀' <= ch <= 'ヿ' for ch in as_sjis)):
+        return 'shift_jis'
+    if as_big5 is not None:
+        return 'cp950'
+    return 'utf-8'
+
+
+class FileEntry:
+    """學生繳交的單一檔案"""
+
+    __slots__ = ('rel_path', 'kind', 'size', 'encoding', 'content', 'truncated')
+
+    def __init__(self, rel_path: str, kind: str, size: int, encoding: Optional[str] = None,
+                 content: Optional[str] = None, truncated: bool = False):
+        self.rel_path = rel_path
+        self.kind = kind
+        self.size = size
+        self.encoding = encoding
+        self.content = content
+        self.truncated = truncated
+
+
+class SubmissionManifest:
+    """單一學生作業的檔案清單與已讀取的文字內容"""
+
+    def __init__(self, root: str):
+        self.root = root
+        self.clear()
+
+    def clear(self) -> None:
+        self.dirs: List[str] = []
+        self.entries: List[FileEntry] = []
+        self.bytes_read = 0
+        # 因超過單一檔案或整份作業的大小上限而未讀取（或只讀取部分）的檔案
+        self.skipped: List[str] = []
+
+    @property
+    def archives(self) -> List[str]:
+        return [e.rel_path for e in self.entries if e.kind == 'archive']
+
+    @property
+    def has_code(self) -> bool:
+        return any(e.kind in CODE_KINDS and e.content is not None for e in self.entries)
+
+    def file_structure(self) -> List[str]:
+        lines = [f"📁 {d}/" for d in self.dirs]
+        for entry in self.entries:
+            suffix = ""
+            if entry.kind == 'binary':
+                suffix = " (二進位檔案)"
+            elif entry.truncated:
+                suffix = f" (檔案過大，僅讀取部分內容，原始大小 {entry.size} 位元組)"
+            lines.append(f"📄 {entry.rel_path}{suffix}")
+        return lines
+
+    def grouped(self) -> Dict[str, List[Tuple[str, str]]]:
+        """依種類分組的 (相對路徑, 內容)，供 PromptBuilder 使用"""
+        files = {"c": [], "cpp": [], "h": [], "py": [], "makefile": [], "other": []}
+        for entry in self.entries:
+            if entry.content is not None and entry.kind in files:
+                files[entry.kind].append((entry.rel_path, entry.content))
+        return files
+
+    def source_files(self) -> List[Tuple[str, str]]:
+        """程式碼與 Makefile 的 (相對路徑, 內容)，用於計算評分快取鍵"""
+        return [(e.rel_path, e.content) for e in self.entries
+                if e.content is not None and e.kind in CODE_KINDS + ('makefile',)]
+
+    def remove_subtree(self, rel_dir: str) -> None:
+        prefix = rel_dir.rstrip('/\\') + os.sep
+        self.dirs = [d for d in self.dirs if d != rel_dir and not d.startswith(prefix)]
+        self.entries = [e for e in self.entries if not e.rel_path.startswith(prefix)]
+
+
+class FileCollector:
+    """
+    以 os.scandir 收集學生作業的檔案。
+
+    依副檔名與開頭位元組判斷檔案種類，二進位檔案不會被讀取；文字檔依樣本判斷編碼，
+    並受單一檔案 (max_file_bytes) 與整份作業 (max_total_bytes) 的大小上限限制。
+    """
+
+    def __init__(self, max_file_bytes: int = 256 * 1024, max_total_bytes: int = 2 * 1024 * 1024,
+                 sniff_bytes: int = 4096):
+        self.max_file_bytes = max_file_bytes
+        self.max_total_bytes = max_total_bytes
+        self.sniff_bytes = sniff_bytes
+
+    def collect(self, root: str) -> SubmissionManifest:
+        manifest = SubmissionManifest(root)
+        with tracer.span("collect") as span:
+            self._scan(manifest, root)
+            span.set(files=len(manifest.entries), bytes_read=manifest.bytes_read)
+        return manifest
+
+    def extend(self, manifest: SubmissionManifest, path: str) -> None:
+        """重新掃描 manifest 底下的某個子資料夾（例如模型剛解壓縮出的資料夾），其餘部分沿用"""
+        rel_dir = os.path.relpath(path, manifest.root)
+        if rel_dir.startswith('..') or not os.path.isdir(path):
+            return
+        with tracer.span("collect", extend=True) as span:
+            if rel_dir == '.':
+                manifest.clear()
+                self._scan(manifest, manifest.root)
+            else:
+                manifest.remove_subtree(rel_dir)
+                if rel_dir not in manifest.dirs:
+                    manifest.dirs.append(rel_dir)
+                self._scan(manifest, path)
+            span.set(files=len(manifest.entries), bytes_read=manifest.bytes_read)
+
+    def add_file(self, manifest: SubmissionManifest, rel_path: str, size: int, read) -> FileEntry:
+        """
+        加入一個不在磁碟上的檔案（例如直接從壓縮檔讀出的成員）。
+        read(limit) 回傳最多 limit 個位元組，只有需要時才會被呼叫，二進位檔案完全不會讀取。
+        """
+        entry = self._make_entry(manifest, rel_path, os.path.basename(rel_path), size, read)
+        manifest.entries.append(entry)
+        return entry
+
+    def _scan(self, manifest: SubmissionManifest, directory: str) -> None:
+        stack = [directory]
+        while stack:
+            current = stack.pop()
+            try:
+                with os.scandir(current) as iterator:
+                    items = sorted(iterator, key=lambda e: e.name)
+            except OSError:
+                continue
+            subdirs = []
+            for item in items:
+                rel_path = os.path.relpath(item.path, manifest.root)
+                if item.is_dir(follow_symlinks=False):
+                    manifest.dirs.append(rel_path)
+                    if item.name not in IGNORED_DIRS:
+                        subdirs.append(item.path)
+                elif item.is_file(follow_symlinks=False):
+                    if item.name == 'grading_report.txt':
+                        continue
+                    size = item.stat(follow_symlinks=False).st_size
+                    manifest.entries.append(
+                        self._make_entry(manifest, rel_path, item.name, size, lambda limit, p=item.path: self._read(p, limit))
+                    )
+            stack.extend(reversed(subdirs))
+
+    @staticmethod
+    def _read(path: str, limit: int) -> bytes:
+        with open(path, 'rb') as f:
+            return f.read(limit)
+
+    def _make_entry(self, manifest: SubmissionManifest, rel_path: str, name: str, size: int, read) -> FileEntry:
+        kind = classify(name)
+        if kind in ('archive', 'binary'):
+            return FileEntry(rel_path, kind, size)
+
+        budget = min(self.max_file_bytes, self.max_total_bytes - manifest.bytes_read)
+        if budget <= 0:
+            manifest.skipped.append(rel_path)
+            return FileEntry(rel_path, kind, size, truncated=True)
+        try:
+            sample = read(min(self.sniff_bytes, budget))
+            if looks_binary(sample):
+                return FileEntry(rel_path, 'binary', size)
+            data = sample if size <= len(sample) else read(budget)
+        except OSError as e:
+            print(f"讀取檔案失敗 {rel_path}：{e}")
+            return FileEntry(rel_path, kind, size)
+
+        truncated = size > len(data)
+        if truncated:
+            manifest.skipped.append(rel_path)
+        encoding = detect_encoding(data[:self.sniff_bytes])
+        content = data.decode(encoding, errors='replace')
+        manifest.bytes_read += len(data)
+        return FileEntry(rel_path, kind, size, encoding, content, truncated)
@@ -0,0 +1,130 @@
+# grading_cache.py
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from typing import Any, Dict, Optional
+
+
+def normalize_source(content: str) -> str:
+    """統一換行符號並去除行尾空白，避免只因編輯器設定不同就讓快取失效"""
+    lines = content.replace('\r\n', '\n').replace('\r', '\n').split('\n')
+    return '\n'.join(line.rstrip() for line in lines).strip('\n')
+
+
+def make_cache_key(source_files: list, rubric: str, model_identity: Dict[str, Any], mode: str = "full",
+                   context: Optional[str] = None) -> str:
+    """
+    以學生的程式碼、評分標準、模型名稱與生成參數，以及評分模式與提示中其他會影響評分的內容計算快取鍵
+
+    Args:
+        source_files: [(相對路徑, 檔案內容), ...]
+        rubric: 評分標準全文
+        model_identity: 模型名稱與生成參數，見 AgentBase.cache_identity
+        mode: 評分模式，"full"（完整評分）或 "diff"（近似重複作業依代表作業的評分報告與差異評分）
+        context: 完整評分時為本機檢查的事實（靜態檢查與執行測試的結果），差異評分時為代表作業的評分報告與程式碼差異
+    """
+    digest = hashlib.sha256()
+    for rel_path, content in sorted(source_files):
+        digest.update(rel_path.replace('\\', '/').encode('utf-8'))
+        digest.update(b'\0')
+        digest.update(normalize_source(content).encode('utf-8'))
+        digest.update(b'\0')
+    digest.update(b'\1rubric\0')
+    digest.update(rubric.encode('utf-8'))
+    digest.update(b'\1model\0')
+    digest.update(json.dumps(model_identity, sort_keys=True, ensure_ascii=False, default=str).encode('utf-8'))
+    digest.update(b'\1mode\0')
+    digest.update(mode.encode('utf-8'))
+    if context:
+        digest.update(b'\1context\0')
+        digest.update(context.encode('utf-8'))
+    return digest.hexdigest()
+
+
+class GradingCache:
+    """
+    以 SQLite 儲存的評分快取。
+
+    值為模型產生的 write_grading_report 工具參數，命中時直接重播該工具調用而不呼叫模型。
+    總大小超過 max_bytes 時會依最後使用時間淘汰舊的項目。
+    """
+
+    def __init__(self, path: str = '.cache/grading_cache.sqlite', max_bytes: int = 64 * 1024 * 1024,
+                 enabled: bool = True, refresh: bool = False):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        # refresh 模式：不讀取快取，但仍然寫入新的結果
+        self.refresh = refresh
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+        self._conn: Optional[sqlite3.Connection] = None
+        if self.enabled:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._conn = sqlite3.connect(path)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+                "created REAL NOT NULL, last_used REAL NOT NULL)"
+            )
+            self._conn.commit()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """取得快取的工具參數，未命中時回傳 None"""
+        if not self.enabled or self.refresh:
+            if self.enabled:
+                self.stats["misses"] += 1
+            return None
+        row = self._conn.execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.stats["misses"] += 1
+            return None
+        self._conn.execute("UPDATE entries SET last_used = ? WHERE key = ?", (time.time(), key))
+        self._conn.commit()
+        self.stats["hits"] += 1
+        return json.loads(row[0])
+
+    def contains(self, key: str) -> bool:
+        """是否會命中快取（不更新統計與使用時間），用於決定學生是否需要送去批次評分"""
+        if not self.enabled or self.refresh:
+            return False
+        return self._conn.execute("SELECT 1 FROM entries WHERE key = ?", (key,)).fetchone() is not None
+
+    def put(self, key: str, value: Dict[str, Any]) -> None:
+        """寫入快取並在超過大小上限時淘汰最久未使用的項目"""
+        if not self.enabled:
+            return
+        data = json.dumps(value, ensure_ascii=False, default=str)
+        now = time.time()
+        self._conn.execute(
+            "INSERT OR REPLACE INTO entries (key, value, size, created, last_used) VALUES (?, ?, ?, ?, ?)",
+            (key, data, len(data.encode('utf-8')), now, now)
+        )
+        self.stats["stores"] += 1
+        self._evict()
+        self._conn.commit()
+
+    def _evict(self) -> None:
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._conn.execute("SELECT key, size FROM entries ORDER BY last_used ASC").fetchall():
+            if total <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            total -= size
+            self.stats["evictions"] += 1
+
+    def summary(self) -> str:
+        if not self.enabled:
+            return "評分快取：已停用"
+        return (
+            f"評分快取：命中 {self.stats['hits']} 次，未命中 {self.stats['misses']} 次，"
+            f"寫入 {self.stats['stores']} 筆，淘汰 {self.stats['evictions']} 筆"
+        )
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
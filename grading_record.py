@@ -0,0 +1,62 @@
+# grading_record.py
+import re
+from typing import Any, Dict
+
+from pydantic import BaseModel, Field, ValidationError
+
+from model.retry import MalformedResponse
+
+# 結構化輸出模式附加在提示最後的指令：不調用工具，直接輸出評分紀錄
+STRUCTURED_INSTRUCTION = """這次請不要調用任何工具，直接輸出符合指定 JSON schema 的評分紀錄：
+{"score": 分數, "comments": "詳細評語，包含給分與扣分的地方以及具體的改進建議"}"""
+
+
+class GradingRecord(BaseModel):
+    """結構化輸出模式中模型直接產生的評分紀錄；學號、姓名與輸出路徑由程式填入"""
+
+    score: int = Field(ge=0, le=100, description="總分（0 到 100 的整數）")
+    comments: str = Field(min_length=1, description="詳細評語，包含給分與扣分的地方以及具體的改進建議，使用繁體中文")
+
+
+# Gemini 的 response_schema 只支援 type / description / properties / required 等欄位，
+# 分數範圍由 pydantic 驗證
+_GEMINI_SCHEMA_KEYS = ("type", "description", "properties", "required", "items", "enum")
+
+
+def _gemini_schema(schema: Dict[str, Any]) -> Dict[str, Any]:
+    result = {}
+    for key in _GEMINI_SCHEMA_KEYS:
+        if key not in schema:
+            continue
+        if key == "properties":
+            result[key] = {name: _gemini_schema(value) for name, value in schema[key].items()}
+        elif key == "items":
+            result[key] = _gemini_schema(schema[key])
+        else:
+            result[key] = schema[key]
+    return result
+
+
+def json_schema() -> Dict[str, Any]:
+    """完整的 JSON schema（Ollama 的 format= 參數）"""
+    return GradingRecord.model_json_schema()
+
+
+def gemini_schema() -> Dict[str, Any]:
+    """Gemini response_schema 可以接受的 schema"""
+    return _gemini_schema(json_schema())
+
+
+def parse_record(text: str) -> GradingRecord:
+    """
+    驗證模型輸出的評分紀錄；受限生成下應該一定是合法的 JSON，但仍允許外層的 ```json 區塊。
+    格式錯誤時拋出 MalformedResponse，讓呼叫端重新送出請求。
+    """
+    text = (text or "").strip()
+    fenced = re.search(r"```(?:json)?\s*(.*?)```", text, re.S)
+    if fenced:
+        text = fenced.group(1).strip()
+    try:
+        return GradingRecord.model_validate_json(text)
+    except ValidationError as e:
+        raise MalformedResponse(f"評分紀錄不符合 schema：{e.errors()[0].get('msg', e)}") from e
@@ -1,34 +1,110 @@
 # main.py
-from pprint import pprint
 import argparse
 import os
 # import google.generativeai as genai
 from dotenv import load_dotenv
 import asyncio
-from model.gemini import AgentGemini
-from model.ollamaAPI import AgentOllama
+import time
+from typing import Optional
+import importlib
+from model.base import AgentBase
+from model.cascade import CascadeAgent
 # 從我們自己寫的檔案中匯入工具
-from mcp_client import MCPToolClient
+from mcp_client import MCPToolClient, tool_result_text
+from grading_cache import GradingCache, make_cache_key
+from conversation import Conversation, estimate_tokens
+from prompt_builder import PromptBuilder
+from file_collector import FileCollector, SubmissionManifest
+from archive_vfs import ArchiveReader, VirtualSubmission, fingerprint_class_archive
+from tools.extract import ExtractLimits, extract_class
+from batch_grader import BatchItem, build_batch_prompt, parse_batch_response
+from tracing import tracer, current_student
+from run_manifest import RunManifest
+from prescreen import analyzer, zero_score_reason
+from tools.sandbox import SANDBOX_AVAILABLE, SANDBOX_UNAVAILABLE, TestSuite, format_results, load_test_suite, sandbox
+from tools.write_report import write_grading_report
+from similarity import MinHasher, SimilarityIndex, cluster_signatures, source_diff, write_report
 
 # 載入環境變數 (API Key)
 load_dotenv()
 # genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
 prompt_dir = 'prompt/'
-chat_history = 'chat_history.txt' 
+log_dir = 'logs/'
 
 # --- 1. 定義評分標準 (這是給 Gemini 的核心指令) ---
 
 with open(f'{prompt_dir}system_prompt_python.txt', 'r', encoding='utf-8') as f:
     GRADING_RUBRIC = f.read()
 
-async def grade_single_student(student_folder_path: str, model: AgentGemini, mcp_client: MCPToolClient) -> None:
+# 所有學生共用的系統提示：評分標準與指令放在最前面且固定不變，
+# 後端可以快取這段前綴（Gemini CachedContent / Ollama KV cache），每位學生只需傳送自己的內容
+SYSTEM_PROMPT = f"""評分標準：
+{GRADING_RUBRIC}
+
+請根據評分標準評分，並使用 write_grading_report 工具生成評分報告。
+評分報告應包含：
+1. 分數（70-100）
+2. 詳細評語
+3. 改進建議
+"""
+
+class StudentState:
+    """單一學生批改過程中的狀態：記憶體中的多輪對話，取代原本所有學生共用的 chat_history.txt 與 prompt.txt"""
+
+    def __init__(self, student_folder_path: str, save_transcript: bool = False, max_history_tokens: int = 4096,
+                 prompt_builder: PromptBuilder = None, collector: FileCollector = None, tests: TestSuite = None,
+                 structured: bool = False, max_test_runs: int = 3):
+        self.student_folder_path = student_folder_path
+        self.conversation = Conversation(max_history_tokens=max_history_tokens)
+        self.prompt_builder = prompt_builder or PromptBuilder()
+        self.collector = collector or FileCollector()
+        self.manifest: SubmissionManifest = None
+        # 虛擬檔案系統模式下無法在記憶體中展開的壓縮檔；None 表示作業在磁碟上
+        self.archive_errors: list = None
+        # 寫入執行紀錄的結果：累計的 token 數與最後的分數
+        self.usage = {"input_tokens": 0, "output_tokens": 0}
+        self.score = None
+        # 近似重複的作業：已完整評分的代表作業、相似度、評分報告與程式碼差異，設定時以差異模式評分
+        self.reference: dict = None
+        # 模型要求解壓縮 (KEEP) 的次數，超過上限仍沒有程式碼時由預先檢查直接給 0 分
+        self.extract_attempts = 0
+        # 模型調用 run_python_tests 的次數與上限，避免模型一直要求重新執行測試而無法結束
+        self.test_runs = 0
+        self.max_test_runs = max_test_runs
+        # 作業定義的測試（--run-tests），None 表示不實際執行學生的程式
+        self.tests = tests
+        # 結構化輸出模式（--structured）：有程式碼時由模型直接產生評分紀錄，在本機寫出評分報告
+        self.structured = structured
+        self.save_transcript = save_transcript
+        self.log_dir = os.path.join(log_dir, os.path.basename(os.path.normpath(student_folder_path)))
+
+    async def call_tool(self, mcp_client: MCPToolClient, tool_name: str, arguments: dict):
+        """調用 MCP 工具，並把結果記錄成對話中的工具回應"""
+        result = await mcp_client.call_tool(tool_name, arguments)
+        self.conversation.add_tool_result(tool_name, tool_result_text(result))
+        return result
+
+    async def save(self) -> None:
+        """若有開啟 --save-transcripts，在背景執行緒中把對話寫到 logs/<資料夾名稱>/transcript.json"""
+        if not self.save_transcript:
+            return
+        await asyncio.to_thread(self._write_transcript, self.conversation.to_json())
+
+    def _write_transcript(self, content: str) -> None:
+        os.makedirs(self.log_dir, exist_ok=True)
+        with open(os.path.join(self.log_dir, "transcript.json"), 'w', encoding='utf-8') as f:
+            f.write(content)
+
+async def grade_single_student(student_folder_path: str, model: AgentBase, mcp_client: MCPToolClient, state: StudentState = None, cache: GradingCache = None) -> None:
     """評分單一學生的作業"""
+    if state is None:
+        state = StudentState(student_folder_path)
     # try:
         # 檢查資料夾命名格式
     folder_name = os.path.basename(student_folder_path)
     if "_" not in folder_name:
         error_msg = f"資料夾命名格式錯誤：{folder_name}，應為「學號_姓名」格式"
-        await mcp_client.call_tool("write_grading_report", {
+        await state.call_tool(mcp_client, "write_grading_report", {
             "student_id": "unknown",
             "student_name": "unknown",
             "score": 0,
@@ -39,241 +115,689 @@ async def grade_single_student(student_folder_path: str, model: AgentGemini, mcp
 
     student_id, student_name = folder_name.split("_", 1)
     
-    # 讀取學生的程式碼
-    c_files = []
-    h_files = []
-    zip_files = []
-    py_files = []
-    cpp_files = []
-    makefile_files = []
-    other_files = []
-    file_structure = []
     try:
-        if "grading_report.txt" not in os.listdir(student_folder_path):
-            for root, dirs, files in os.walk(student_folder_path):
-                # 計算相對路徑
-                rel_path = os.path.relpath(root, student_folder_path)
-                if rel_path == '.':
-                    rel_path = ''
-                    
-                # 添加資料夾資訊
-                for dir_name in dirs:
-                    file_structure.append(f"📁 {os.path.join(rel_path, dir_name)}/")
-                    
-                # 添加檔案資訊
-                for file_name in files:
-                    if file_name.endswith('.zip') or file_name.endswith('.rar') or file_name.endswith('.tar') or file_name.endswith('.7z'):
-                        zip_files.append(file_name)
-                    file_path = os.path.join(rel_path, file_name)
-                    file_structure.append(f"📄 {file_path}")
-                    
-                    # 讀取檔案內容
-                    full_path = os.path.join(root, file_name)
-                    try:
-                        try:
-                            with open(full_path, 'r', encoding='utf-8') as f:
-                                content = f.read()
-                        except UnicodeDecodeError as e:
-                            print(f"UTF-8 解碼失敗 {e}")
-                            with open(full_path, 'r') as f:
-                                content = f.read()
-                        except Exception as e:
-                            print(f"讀取檔案失敗 {e}")
-                        if file_name.endswith('.c'):
-                            c_files.append(content)
-                        elif file_name.endswith('.h'):
-                            h_files.append(content)
-                        elif file_name.endswith('.cpp'):
-                            cpp_files.append(content)
-                        elif file_name.endswith('.py'):
-                            py_files.append(content)
-                        elif file_name.endswith('makefile') or file_name.endswith('Makefile'):
-                            makefile_files.append(f"檔案：{file_path}\n內容：\n{content}\n")
-                        else:
-                            other_files.append(f"檔案：{file_path}\n內容：\n{content}\n")
-                    except UnicodeDecodeError:
-                        # 如果檔案不是文字格式，只記錄檔案名稱
-                        other_files.append(f"檔案：{file_path} (二進位檔案)")
-                    except Exception as e:
-                        other_files.append(f"檔案：{file_path} (無法讀取：{str(e)})")
-            if not c_files and not h_files and not cpp_files and not py_files and not zip_files:
-                error_msg = "找不到 .c, .cpp, .h, .py 檔案或壓縮檔"
-                return error_msg
-            # if not c_files and not h_files:
-            #     error_msg = "找不到 .c 或 .h 檔案"
-            #     await mcp_client.call_tool("write_grading_report", {
-            #         "student_id": student_id,
-            #         "student_name": student_name,
-            #         "score": 0,
-            #         "comments": error_msg,
-            #         "output_path": os.path.join(student_folder_path, "grading_report.txt")
-            #     })
-            #     return
+        if not os.path.exists(os.path.join(student_folder_path, "grading_report.txt")):
+            # 收集學生的檔案（二進位檔案不讀取），KEEP 重試時沿用同一份清單，只重新掃描剛解壓縮出的資料夾
+            if state.manifest is None:
+                state.manifest = state.collector.collect(student_folder_path)
+            manifest = state.manifest
+            files = manifest.grouped()
+            file_structure = manifest.file_structure()
+            # (相對路徑, 內容)，用於計算評分快取鍵
+            source_files = manifest.source_files()
+            has_code = manifest.has_code
+            # 預先檢查：評分標準中機械性的零分條件（例如只繳交截圖）在本機判斷，直接寫出 0 分報告而不呼叫模型
+            with tracer.span("prescreen") as span:
+                reason = zero_score_reason(manifest, state.archive_errors, state.extract_attempts)
+                span.set(zero_score=reason is not None)
+            if reason is not None:
+                print(f"{student_folder_path}{reason}")
+                state.score = 0
+                await state.call_tool(mcp_client, "write_grading_report", {
+                    "student_id": student_id,
+                    "student_name": student_name,
+                    "score": 0,
+                    "comments": reason,
+                    "output_path": os.path.join(student_folder_path, "grading_report.txt")
+                })
+                await state.save()
+                return 'STOP'
             
-            # 組合提示
-            prompt = f"""請評分以下學生的作業：
-
-學號：{student_id}\n
-姓名：{student_name}\n
-
-檔案結構:\n
-{chr(10).join(file_structure)}
-
-程式碼：
-"""    
-            if not c_files and not h_files and not cpp_files and not py_files:
-                prompt += f"無程式碼提供，請根據檔案結構判斷是否需要解壓縮，如需解壓縮，檔案路徑為:{os.path.join(student_folder_path)}，將上述路徑加上要解壓縮的資料夾檔名才是完整的解壓縮路徑，請將該路徑設置為source_path。並且將該檔案的解壓縮目標設置為{os.path.join(student_folder_path)}加上解壓縮後你希望該資料夾命名的名稱，才是完整的target_path; 但是如果zip檔案包裹不只一層則請你依據以上規則自行解壓縮到正確的目錄下，解壓縮後請再次評分該學生的作業。"
+            # 組合提示（在 token 預算內，程式碼優先，過長的檔案會被截斷並標記）
+            no_code_hint = None
+            if not has_code and state.archive_errors is not None:
+                # 虛擬檔案系統模式沒有可以解壓縮的實體檔案，直接請模型依現有資訊評分
+                no_code_hint = "無程式碼提供，以下壓縮檔無法讀取：\n" + "\n".join(state.archive_errors) + "\n請直接依評分標準評分。"
+            elif not has_code:
+                no_code_hint = f"無程式碼提供，請根據檔案結構判斷是否需要解壓縮，如需解壓縮，檔案路徑為:{os.path.join(student_folder_path)}，將上述路徑加上要解壓縮的資料夾檔名才是完整的解壓縮路徑，請將該路徑設置為source_path。並且將該檔案的解壓縮目標設置為{os.path.join(student_folder_path)}加上解壓縮後你希望該資料夾命名的名稱，才是完整的target_path; 但是如果zip檔案包裹不只一層則請你依據以上規則自行解壓縮到正確的目錄下，解壓縮後請再次評分該學生的作業。"
+            if state.reference is not None and has_code:
+                built = state.prompt_builder.build_diff(
+                    student_id, student_name, state.reference,
+                    os.path.join(student_folder_path, "grading_report.txt")
+                )
+                mode, context = "diff", state.reference["report"] + "\0" + state.reference["diff"]
             else:
-                if c_files:
-                    prompt += "\nC 檔案：\n" + "\n---\n".join(c_files)
-                if cpp_files:
-                    prompt += "\nCPP 檔案：\n" + "\n---\n".join(cpp_files)
-                if h_files:
-                    prompt += "\n\n標頭檔：\n" + "\n---\n".join(h_files)
-                if py_files:
-                    prompt += "\n\nPython 檔案：\n" + "\n".join(py_files)
-                if makefile_files:
-                    prompt += "\n\nMakefile 檔案：\n" + "\n---\n".join(makefile_files)
-            prompt += f"""
-
-評分標準：
-{GRADING_RUBRIC}
-
-請根據評分標準評分，並使用 write_grading_report 工具生成評分報告。
-評分報告應包含：
-1. 分數（70-100）
-2. 詳細評語
-3. 改進建議
+                facts = await collect_facts(state, manifest) if has_code else None
+                built = state.prompt_builder.build(
+                    student_id, student_name, file_structure, files,
+                    os.path.join(student_folder_path, "grading_report.txt"),
+                    no_code_hint=no_code_hint, facts=facts
+                )
+                mode, context = "full", facts
+            prompt = built.text
+            print(f"{student_folder_path}{built.summary()}")
+            # 評分快取：程式碼、評分標準、模型、評分模式與本機檢查的事實都沒變時，直接重播之前的評分報告
+            cache_key = None
+            if cache is not None and source_files:
+                cache_key = make_cache_key(source_files, SYSTEM_PROMPT, model.cache_identity(), mode, context)
+                cached = cache.get(cache_key)
+                if cached is not None:
+                    cached.update({
+                        "student_id": student_id,
+                        "student_name": student_name,
+                        "output_path": os.path.join(student_folder_path, "grading_report.txt")
+                    })
+                    print(f"{student_folder_path}使用快取的評分結果")
+                    state.score = cached.get("score")
+                    await state.call_tool(mcp_client, "write_grading_report", cached)
+                    await state.save()
+                    return 'STOP'
 
-請確保評分報告的輸出路徑為：{os.path.join(student_folder_path, "grading_report.txt")}
-            """
-            with open(chat_history, 'r', encoding='utf-8') as f:
-                chat_history_content = f.read()
-            with open(chat_history, 'a', encoding='utf-8') as f:
-                f.write("user:" + prompt)
-            # print(chat_history_content)
-            if len(chat_history) > 0:
-                prompt += "\n\n以下是之前的對話歷史記錄：\n" + chat_history_content
+            # 之前的對話（例如上一輪的解壓縮工具調用與結果）以多輪訊息傳給模型，並受 token 上限限制
+            history = state.conversation.history()
+            state.conversation.add_user(prompt)
             print(f"{student_folder_path}作業批改中....")
-            with open("prompt.txt", 'w', encoding='utf-8') as f:
-                f.write(prompt)
-            # 生成評分
-            response = model.generate_text(prompt)
+            if state.structured and has_code:
+                outcome = await grade_structured(state, model, prompt, history, built, student_id, student_name, cache, cache_key)
+                if outcome is not None:
+                    return outcome
+            # 生成評分（非同步呼叫，不會阻塞其他學生的批改）
+            with tracer.span("model", backend=type(model).__name__, prompt_tokens=built.tokens, history_messages=len(history),
+                             diff=state.reference is not None) as span:
+                response = await model.agenerate_text(prompt, {"history": history})
+                span.set(**response.get("usage") or {})
+            for field in state.usage:
+                state.usage[field] += (response.get("usage") or {}).get(field) or 0
             print(response["response"])
-            with open(chat_history, 'a', encoding='utf-8') as f:
-                f.write("\nassistant:" + str(response["response"]) + "\n" + str(response["tool_calls"]) + "\n")
+            state.conversation.add_assistant(response["response"], response.get("tool_calls"))
             # 處理工具調用
             if "tool_calls" in response:
                 for tool_call in response["tool_calls"]:
                     if tool_call["tool"] == "write_grading_report":
-                        await mcp_client.call_tool("write_grading_report", tool_call["parameters"])
+                        state.score = tool_call["parameters"].get("score")
+                        await state.call_tool(mcp_client, "write_grading_report", tool_call["parameters"])
+                        if cache_key is not None:
+                            cache.put(cache_key, dict(tool_call["parameters"]))
+                        await state.save()
                         return 'STOP' 
+                    if tool_call["tool"] == "run_python_tests":
+                        state.test_runs += 1
+                        if state.test_runs > state.max_test_runs:
+                            reason = f"評分中止：模型要求執行測試超過 {state.max_test_runs} 次仍未產生評分，請人工複查"
+                            print(f"{student_folder_path}{reason}")
+                            await state.call_tool(mcp_client, "write_grading_report", {
+                                "student_id": student_id,
+                                "student_name": student_name,
+                                "score": 0,
+                                "comments": reason,
+                                "output_path": os.path.join(student_folder_path, "grading_report.txt")
+                            })
+                            await state.save()
+                            return 'STOP'
+                        await state.call_tool(mcp_client, "run_python_tests", tool_call['parameters'])
+                        await state.save()
+                        return 'KEEP'
                     if tool_call["tool"] == "unzip_folder":
-                        await mcp_client.call_tool("unzip_folder", tool_call['parameters'])
+                        state.extract_attempts += 1
+                        await state.call_tool(mcp_client, "unzip_folder", tool_call['parameters'])
+                        state.collector.extend(manifest, tool_call['parameters'].get('target_path', student_folder_path))
+                        await state.save()
                         return 'KEEP'
-            # except Exception as e:
-            #     print(f"評分過程發生錯誤：{str(e)}")
-            #     # 寫入錯誤報告
-            #     await mcp_client.call_tool("write_grading_report", {
-            #         "student_id": student_id if 'student_id' in locals() else "unknown",
-            #         "student_name": student_name if 'student_name' in locals() else "unknown",
-            #         "score": 0,
-            #         "comments": f"評分過程發生錯誤：{str(e)}",
-            #         "output_path": os.path.join(student_folder_path, "grading_report.txt")
-            #     })
         else:
             return 'STOP'  # 已經有評分報告，跳過
     except Exception as e:
         print(f"處理學生作業時發生錯誤：{str(e)}")
         return 'STOP'    
 
+async def grade_structured(state: StudentState, model: AgentBase, prompt: str, history: list, built, student_id: str,
+                           student_name: str, cache: GradingCache = None, cache_key: str = None) -> Optional[str]:
+    """
+    結構化輸出模式：模型以受限生成直接產生評分紀錄（Gemini response_schema / Ollama format=），
+    驗證後在本機寫出評分報告，不需要工具調用的來回。格式錯誤且重試用盡或 API 錯誤時回傳 None，改用工具調用評分。
+    """
+    with tracer.span("model", backend=type(model).__name__, prompt_tokens=built.tokens, history_messages=len(history),
+                     diff=state.reference is not None, structured=True) as span:
+        try:
+            response = await model.agenerate_record(prompt, {"history": history})
+        except Exception as e:
+            # 後端的 API 錯誤不中斷這位學生的評分，與格式錯誤一樣改用工具調用評分
+            response = {"record": None, "response": "", "error": str(e), "tool_calls": []}
+        span.set(**response.get("usage") or {})
+    for field in state.usage:
+        state.usage[field] += (response.get("usage") or {}).get(field) or 0
+    record = response.get("record")
+    if record is None:
+        print(f"{state.student_folder_path}結構化輸出沒有產生有效的評分紀錄，改用工具調用評分：{response.get('error') or response.get('response')}")
+        return None
+    parameters = {
+        "student_id": student_id,
+        "student_name": student_name,
+        "score": record.score,
+        "comments": record.comments,
+        "output_path": os.path.join(state.student_folder_path, "grading_report.txt")
+    }
+    print(f"{state.student_folder_path}分數：{record.score}")
+    state.score = record.score
+    state.conversation.add_assistant("", [{"tool": "write_grading_report", "parameters": parameters}])
+    with tracer.span("report.write", structured=True):
+        result = await asyncio.to_thread(write_grading_report, **parameters)
+    state.conversation.add_tool_result("write_grading_report", result)
+    if cache_key is not None:
+        cache.put(cache_key, dict(parameters))
+    await state.save()
+    return 'STOP'
+
+async def collect_facts(state: StudentState, manifest: SubmissionManifest) -> Optional[str]:
+    """
+    本機檢查的事實：Python 檔案在行程池中以 ast.parse 檢查的語法錯誤位置與基本指標，
+    以及 --run-tests 時在沙箱中以作業的測試輸入實際執行的結果。
+    """
+    facts = []
+    static = await analyzer.analyze(manifest)
+    if static:
+        facts.append("靜態檢查（ast.parse）：\n" + static)
+    if state.tests is not None:
+        python_files = [(rel_path, content) for rel_path, content in manifest.source_files() if rel_path.lower().endswith('.py')]
+        with tracer.span("sandbox", cases=len(state.tests.cases)) as span:
+            results = await asyncio.to_thread(sandbox.run_submission, python_files, state.tests)
+            span.set(entries=len(results), passed=sum(case.passed for cases in results.values() for case in cases),
+                     runs=sum(len(cases) for cases in results.values()))
+        if results:
+            facts.append("執行測試（在沙箱中以作業的測試輸入實際執行）：\n" + format_results(results, state.tests.limits))
+    return "\n\n".join(facts) or None
+
+# 模型後端在使用時才匯入：google.generativeai 約需 0.5 秒，只用 Ollama 或只看 --help 時不需要載入
+BACKENDS = {
+    'gemini': ('model.gemini', 'AgentGemini'),
+    'ollama': ('model.ollamaAPI', 'AgentOllama'),
+}
+
+def load_backend(backend: str) -> type:
+    """依 --model 匯入並回傳模型後端的類別"""
+    if backend not in BACKENDS:
+        raise ValueError(f"不支援的模型後端：{backend}")
+    module_name, class_name = BACKENDS[backend]
+    return getattr(importlib.import_module(module_name), class_name)
+
+def make_model(backend: str, args, model_name: Optional[str] = None) -> AgentBase:
+    """建立模型後端；model_name 取代環境變數中的模型名稱（分級評分的小模型）"""
+    model = load_backend(backend)()
+    if model_name:
+        model.model_name = model_name
+    model.streaming = args.stream
+    model.max_thinking_tokens = args.max_thinking_tokens
+    return model
+
 async def main(args):
     """主執行函數"""
     # 使用絕對路徑
     current_dir = os.path.dirname(os.path.abspath(__file__))
     homework_zip_file = os.path.join(current_dir, args.zip)
-    unzip_target_dir = os.path.join(current_dir, "assignments", "graded_homework")
+    unzip_target_dir = os.path.join(current_dir, getattr(args, "output_dir", None) or os.path.join("assignments", "graded_homework"))
 
     print("--- C/C++/python語言助教 Agent ---")
     print(f"正在處理壓縮檔：{homework_zip_file}")
     print(f"解壓縮目標目錄：{unzip_target_dir}")
     
+    if getattr(args, "run_tests", False) and not SANDBOX_AVAILABLE:
+        print(f"警告：{SANDBOX_UNAVAILABLE}；略過 --run-tests")
+        args.run_tests = False
+
     # 確保目標目錄存在
     os.makedirs(unzip_target_dir, exist_ok=True)
+    tracer.reset()
+    if getattr(args, "trace", None):
+        tracer.open(args.trace)
     
-    # 初始化 MCP 客戶端和 Gemini 模型
-    mcp_client = MCPToolClient("tools/mcp_tools.py")
-    if args.model == 'ollama':
-        model = AgentOllama()
-    else:
-        model = AgentGemini()
-    
-    # 獲取可用工具列表
+    runs = RunManifest(os.path.join(current_dir, ".cache", "run_manifest.sqlite"))
+    if getattr(args, "list_failures", False):
+        print_failures(runs, os.path.basename(homework_zip_file) if args.zip else None)
+        runs.close()
+        return
+
+    # 初始化 Gemini 模型
+    model = make_model(args.model, args)
+    if args.cascade:
+        # 分級評分：先由小模型評分，信心不足或接近分數界線時才交給 --model 指定的大模型
+        backend, _, model_name = args.cascade.partition(':')
+        model = CascadeAgent(
+            make_model(backend, args, model_name or None), model,
+            min_confidence=args.cascade_confidence,
+            boundaries=tuple(float(b) for b in args.cascade_boundaries.split(',') if b.strip()),
+            margin=args.cascade_margin
+        )
+
+    cache = GradingCache(
+        os.path.join(current_dir, ".cache", "grading_cache.sqlite"),
+        max_bytes=args.cache_size_mb * 1024 * 1024,
+        enabled=not args.no_cache,
+        refresh=args.refresh
+    )
+
+    # 初始化 MCP 客戶端（常駐連線，整個批改過程共用同一組伺服器）
+    async with MCPToolClient("tools/mcp_tools.py", pool_size=args.mcp_pool_size,
+                             tool_cache_path=os.path.join(current_dir, ".cache", "tool_schema.json")) as mcp_client:
+        await grade_all_students(args, model, mcp_client, homework_zip_file, unzip_target_dir, cache, runs)
+
+    model.close()
+    analyzer.close()
+    sandbox.close()
+    print(cache.summary())
+    cache.close()
+    if runs.archive is not None:
+        print(runs.summary())
+    runs.close()
+    print(tracer.summary())
+    tracer.close()
+
+    print("\n--- 所有作業已評分完畢 ---")
+
+def print_failures(runs: RunManifest, archive: str = None) -> None:
+    """列出執行紀錄中尚未完成的學生（--list-failures），不需要讀取任何學生資料夾"""
+    rows = runs.failures(archive)
+    if not rows:
+        print("沒有未完成或失敗的學生")
+        return
+    for row in rows:
+        print(f"{row['archive']}  {row['student']}  狀態 {row['status']}  嘗試 {row['attempts']} 次  {row['error'] or ''}")
+
+def plan_students(args, model: AgentBase, homework_zip_file: str, runs: RunManifest = None) -> Optional[set]:
+    """
+    在執行紀錄中登記這次的作業與每位學生的內容雜湊（只讀取 zip 的中央目錄）。
+    --incremental 時回傳需要批改的學生資料夾名稱，None 表示全部批改。
+    """
+    if runs is None:
+        return None
+    try:
+        fingerprints = fingerprint_class_archive(homework_zip_file)
+    except Exception as e:
+        print(f"無法讀取作業壓縮檔的檔案清單：{e}")
+        fingerprints = {}
+    runs.begin(os.path.basename(homework_zip_file), fingerprints, SYSTEM_PROMPT, model.cache_identity())
+    if not getattr(args, "incremental", False):
+        return None
+    todo = runs.plan()
+    print(f"增量評分：{len(todo)} / {len(fingerprints)} 位學生需要批改（新的、內容改變、上次未完成或評分標準/模型改變）")
+    return todo
+
+def discard_stale_report(student_folder_path: str) -> None:
+    """增量評分時，需要重新批改的學生若留有舊的評分報告（例如重新繳交），先刪除以免被當成已批改"""
+    report = os.path.join(student_folder_path, "grading_report.txt")
+    if os.path.exists(report):
+        print(f"刪除過期的評分報告：{report}")
+        os.remove(report)
+
+async def grade_all_students(args, model: AgentBase, mcp_client: MCPToolClient, homework_zip_file: str, unzip_target_dir: str, cache: GradingCache = None, runs: RunManifest = None) -> None:
+    """解壓縮作業並評分每位學生"""
+    # 先判斷是否有需要批改的學生，沒有時不必查詢工具或建立模型的前綴快取
+    todo = plan_students(args, model, homework_zip_file, runs)
+    if todo is not None and not todo:
+        print("所有學生的評分都是最新的，不需要重新批改")
+        return
+    # 獲取可用工具列表（依 tools/mcp_tools.py 的雜湊值快取在 .cache/tool_schema.json）
     tools = await mcp_client.list_available_tools()
     model.set_tools(tools)
-    
-    # 初始動作：解壓縮作業
-    result = await mcp_client.call_tool("unzip_folder", {
-        "source_path": homework_zip_file,
-        "target_path": unzip_target_dir
-    })
-    print(result)
-    
-    if "錯誤" in result:
+    model.set_system_prompt(SYSTEM_PROMPT)
+    # 在每台 Ollama 主機預先載入模型，第一位學生不必等待模型載入
+    await model.warm_up()
+
+    if args.in_memory:
+        await grade_all_in_memory(args, model, mcp_client, homework_zip_file, unzip_target_dir, cache, runs, todo)
+        return
+
+    # 初始動作：解壓縮作業，並以行程池同時把每位學生繳交的巢狀壓縮檔就地展開，
+    # 讓模型只需要看到程式碼，不必再花一次生成來決定解壓縮路徑
+    with tracer.span("extract", archive=os.path.basename(homework_zip_file)) as span:
+        manifest = await asyncio.to_thread(
+            extract_class, homework_zip_file, unzip_target_dir,
+            recursive=args.archive_depth > 0, max_depth=args.archive_depth,
+            workers=getattr(args, "extract_workers", 0), limits=make_extract_limits(args)
+        )
+        span.set(students=len(manifest.students), workers=manifest.workers, failed=len(manifest.failures()),
+                 skipped=manifest.skipped_count + sum(student.skipped_count for student in manifest.students))
+        if manifest.error:
+            span.status = "error"
+    print(manifest.summary())
+    if manifest.error:
         return # 如果解壓縮失敗，就直接結束
 
-    # 獲取解壓縮後的目錄
-    main_homework_folder = unzip_target_dir
-    if not os.path.isdir(main_homework_folder):
-        print(f"[錯誤] 解壓縮目錄不存在: {main_homework_folder}")
+    # 獲取解壓縮後的目錄（外層資料夾已經略過）
+    main_homework_folder = manifest.root
+    for student in manifest.failures():
+        # 學生的壓縮檔無法解壓縮，不必交給模型
+        if runs is not None and (todo is None or student.name in todo):
+            runs.start(student.name, "failed")
+            runs.finish(student.name, "failed", student.seconds, error="\n".join(student.errors))
+
+    entries = [os.path.basename(student.path) for student in manifest.students if not student.failed]
+    if todo is not None:
+        # 只批改新的或改變的學生。解壓縮後的學生資料夾名稱可能包含句點（例如「114B30007_Y. HORINOUCHI」），
+        # 直接以資料夾名稱比對；只有未展開的學生壓縮檔（--archive-depth 0）才去掉副檔名
+        def student_name(entry: str) -> str:
+            return entry if os.path.isdir(os.path.join(main_homework_folder, entry)) else os.path.splitext(entry)[0]
+
+        entries = [name for name in entries if student_name(name) in todo]
+        for name in entries:
+            discard_stale_report(os.path.join(main_homework_folder, student_name(name)))
+    states = {}
+    if getattr(args, "batch_size", 1) > 1 or getattr(args, "dedupe", False):
+        for name in entries:
+            path = os.path.join(main_homework_folder, name)
+            if os.path.isdir(path):
+                states[name] = make_student_state(path, args)
+    # 近似重複的學生等代表作業評分完後才以差異模式評分
+    followers = {}
+    if getattr(args, "dedupe", False):
+        followers = await find_near_duplicates(states, args, homework_zip_file)
+    if getattr(args, "batch_size", 1) > 1:
+        await grade_in_batches([(state.student_folder_path, state) for name, state in states.items() if name not in followers],
+                               model, mcp_client, cache, args, runs)
+
+    # 同時批改多位學生，以 semaphore 限制同時進行的數量；批次評分已寫出報告的學生會直接跳過
+    semaphore = asyncio.Semaphore(max(1, args.concurrency))
+
+    async def worker(student_dir_name: str) -> None:
+        async with semaphore:
+            await grade_student_entry(main_homework_folder, student_dir_name, model, mcp_client, cache, args, states.get(student_dir_name), runs)
+
+    await asyncio.gather(*[worker(name) for name in entries if name not in followers])
+    if followers:
+        attach_references(followers, states)
+        await asyncio.gather(*[worker(name) for name in entries if name in followers])
+
+def make_extract_limits(args=None) -> ExtractLimits:
+    return ExtractLimits(
+        max_total_mb=getattr(args, "extract_max_mb", 512),
+        max_members=getattr(args, "extract_max_members", 5000),
+        max_ratio=getattr(args, "extract_max_ratio", 200),
+        max_class_mb=getattr(args, "class_max_mb", 8192)
+    )
+
+def make_collector(args=None) -> FileCollector:
+    return FileCollector(
+        max_file_bytes=getattr(args, "max_file_kb", 256) * 1024,
+        max_total_bytes=getattr(args, "max_submission_kb", 2048) * 1024
+    )
+
+def make_student_state(student_folder_path: str, args=None) -> StudentState:
+    """依命令列參數建立單一學生的批改狀態"""
+    return StudentState(
+        student_folder_path,
+        save_transcript=getattr(args, "save_transcripts", False),
+        max_history_tokens=getattr(args, "history_tokens", 4096),
+        prompt_builder=PromptBuilder(
+            max_tokens=getattr(args, "prompt_tokens", 12000),
+            max_file_tokens=getattr(args, "file_tokens", 4000)
+        ),
+        collector=make_collector(args),
+        tests=load_test_suite(args.test_cases) if getattr(args, "run_tests", False) else None,
+        structured=getattr(args, "structured", False),
+        max_test_runs=getattr(args, "max_test_runs", 3)
+    )
+
+async def grade_student_folder(student_folder_path: str, model: AgentBase, mcp_client: MCPToolClient, state: StudentState, cache: GradingCache = None, runs: RunManifest = None) -> None:
+    """評分單一學生，模型要求解壓縮 (KEEP) 時以同一份狀態繼續評分，並把結果寫入執行紀錄"""
+    student = os.path.basename(os.path.normpath(student_folder_path))
+    report_path = os.path.join(student_folder_path, "grading_report.txt")
+    already_graded = os.path.exists(report_path)
+    if runs is not None and not already_graded:
+        extraction = "extracted"
+        if state.archive_errors is not None:
+            extraction = "in_memory_partial" if state.archive_errors else "in_memory"
+        runs.start(student, extraction)
+    started = time.perf_counter()
+    with tracer.span("student"):
+        result = await grade_single_student(student_folder_path, model, mcp_client, state, cache)
+        while result == 'KEEP':
+            result = await grade_single_student(student_folder_path, model, mcp_client, state, cache)
+        if result == 'STOP':
+            print(f"{student_folder_path}作業批改完畢。")
+        else:
+            print(f"[錯誤] 無法處理學生作業: {os.path.basename(student_folder_path)} {result}")
+    if runs is None:
         return
+    if already_graded:
+        runs.finish(student, "done", report_path=report_path)
+    elif os.path.exists(report_path):
+        runs.finish(student, "done", time.perf_counter() - started, state.usage, _as_score(state.score), report_path)
+    else:
+        runs.finish(student, "failed", time.perf_counter() - started, state.usage,
+                    error=result if result != 'STOP' else "沒有產生評分報告")
 
-    if len(os.listdir(main_homework_folder))<=1:
-        while len(os.listdir(main_homework_folder))<=1:
-            main_homework_folder = os.path.join(main_homework_folder, os.listdir(main_homework_folder)[0])
-        print(main_homework_folder)
-
-    # 遍歷所有學生資料夾
-    for student_dir_name in os.listdir(main_homework_folder):
-        print(f"\n--- 處理學生資料夾: {student_dir_name} ---")
-        with open(chat_history, 'w', encoding='utf-8') as f:
-            f.write("")
-        student_folder_path = os.path.join(main_homework_folder, student_dir_name)
-        # 如果是目錄，直接處理
-        if os.path.isdir(student_folder_path):
-            result = ""
-            result = await grade_single_student(student_folder_path, model, mcp_client)
-            if result == 'STOP':
-                print(f"{student_folder_path}作業批改完畢。")
-                continue
-            elif result != 'KEEP':
-                print(f"[錯誤] 無法處理學生作業: {student_dir_name} {result}")
-                continue
-            while result == 'STOP' or result == 'KEEP':
-                result = await grade_single_student(student_folder_path, model, mcp_client)
-                if result == 'STOP':
-                    print(f"{student_folder_path}作業批改完畢。")
-                    break
-            # else:
-            #     print(f"[錯誤] 無法處理學生作業: {student_dir_name} {result}")
-            # print(f"{student_folder_path}作業批改完畢。")
-        # 如果是壓縮檔，先解壓縮再處理
-        elif student_dir_name.endswith(('.zip', '.rar')):
-            nested_zip_path = student_folder_path
-            nested_extract_dir = os.path.splitext(student_folder_path)[0]
-            nested_result = await mcp_client.call_tool("unzip_folder", {
-                "source_path": nested_zip_path,
-                "target_path": nested_extract_dir
-            })
-            if "成功" in nested_result:
-                result = await grade_single_student(nested_extract_dir, model, mcp_client)
-            else:
-                print(f"[錯誤] 無法解壓縮學生作業: {student_dir_name}")
-                print(nested_result)
-            
-    print("\n--- 所有作業已評分完畢 ---")
+def _as_score(value) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
 
-if __name__ == "__main__":
+def student_tag(student_folder_path: str) -> str:
+    """追蹤記錄中代表學生的標籤：資料夾名稱中的學號"""
+    return os.path.basename(os.path.normpath(student_folder_path)).split("_", 1)[0]
+
+async def grade_student_entry(main_homework_folder: str, student_dir_name: str, model: AgentBase, mcp_client: MCPToolClient, cache: GradingCache = None, args=None, state: StudentState = None, runs: RunManifest = None) -> None:
+    """處理作業目錄下的單一項目（學生資料夾或學生壓縮檔），每位學生各自擁有獨立的狀態"""
+    print(f"\n--- 處理學生資料夾: {student_dir_name} ---")
+    student_folder_path = os.path.join(main_homework_folder, student_dir_name)
+    # 每個學生在各自的 asyncio 任務中執行，設定的學號只影響這位學生的追蹤記錄
+    current_student.set(student_tag(os.path.splitext(student_folder_path)[0]))
+    # 如果是目錄，直接處理
+    if os.path.isdir(student_folder_path):
+        await grade_student_folder(student_folder_path, model, mcp_client, state or make_student_state(student_folder_path, args), cache, runs)
+    # 如果是壓縮檔，先解壓縮再處理
+    elif student_dir_name.endswith(('.zip', '.rar')):
+        nested_zip_path = student_folder_path
+        nested_extract_dir = os.path.splitext(student_folder_path)[0]
+        nested_result = tool_result_text(await mcp_client.call_tool("unzip_folder", {
+            "source_path": nested_zip_path,
+            "target_path": nested_extract_dir,
+            "recursive": True
+        }))
+        if "成功" in nested_result:
+            await grade_student_folder(nested_extract_dir, model, mcp_client, make_student_state(nested_extract_dir, args), cache, runs)
+        else:
+            print(f"[錯誤] 無法解壓縮學生作業: {student_dir_name}")
+            print(nested_result)
+            if runs is not None:
+                runs.start(os.path.basename(nested_extract_dir), "failed")
+                runs.finish(os.path.basename(nested_extract_dir), "failed", error=nested_result)
+
+async def grade_all_in_memory(args, model: AgentBase, mcp_client: MCPToolClient, homework_zip_file: str, unzip_target_dir: str, cache: GradingCache = None, runs: RunManifest = None, todo: set = None) -> None:
+    """
+    虛擬檔案系統模式：直接在記憶體中讀取班級壓縮檔與學生的巢狀壓縮檔，
+    只有 grading_report.txt 會寫到 unzip_target_dir/<學生資料夾>/ 底下
+    """
+    reader = ArchiveReader(lambda: make_collector(args), max_depth=args.archive_depth, limits=make_extract_limits(args))
+    try:
+        with tracer.span("extract", archive=os.path.basename(homework_zip_file), in_memory=True):
+            submissions = await asyncio.to_thread(reader.read_class_archive, homework_zip_file, unzip_target_dir)
+    except Exception as e:
+        print(f"[錯誤] 無法讀取作業壓縮檔：{e}")
+        return
+    print(f"已從壓縮檔讀取 {len(submissions)} 位學生的作業（未解壓縮到磁碟）")
+
+    if todo is not None:
+        submissions = [(submission, collector) for submission, collector in submissions if submission.name in todo]
+        for submission, _ in submissions:
+            discard_stale_report(submission.manifest.root)
+    states = []
+    for submission, collector in submissions:
+        state = make_student_state(submission.manifest.root, args)
+        state.collector = collector
+        state.manifest = submission.manifest
+        state.archive_errors = submission.errors
+        states.append((submission, state))
+    followers = {}
+    if getattr(args, "dedupe", False):
+        followers = await find_near_duplicates({submission.name: state for submission, state in states}, args, homework_zip_file)
+    if getattr(args, "batch_size", 1) > 1:
+        await grade_in_batches([(state.student_folder_path, state) for submission, state in states if submission.name not in followers],
+                               model, mcp_client, cache, args, runs)
+
+    semaphore = asyncio.Semaphore(max(1, args.concurrency))
+
+    async def worker(submission: VirtualSubmission, state: StudentState) -> None:
+        async with semaphore:
+            print(f"\n--- 處理學生資料夾: {submission.name} ---")
+            current_student.set(student_tag(submission.name))
+            for error in submission.errors:
+                print(f"[警告] {error}")
+            await grade_student_folder(submission.manifest.root, model, mcp_client, state, cache, runs)
+
+    await asyncio.gather(*[worker(submission, state) for submission, state in states if submission.name not in followers])
+    if followers:
+        attach_references(followers, {submission.name: state for submission, state in states})
+        await asyncio.gather(*[worker(submission, state) for submission, state in states if submission.name in followers])
+
+def compute_signatures(states: dict, hasher: MinHasher) -> dict:
+    """收集每位學生的程式碼並計算 MinHash 簽章；沒有程式碼的學生（例如還需要解壓縮）不列入"""
+    signatures = {}
+    for name, state in states.items():
+        if state.manifest is None:
+            state.manifest = state.collector.collect(state.student_folder_path)
+        signature = hasher.signature(state.manifest.source_files())
+        if signature is not None:
+            signatures[name] = signature
+    return signatures
+
+async def find_near_duplicates(states: dict, args, homework_zip_file: str) -> dict:
+    """
+    --dedupe：以 MinHash/LSH 找出只有空白、註解或變數名稱不同的近似重複作業。
+    每組只有代表作業完整評分，回傳其餘學生的 {資料夾名稱: (代表作業資料夾名稱, 相似度)}，之後以差異模式評分。
+    相似群組與索引中其他壓縮檔（之前學期或其他班級）的相似作業寫到 logs/similarity_report.json，可作為抄襲的參考訊號。
+    """
+    hasher = MinHasher()
+    archive = os.path.basename(homework_zip_file)
+    threshold = args.similarity_threshold
+    with tracer.span("similarity", students=len(states)) as span:
+        signatures = await asyncio.to_thread(compute_signatures, states, hasher)
+        index = SimilarityIndex(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "similarity_index.sqlite"), hasher.params)
+        try:
+            clusters = cluster_signatures(signatures, threshold)
+            cross_matches = index.cross_matches(archive, signatures, threshold)
+            index.store(archive, signatures)
+        finally:
+            index.close()
+        followers = {member: (cluster.representative, score) for cluster in clusters for member, score in cluster.members.items()}
+        span.set(clusters=len(clusters), followers=len(followers), cross_archive=len(cross_matches))
+    report_path = os.path.join(log_dir, "similarity_report.json")
+    write_report(report_path, threshold, clusters, cross_matches)
+    print(f"相似作業：{len(clusters)} 組，{len(followers)} 位學生改為與代表作業比對差異；"
+          f"與其他壓縮檔相似的作業 {len(cross_matches)} 筆，詳見 {report_path}")
+    return followers
+
+def attach_references(followers: dict, states: dict) -> None:
+    """
+    代表作業評分完後，把它的評分報告與程式碼差異交給近似重複的學生。
+    代表作業沒有評分報告或差異太大（超過提示預算的一半）時，該學生改為完整評分。
+    """
+    for name, (leader, similarity) in followers.items():
+        state, leader_state = states[name], states[leader]
+        report_path = os.path.join(leader_state.student_folder_path, "grading_report.txt")
+        if not os.path.exists(report_path) or state.manifest is None or leader_state.manifest is None:
+            print(f"{name} 的代表作業 {leader} 沒有評分報告，改為完整評分")
+            continue
+        diff = source_diff(leader_state.manifest.source_files(), state.manifest.source_files())
+        if estimate_tokens(diff) > state.prompt_builder.max_tokens // 2:
+            print(f"{name} 與代表作業 {leader} 的差異太大，改為完整評分")
+            continue
+        with open(report_path, 'r', encoding='utf-8') as f:
+            report = f.read()
+        state.reference = {"student": leader, "similarity": similarity, "report": report, "diff": diff}
+
+async def prepare_batch_item(student_folder_path: str, model: AgentBase, state: StudentState, cache: GradingCache = None, max_tokens: int = 4000) -> Optional[BatchItem]:
+    """
+    建立批次評分的項目。只有資料夾名稱正確、尚未有評分報告、有程式碼且評分快取未命中的學生才適合批次評分，
+    其餘學生回傳 None，交給一般流程處理（解壓縮、快取重播或錯誤報告）。
+    提示與單獨評分一樣附上本機檢查的事實，快取鍵也相同，兩條路徑可以共用評分快取。
+    """
+    folder_name = os.path.basename(student_folder_path)
+    output_path = os.path.join(student_folder_path, "grading_report.txt")
+    if "_" not in folder_name or os.path.exists(output_path):
+        return None
+    if state.manifest is None:
+        state.manifest = state.collector.collect(student_folder_path)
+    manifest = state.manifest
+    if not manifest.has_code or zero_score_reason(manifest, state.archive_errors) is not None:
+        return None
+    facts = await collect_facts(state, manifest)
+    cache_key = None
+    if cache is not None:
+        cache_key = make_cache_key(manifest.source_files(), SYSTEM_PROMPT, model.cache_identity(), "full", facts)
+        if cache.contains(cache_key):
+            return None
+    student_id, student_name = folder_name.split("_", 1)
+    builder = PromptBuilder(max_tokens=max_tokens, max_file_tokens=min(state.prompt_builder.max_file_tokens, max_tokens))
+    built = builder.build(student_id, student_name, manifest.file_structure(), manifest.grouped(), None, facts=facts)
+    return BatchItem(student_id, student_name, output_path, built, cache_key)
+
+async def write_batch_results(batch: list, response, mcp_client: MCPToolClient, cache: GradingCache = None, runs: RunManifest = None, latency: float = None) -> None:
+    """把批次回應中每位學生的評分各自寫成評分報告；缺少或格式錯誤的學生留給一般流程單獨評分"""
+    records = parse_batch_response(response, [item for item, _ in batch])
+    for item, state in batch:
+        current_student.set(item.student_id)
+        record = records.get(item.student_id)
+        if record is None:
+            print(f"{item.student_id} 的批次評分結果缺少或格式錯誤，改為單獨評分")
+            continue
+        state.conversation.add_user(item.prompt.text)
+        state.conversation.add_assistant("", [{"tool": "write_grading_report", "parameters": record}])
+        await state.call_tool(mcp_client, "write_grading_report", record)
+        if cache is not None and item.cache_key is not None:
+            cache.put(item.cache_key, dict(record))
+        if runs is not None:
+            student = os.path.basename(os.path.dirname(item.output_path))
+            runs.start(student, "in_memory" if state.archive_errors is not None else "extracted")
+            runs.finish(student, "done", latency, score=_as_score(record.get("score")), report_path=item.output_path)
+        await state.save()
+
+async def grade_in_batches(students: list, model: AgentBase, mcp_client: MCPToolClient, cache: GradingCache = None, args=None, runs: RunManifest = None) -> None:
+    """
+    批次評分：把 --batch-size 位學生的程式碼放進同一個請求，每個請求只需負擔一次固定開銷。
+    回應是每位學生一筆的評分紀錄，各自驗證後寫成評分報告；沒有寫出報告的學生之後由一般流程單獨評分。
+    """
+    batch_size = args.batch_size
+    # 每位學生分到的提示預算，所有學生合起來不超過 --prompt-tokens
+    max_tokens = max(args.prompt_tokens // batch_size, 1000)
+    async def prepare(student_folder_path: str, state: StudentState):
+        # gather 為每個協程建立各自的 Task 與 context，不需要重設 current_student
+        current_student.set(student_tag(student_folder_path))
+        return await prepare_batch_item(student_folder_path, model, state, cache, max_tokens), state
+
+    # 靜態檢查與沙箱測試在行程池與沙箱中同時進行
+    prepared = await asyncio.gather(*[prepare(student_folder_path, state) for student_folder_path, state in students])
+    items = [(item, state) for item, state in prepared if item is not None]
+    batches = [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+    if not batches:
+        return
+    print(f"批次評分：{len(items)} 位學生，共 {len(batches)} 個請求")
+
+    if getattr(args, "batch_job", False):
+        prompts = [build_batch_prompt([item for item, _ in batch]) for batch in batches]
+        try:
+            responses = await asyncio.to_thread(model.run_batch_job, prompts)
+        except Exception as e:
+            print(f"離線批次工作失敗，改為即時批次評分：{e}")
+        else:
+            for batch, response in zip(batches, responses):
+                if response is not None:
+                    await write_batch_results(batch, response, mcp_client, cache, runs)
+            return
+
+    if isinstance(model, CascadeAgent):
+        # 批次回應沒有信心分數可以判斷，直接使用大模型
+        model = model.large
+    semaphore = asyncio.Semaphore(max(1, args.concurrency))
+
+    async def worker(batch: list) -> None:
+        async with semaphore:
+            prompt = build_batch_prompt([item for item, _ in batch])
+            print(f"批次評分中：{', '.join(item.student_id for item, _ in batch)}")
+            started = time.perf_counter()
+            try:
+                with tracer.span("model", backend=type(model).__name__, batch=len(batch),
+                                 students=[item.student_id for item, _ in batch]) as span:
+                    response = await model.agenerate_text(prompt, {"history": []})
+                    if isinstance(response, dict):
+                        span.set(**response.get("usage") or {})
+            except Exception as e:
+                print(f"批次評分失敗，改為單獨評分：{e}")
+                return
+            await write_batch_results(batch, response, mcp_client, cache, runs, time.perf_counter() - started)
+
+    await asyncio.gather(*[worker(batch) for batch in batches])
+
+def build_parser() -> argparse.ArgumentParser:
+    """命令列參數；benchmarks/ 也用它取得與 CLI 相同的預設值"""
     parser = argparse.ArgumentParser(description="C語言助教 (Gemini/Ollama)")
     parser.add_argument(
         "-z", "--zip", 
@@ -286,5 +810,209 @@ if __name__ == "__main__":
         default="gemini",
         help="選擇使用的 AI 模型 (預設: gemini)"
     )
-    args = parser.parse_args()
-    asyncio.run(main(args))
\ No newline at end of file
+    parser.add_argument(
+        "-o", "--output-dir",
+        default=None,
+        help="解壓縮與評分報告的目錄 (預設: assignments/graded_homework)"
+    )
+    parser.add_argument(
+        "--mcp-pool-size",
+        type=int,
+        default=1,
+        help="常駐 MCP 工具伺服器的連線數量，工具呼叫通常只需數毫秒，一般不需調高 (預設: 1)"
+    )
+    parser.add_argument(
+        "--archive-depth",
+        type=int,
+        default=3,
+        help="解壓縮作業後自動展開巢狀壓縮檔的最大層數，0 表示交給模型決定 (預設: 3)"
+    )
+    parser.add_argument(
+        "--extract-workers",
+        type=int,
+        default=0,
+        help="同時解壓縮學生壓縮檔的行程數量，0 表示依 CPU 數量決定，1 表示依序解壓縮 (預設: 0)"
+    )
+    parser.add_argument(
+        "--extract-max-mb",
+        type=int,
+        default=512,
+        help="每位學生（包含巢狀壓縮檔）解壓縮後的總大小上限 (MB)，超過的檔案略過 (預設: 512)"
+    )
+    parser.add_argument(
+        "--extract-max-members",
+        type=int,
+        default=5000,
+        help="每位學生最多解壓縮的檔案數量 (預設: 5000)"
+    )
+    parser.add_argument(
+        "--extract-max-ratio",
+        type=float,
+        default=200,
+        help="超過 1 MB 的檔案壓縮比高於此值時視為壓縮炸彈並略過 (預設: 200)"
+    )
+    parser.add_argument(
+        "--class-max-mb",
+        type=int,
+        default=8192,
+        help="班級壓縮檔本身解壓縮後的總大小上限 (MB) (預設: 8192)"
+    )
+    parser.add_argument(
+        "--in-memory",
+        action="store_true",
+        help="直接在記憶體中讀取壓縮檔評分，不解壓縮到磁碟，只寫出 grading_report.txt"
+    )
+    parser.add_argument(
+        "-c", "--concurrency",
+        type=int,
+        default=1,
+        help="同時批改的學生數量 (預設: 1，即依序批改)"
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=1,
+        help="每個請求同時評分的學生數量，大於 1 時啟用批次評分，格式錯誤的學生會改為單獨評分 (預設: 1)"
+    )
+    parser.add_argument(
+        "--batch-job",
+        action="store_true",
+        help="批次評分改用 Gemini 離線批次工作（費用較低但需等待工作完成）"
+    )
+    parser.add_argument(
+        "--history-tokens",
+        type=int,
+        default=4096,
+        help="每位學生傳給模型的對話歷史 token 上限，超過時較早的對話會被摘要 (預設: 4096)"
+    )
+    parser.add_argument(
+        "--prompt-tokens",
+        type=int,
+        default=12000,
+        help="每位學生提示（不含評分標準）的 token 預算 (預設: 12000)"
+    )
+    parser.add_argument(
+        "--file-tokens",
+        type=int,
+        default=4000,
+        help="單一程式碼檔案的 token 上限，超過時保留開頭與結尾並標記省略的行 (預設: 4000)"
+    )
+    parser.add_argument(
+        "--max-file-kb",
+        type=int,
+        default=256,
+        help="單一文字檔最多讀取的大小 (KB)，超過的部分不讀取 (預設: 256)"
+    )
+    parser.add_argument(
+        "--max-submission-kb",
+        type=int,
+        default=2048,
+        help="每位學生作業最多讀取的文字總量 (KB) (預設: 2048)"
+    )
+    parser.add_argument(
+        "--cascade",
+        default="",
+        help="分級評分的小模型，格式為 後端:模型名稱，例如 ollama:qwen3:4b 或 gemini:gemini-2.5-flash-lite；"
+             "小模型信心不足、工具調用格式錯誤或分數接近界線時才交給 --model 的大模型"
+    )
+    parser.add_argument(
+        "--cascade-confidence",
+        type=float,
+        default=0.7,
+        help="分級評分時小模型的信心低於此值就交給大模型 (預設: 0.7)"
+    )
+    parser.add_argument(
+        "--cascade-boundaries",
+        default="60",
+        help="分數界線，以逗號分隔，小模型的分數距離界線不超過 --cascade-margin 時交給大模型 (預設: 60)"
+    )
+    parser.add_argument(
+        "--cascade-margin",
+        type=float,
+        default=5,
+        help="分數界線的範圍 (預設: 5)"
+    )
+    parser.add_argument(
+        "--structured",
+        action="store_true",
+        help="有程式碼的學生以結構化輸出（Gemini response_schema / Ollama format=）直接產生評分紀錄，在本機寫出評分報告，不經過工具調用"
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="以串流方式生成，收到完整的評分或解壓縮工具調用就停止生成，不等模型輸出剩下的文字"
+    )
+    parser.add_argument(
+        "--max-thinking-tokens",
+        type=int,
+        default=0,
+        help="串流時 thinking 的 token 上限，超過時改為不使用 thinking 重新生成，0 表示不限制；只適用於 Ollama (預設: 0)"
+    )
+    parser.add_argument(
+        "--run-tests",
+        action="store_true",
+        help="在沙箱中以作業定義的測試輸入實際執行學生的 Python 程式，並把結果提供給模型"
+    )
+    parser.add_argument(
+        "--max-test-runs",
+        type=int,
+        default=3,
+        help="每位學生最多讓模型調用 run_python_tests 的次數，超過時停止評分並寫出需要人工複查的報告 (預設: 3)"
+    )
+    parser.add_argument(
+        "--test-cases",
+        default=os.path.join(prompt_dir, "test_cases_python.json"),
+        help="作業的測試定義 (預設: prompt/test_cases_python.json)"
+    )
+    parser.add_argument(
+        "--dedupe",
+        action="store_true",
+        help="以 MinHash/LSH 找出近似重複的作業，每組只完整評分一份，其餘學生只比對差異；相似群組寫到 logs/similarity_report.json"
+    )
+    parser.add_argument(
+        "--similarity-threshold",
+        type=float,
+        default=0.9,
+        help="--dedupe 判定為近似重複的相似度（程式碼 token 的 Jaccard 相似度估計值）(預設: 0.9)"
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="依執行紀錄 (.cache/run_manifest.sqlite) 只批改新的、內容改變、上次中斷或失敗的學生"
+    )
+    parser.add_argument(
+        "--list-failures",
+        action="store_true",
+        help="列出執行紀錄中尚未完成或失敗的學生後結束"
+    )
+    parser.add_argument(
+        "--trace",
+        default=None,
+        help="將各階段的追蹤記錄（span）寫成 JSONL 檔案，例如 logs/trace.jsonl"
+    )
+    parser.add_argument(
+        "--save-transcripts",
+        action="store_true",
+        help="將每位學生的對話記錄寫到 logs/<學生資料夾>/transcript.json"
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="停用評分快取，每位學生都重新呼叫模型"
+    )
+    parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="忽略已快取的評分結果並重新評分，新的結果仍會寫入快取"
+    )
+    parser.add_argument(
+        "--cache-size-mb",
+        type=int,
+        default=64,
+        help="評分快取的大小上限，超過時淘汰最久未使用的項目 (預設: 64)"
+    )
+    return parser
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    asyncio.run(main(args))
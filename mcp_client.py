@@ -1,34 +1,299 @@
-# mcp_client.py  
-import asyncio  
-from mcp import ClientSession, StdioServerParameters  
-from mcp.client.stdio import stdio_client  
-
-class MCPToolClient:  
-    def __init__(self, server_script_path: str):  
-        self.server_params = StdioServerParameters(  
-            command="python",  
-            args=[server_script_path],  
-            env=None,  
-        )  
-        self.chat_history = 'chat_history.txt' 
-      
-    async def call_tool(self, tool_name: str, arguments: dict):  
-        """调用MCP工具"""  
-        async with stdio_client(self.server_params) as (read, write):  
-            async with ClientSession(read, write) as session:  
-                # 初始化连接  
-                await session.initialize()  
-                  
-                # 调用工具  
-                result = await session.call_tool(tool_name, arguments)  
-                with open(self.chat_history, 'a', encoding='utf-8') as f:  
-                    f.write(f"\n工具調用結果:\n{result}\n")
-                return result  
-      
-    async def list_available_tools(self):  
-        """获取可用工具列表"""  
-        async with stdio_client(self.server_params) as (read, write):  
-            async with ClientSession(read, write) as session:  
-                await session.initialize()  
-                tools = await session.list_tools()  
-                return tools.tools
\ No newline at end of file
+# mcp_client.py
+import asyncio
+import hashlib
+import json
+import os
+import time
+from importlib import metadata
+from typing import Optional
+import anyio
+from tracing import tracer
+
+# mcp 套件約需 0.6 秒才能匯入完成，只在真的要啟動伺服器或呼叫工具時才匯入（python main.py --help 不需要）
+
+# 代表伺服器已經結束、需要重新啟動的例外
+_CONNECTION_ERRORS = (
+    anyio.ClosedResourceError,
+    anyio.BrokenResourceError,
+    anyio.EndOfStream,
+    ConnectionError,
+    EOFError,
+)
+
+
+def _is_connection_error(e: BaseException) -> bool:
+    from mcp.shared.exceptions import McpError
+    from mcp.types import CONNECTION_CLOSED
+
+    if isinstance(e, McpError):
+        return e.error.code == CONNECTION_CLOSED
+    return isinstance(e, _CONNECTION_ERRORS)
+
+
+def tool_result_text(result) -> str:
+    """取出工具調用結果 (CallToolResult) 中的文字內容"""
+    if isinstance(result, str):
+        return result
+    return "\n".join(getattr(content, "text", "") for content in getattr(result, "content", []) or [])
+
+
+class _PooledSession:
+    """
+    一個常駐的 MCP 伺服器連線。
+
+    stdio_client / ClientSession 的 context manager 必須在同一個 task 中進入與離開，
+    因此每個連線都由專屬的背景 task 持有，其他 task 只透過 self.session 呼叫工具。
+    """
+
+    def __init__(self, server_params: "StdioServerParameters"):
+        self.server_params = server_params
+        self.session: Optional["ClientSession"] = None
+        self.startup_time = 0.0
+        self._task: Optional[asyncio.Task] = None
+        self._ready = asyncio.Event()
+        self._closing = asyncio.Event()
+        self._error: Optional[BaseException] = None
+
+    @property
+    def alive(self) -> bool:
+        return self.session is not None and self._task is not None and not self._task.done()
+
+    async def _run(self):
+        from mcp import ClientSession
+        from mcp.client.stdio import stdio_client
+
+        try:
+            async with stdio_client(self.server_params) as (read, write):
+                async with ClientSession(read, write) as session:
+                    await session.initialize()
+                    self.session = session
+                    self._ready.set()
+                    await self._closing.wait()
+        except Exception as e:
+            self._error = e
+        finally:
+            self.session = None
+            self._ready.set()
+
+    async def start(self):
+        """啟動伺服器並完成 MCP 握手，回傳花費的秒數"""
+        self._ready = asyncio.Event()
+        self._closing = asyncio.Event()
+        self._error = None
+        start = time.perf_counter()
+        self._task = asyncio.create_task(self._run())
+        await self._ready.wait()
+        if self.session is None:
+            raise RuntimeError(f"MCP 伺服器啟動失敗：{self._error}")
+        self.startup_time = time.perf_counter() - start
+        return self.startup_time
+
+    async def close(self):
+        if self._task is None:
+            return
+        self._closing.set()
+        try:
+            await self._task
+        except Exception:
+            pass
+        self._task = None
+        self.session = None
+
+    async def restart(self):
+        await self.close()
+        return await self.start()
+
+
+class MCPToolClient:
+    """
+    MCP 工具客戶端。
+
+    直接呼叫 call_tool 時，每次都會啟動一個新的 tools/mcp_tools.py 子行程（舊行為）。
+    以 `async with MCPToolClient(...) as client:` 使用時，第一次呼叫工具時才啟動 pool_size 個常駐連線，
+    之後所有呼叫都重複使用這些連線；伺服器若中途結束會自動重新啟動。
+    指定 tool_cache_path 時，工具定義依伺服器程式的雜湊值快取在磁碟上，list_available_tools 不需要啟動伺服器。
+    """
+
+    def __init__(self, server_script_path: str, pool_size: int = 1, tool_cache_path: Optional[str] = None):
+        self.server_script_path = server_script_path
+        self.tool_cache_path = tool_cache_path
+        self._server_params = None
+        self.pool_size = max(1, pool_size)
+        self._sessions: list[_PooledSession] = []
+        self._idle: Optional[asyncio.Queue] = None
+        self._pooled = False
+        self._start_lock: Optional[asyncio.Lock] = None
+        # 統計資料，用來估算常駐連線省下的啟動成本
+        self.stats = {"calls": 0, "spawns": 0, "respawns": 0, "spawn_time": 0.0, "call_time": 0.0}
+
+    @property
+    def server_params(self) -> "StdioServerParameters":
+        if self._server_params is None:
+            from mcp import StdioServerParameters
+
+            self._server_params = StdioServerParameters(
+                command="python",
+                args=[self.server_script_path],
+                env=None,
+            )
+        return self._server_params
+
+    async def __aenter__(self):
+        self._pooled = True
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._pooled = False
+        await self.close()
+
+    async def start(self):
+        """啟動連線池"""
+        if self._idle is not None:
+            return
+        self._idle = asyncio.Queue()
+        results = await asyncio.gather(*[self._spawn() for _ in range(self.pool_size)], return_exceptions=True)
+        for session in results:
+            if isinstance(session, BaseException):
+                await self.close()
+                raise session
+            self._idle.put_nowait(session)
+
+    async def close(self):
+        """關閉所有常駐連線並輸出統計"""
+        for session in self._sessions:
+            await session.close()
+        if self._idle is not None and self.stats["calls"]:
+            print(self.overhead_report())
+        self._sessions = []
+        self._idle = None
+
+    async def _spawn(self) -> _PooledSession:
+        session = _PooledSession(self.server_params)
+        self._sessions.append(session)
+        self.stats["spawn_time"] += await session.start()
+        self.stats["spawns"] += 1
+        return session
+
+    def overhead_report(self) -> str:
+        """回報常駐連線相較於每次呼叫都啟動伺服器省下的時間"""
+        spawns = self.stats["spawns"]
+        calls = self.stats["calls"]
+        if not spawns:
+            return "MCP 連線統計：尚未啟動任何伺服器"
+        per_spawn = self.stats["spawn_time"] / spawns
+        saved = per_spawn * max(0, calls - spawns)
+        per_call = self.stats["call_time"] / calls if calls else 0.0
+        return (
+            f"MCP 連線統計：{calls} 次工具呼叫，啟動伺服器 {spawns} 次（重啟 {self.stats['respawns']} 次），"
+            f"每次啟動+握手約 {per_spawn * 1000:.0f} ms，常駐呼叫平均 {per_call * 1000:.0f} ms，"
+            f"估計省下 {saved:.2f} 秒"
+        )
+
+    async def _ensure_started(self):
+        """第一次使用時才啟動連線池；同時有多個呼叫時只啟動一次"""
+        if self._start_lock is None:
+            self._start_lock = asyncio.Lock()
+        async with self._start_lock:
+            await self.start()
+
+    async def _call_pooled(self, method: str, *args):
+        if self._idle is None:
+            await self._ensure_started()
+        session = await self._idle.get()
+        start = time.perf_counter()
+        try:
+            for attempt in range(2):
+                try:
+                    if not session.alive:
+                        self.stats["spawn_time"] += await session.restart()
+                        self.stats["spawns"] += 1
+                        self.stats["respawns"] += 1
+                    return await getattr(session.session, method)(*args)
+                except Exception as e:
+                    # 伺服器已經結束或連線中斷，重新啟動後再試一次
+                    if attempt == 1 or not _is_connection_error(e):
+                        raise
+                    print(f"MCP 伺服器連線中斷，正在重新啟動：{e}")
+                    tracer.event("mcp.retry", method=method, error=str(e)[:300])
+                    await session.close()
+        finally:
+            self.stats["call_time"] += time.perf_counter() - start
+            self._idle.put_nowait(session)
+
+    async def call_tool(self, tool_name: str, arguments: dict):
+        """调用MCP工具"""
+        self.stats["calls"] += 1
+        with tracer.span(f"tool.{tool_name}", pooled=self._pooled) as span:
+            if self._pooled:
+                result = await self._call_pooled("call_tool", tool_name, arguments)
+            else:
+                from mcp import ClientSession
+                from mcp.client.stdio import stdio_client
+
+                async with stdio_client(self.server_params) as (read, write):
+                    async with ClientSession(read, write) as session:
+                        # 初始化连接
+                        await session.initialize()
+
+                        # 调用工具
+                        result = await session.call_tool(tool_name, arguments)
+            if getattr(result, "isError", False):
+                span.status = "error"
+        return result
+
+    def _tool_cache_key(self) -> str:
+        """伺服器程式內容與 mcp 版本的雜湊值；工具的參數或說明改變時快取自動失效"""
+        digest = hashlib.sha256()
+        with open(self.server_script_path, 'rb') as f:
+            digest.update(f.read())
+        try:
+            digest.update(metadata.version("mcp").encode())
+        except metadata.PackageNotFoundError:
+            pass
+        return digest.hexdigest()
+
+    def _load_cached_tools(self) -> Optional[list]:
+        if not self.tool_cache_path or not os.path.exists(self.tool_cache_path):
+            return None
+        try:
+            with open(self.tool_cache_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get("key") != self._tool_cache_key():
+                return None
+            from mcp.types import Tool
+
+            return [Tool.model_validate(tool) for tool in data["tools"]]
+        except (OSError, ValueError, KeyError) as e:
+            print(f"無法讀取工具定義快取，改為向 MCP 伺服器查詢：{e}")
+            return None
+
+    def _save_cached_tools(self, tools: list) -> None:
+        if not self.tool_cache_path:
+            return
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.tool_cache_path)), exist_ok=True)
+            with open(self.tool_cache_path, 'w', encoding='utf-8') as f:
+                json.dump({"key": self._tool_cache_key(),
+                           "tools": [tool.model_dump(mode="json", exclude_none=True) for tool in tools]},
+                          f, ensure_ascii=False)
+        except OSError as e:
+            print(f"無法寫入工具定義快取：{e}")
+
+    async def list_available_tools(self):
+        """获取可用工具列表"""
+        cached = self._load_cached_tools()
+        if cached is not None:
+            tracer.event("mcp.list_tools", cached=True, tools=len(cached))
+            return cached
+        if self._pooled:
+            tools = (await self._call_pooled("list_tools")).tools
+        else:
+            from mcp import ClientSession
+            from mcp.client.stdio import stdio_client
+
+            async with stdio_client(self.server_params) as (read, write):
+                async with ClientSession(read, write) as session:
+                    await session.initialize()
+                    tools = (await session.list_tools()).tools
+        self._save_cached_tools(tools)
+        return tools
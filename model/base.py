@@ -0,0 +1,100 @@
+import asyncio
+import contextvars
+import functools
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional
+
+from conversation import estimate_tokens
+
+
+class AgentBase(ABC):
+    """
+    模型後端的共同介面，main.py 只依賴這個類別而不依賴具體的 AgentGemini / AgentOllama。
+
+    generate_text / agenerate_text 回傳的字典格式：
+        {"response": str, "tool_calls": [{"tool": str, "parameters": dict}, ...]}
+    """
+
+    # 沒有原生非同步客戶端時，agenerate_text 會在這個專用執行緒池中執行 generate_text，
+    # 避免阻塞事件迴圈，也不會佔用 asyncio 預設的執行緒池
+    executor_workers = 8
+    _executor: Optional[ThreadPoolExecutor] = None
+    # 所有學生共用的系統提示（評分標準與指令），放在每次請求的最前面讓後端可以重複使用前綴
+    system_prompt: Optional[str] = None
+    # 串流生成：收到參數齊全的 write_grading_report / unzip_folder 調用就停止生成（見 model/streaming.py）
+    streaming = False
+    # 串流時 thinking 的 token 上限，0 表示不限制；只有支援關閉 thinking 的後端會使用
+    max_thinking_tokens = 0
+
+    @abstractmethod
+    def set_tools(self, tools: list):
+        """設置可用的工具列表（MCP 工具）"""
+
+    @abstractmethod
+    def generate_text(self, prompt: str, context: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """同步生成回應，可能包含工具調用"""
+
+    def set_system_prompt(self, system_prompt: str) -> None:
+        """設置所有學生共用的系統提示，後端可以在此建立前綴快取"""
+        self.system_prompt = system_prompt
+
+    async def warm_up(self) -> None:
+        """開始批改前預先載入模型（例如在每台 Ollama 主機載入），預設不做任何事"""
+
+    def close(self) -> None:
+        """釋放後端資源（例如伺服器端的快取內容）"""
+
+    def cache_identity(self) -> Dict[str, Any]:
+        """回傳會影響評分結果的模型名稱與生成參數，用於評分快取的鍵"""
+        return {"backend": type(self).__name__}
+
+    def estimate_request_tokens(self, prompt: str, context: Optional[Dict[str, Any]] = None) -> int:
+        """估計一次請求的輸入 token 數（系統提示 + 對話歷史 + 提示），供用戶端限流使用"""
+        history = (context or {}).get("history", [])
+        return (estimate_tokens(self.system_prompt or "") + estimate_tokens(prompt)
+                + sum(estimate_tokens(m.get("content") or "") for m in history))
+
+    def run_batch_job(self, prompts: List[str]) -> List[Optional[Dict[str, Any]]]:
+        """
+        以後端的離線批次工作（較便宜但延遲較高）一次送出多個提示，依序回傳每個提示的回應，
+        失敗的提示回傳 None。預設不支援。
+        """
+        raise NotImplementedError(f"{type(self).__name__} 不支援離線批次工作")
+
+    async def agenerate_record(self, prompt: str, context: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        結構化輸出模式：不調用工具，直接產生符合 GradingRecord schema 的評分紀錄，回傳
+            {"record": GradingRecord 或 None（格式錯誤）, "response": str, "tool_calls": [], "usage": {...}}
+        預設沒有受限生成，以一般的 agenerate_text 加上指令再驗證；模型仍調用 write_grading_report 時採用其參數。
+        """
+        # pydantic 只有結構化輸出模式需要，不在啟動時匯入
+        from grading_record import STRUCTURED_INSTRUCTION, GradingRecord, parse_record
+        from model.retry import MalformedResponse
+
+        response = await self.agenerate_text(prompt + "\n\n" + STRUCTURED_INSTRUCTION, context)
+        result = {"record": None, "response": "", "tool_calls": []}
+        if not isinstance(response, dict):
+            return result
+        result.update(response=response.get("response", ""), usage=response.get("usage"))
+        for tool_call in response.get("tool_calls") or []:
+            if tool_call.get("tool") == "write_grading_report":
+                try:
+                    result["record"] = GradingRecord.model_validate(tool_call.get("parameters") or {})
+                except ValueError:
+                    pass
+                return result
+        try:
+            result["record"] = parse_record(result["response"])
+        except MalformedResponse:
+            pass
+        return result
+
+    async def agenerate_text(self, prompt: str, context: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """非同步生成回應，預設在專用執行緒池中執行 generate_text"""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.executor_workers, thread_name_prefix=type(self).__name__)
+        loop = asyncio.get_running_loop()
+        # 帶著目前的 contextvars（例如追蹤記錄的學生學號）到執行緒中
+        call = functools.partial(contextvars.copy_context().run, self.generate_text, prompt, context)
+        return await loop.run_in_executor(self._executor, call)
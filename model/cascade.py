@@ -0,0 +1,205 @@
+# model/cascade.py
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+from model.base import AgentBase
+from tracing import tracer
+
+# 小模型調用 write_grading_report 時額外回報的信心參數，轉交 MCP 工具前會移除
+CONFIDENCE_PARAM = "confidence"
+CONFIDENCE_INSTRUCTION = (
+    "調用 write_grading_report 時，請以 confidence 參數（0 到 1 的數字）表示你對這個分數的把握；"
+    "程式碼難以判斷、是否能執行不確定或分數可能落在及格邊緣時，請給較低的值。"
+)
+
+
+def _with_confidence(tool):
+    """複製 write_grading_report 的工具定義，加上必填的 confidence 參數（只給小模型使用）"""
+    schema = dict(tool.inputSchema or {})
+    schema["properties"] = dict(schema.get("properties", {}), **{
+        CONFIDENCE_PARAM: {"type": "number", "title": "評分信心（0 到 1）"}
+    })
+    schema["required"] = list(schema.get("required", [])) + [CONFIDENCE_PARAM]
+    return tool.model_copy(update={"inputSchema": schema})
+
+
+class CascadeAgent(AgentBase):
+    """
+    分級評分：每個請求先交給較小、較快的模型（例如本機的小型 Ollama 模型或便宜的 Gemini flash），
+    只有下列情況才以相同的提示與對話歷史改問大模型：
+        - 沒有調用任何工具、回應錯誤或工具參數缺漏（格式錯誤的工具調用）
+        - 分數不是 0 到 100 的數字
+        - 信心 (confidence) 低於 min_confidence
+        - 分數距離某個分數界線（例如及格的 60 分）不超過 margin 分
+    解壓縮與執行測試等工具調用不影響分數，直接採用小模型的結果。
+    """
+
+    def __init__(self, small: AgentBase, large: AgentBase, min_confidence: float = 0.7,
+                 boundaries: Tuple[float, ...] = (60,), margin: float = 5):
+        self.small = small
+        self.large = large
+        self.min_confidence = min_confidence
+        self.boundaries = tuple(boundaries)
+        self.margin = margin
+        self.tools = None
+        self.escalations: Counter = Counter()
+        self.tier_calls: Counter = Counter()
+        self.tier_seconds: Dict[str, float] = {"small": 0.0, "large": 0.0}
+        self._lock = threading.Lock()
+
+    def set_tools(self, tools: list):
+        self.tools = tools
+        self.large.set_tools(tools)
+        self.small.set_tools([_with_confidence(tool) if tool.name == "write_grading_report" else tool for tool in tools])
+
+    def set_system_prompt(self, system_prompt: str) -> None:
+        self.system_prompt = system_prompt
+        self.large.set_system_prompt(system_prompt)
+        self.small.set_system_prompt(system_prompt + "\n\n" + CONFIDENCE_INSTRUCTION)
+
+    async def warm_up(self) -> None:
+        await self.small.warm_up()
+        await self.large.warm_up()
+
+    def cache_identity(self) -> Dict[str, Any]:
+        return {"backend": "cascade", "small": self.small.cache_identity(), "large": self.large.cache_identity(),
+                "min_confidence": self.min_confidence, "boundaries": self.boundaries, "margin": self.margin}
+
+    def run_batch_job(self, prompts: List[str]) -> List[Optional[Dict[str, Any]]]:
+        # 批次回應沒有信心分數可以判斷，離線批次工作直接使用大模型
+        return self.large.run_batch_job(prompts)
+
+    def escalation_reason(self, response: Dict[str, Any]) -> Optional[str]:
+        """小模型的回應需要交給大模型的原因，可以直接採用時回傳 None"""
+        if not isinstance(response, dict) or response.get("error"):
+            return "error"
+        calls = response.get("tool_calls") or []
+        if not calls:
+            return "no_tool_call"
+        report = next((call for call in calls if call.get("tool") == "write_grading_report"), None)
+        if report is None:
+            return None
+        parameters = report.get("parameters") or {}
+        required = [name for name in ("score", "comments") if name not in parameters]
+        if required:
+            return "malformed_tool_call"
+        try:
+            score = float(parameters["score"])
+        except (TypeError, ValueError):
+            return "invalid_score"
+        if not 0 <= score <= 100:
+            return "invalid_score"
+        try:
+            confidence = float(parameters.get(CONFIDENCE_PARAM))
+        except (TypeError, ValueError):
+            return "missing_confidence"
+        if confidence < self.min_confidence:
+            return "low_confidence"
+        if any(abs(score - boundary) <= self.margin for boundary in self.boundaries):
+            return "near_boundary"
+        return None
+
+    @staticmethod
+    def _strip_confidence(response: Dict[str, Any]) -> Dict[str, Any]:
+        for call in response.get("tool_calls") or []:
+            if call.get("tool") == "write_grading_report" and isinstance(call.get("parameters"), dict):
+                call["parameters"] = {k: v for k, v in call["parameters"].items() if k != CONFIDENCE_PARAM}
+        return response
+
+    def _record(self, tier: str, seconds: float) -> None:
+        with self._lock:
+            self.tier_calls[tier] += 1
+            self.tier_seconds[tier] += seconds
+
+    def _escalate(self, reason: str, response: Any) -> None:
+        with self._lock:
+            self.escalations[reason] += 1
+        score = None
+        if isinstance(response, dict):
+            for call in response.get("tool_calls") or []:
+                if call.get("tool") == "write_grading_report":
+                    score = (call.get("parameters") or {}).get("score")
+        tracer.event("cascade.escalate", reason=reason, small_score=score)
+
+    @staticmethod
+    def _merge_usage(small: Any, large: Dict[str, Any]) -> Dict[str, Any]:
+        """大模型的回應加上小模型花費的 token 數，並標記由哪一級完成"""
+        usage = dict(large.get("usage") or {})
+        small_usage = (small.get("usage") if isinstance(small, dict) else None) or {}
+        for field in ("input_tokens", "output_tokens"):
+            if isinstance(small_usage.get(field), int):
+                usage[field] = (usage.get(field) or 0) + small_usage[field]
+        usage["tier"] = "large"
+        large["usage"] = usage
+        return large
+
+    def generate_text(self, prompt: str, context: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        started = time.perf_counter()
+        with tracer.span("cascade.small", model=getattr(self.small, "model_name", None)):
+            response = self.small.generate_text(prompt, context)
+        self._record("small", time.perf_counter() - started)
+        reason = self.escalation_reason(response)
+        if reason is None:
+            response.setdefault("usage", {})["tier"] = "small"
+            return self._strip_confidence(response)
+        self._escalate(reason, response)
+        started = time.perf_counter()
+        with tracer.span("cascade.large", model=getattr(self.large, "model_name", None), reason=reason):
+            escalated = self.large.generate_text(prompt, context)
+        self._record("large", time.perf_counter() - started)
+        return self._merge_usage(response, escalated) if isinstance(escalated, dict) else escalated
+
+    async def agenerate_text(self, prompt: str, context: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        started = time.perf_counter()
+        with tracer.span("cascade.small", model=getattr(self.small, "model_name", None)):
+            response = await self.small.agenerate_text(prompt, context)
+        self._record("small", time.perf_counter() - started)
+        reason = self.escalation_reason(response)
+        if reason is None:
+            response.setdefault("usage", {})["tier"] = "small"
+            return self._strip_confidence(response)
+        self._escalate(reason, response)
+        started = time.perf_counter()
+        with tracer.span("cascade.large", model=getattr(self.large, "model_name", None), reason=reason):
+            escalated = await self.large.agenerate_text(prompt, context)
+        self._record("large", time.perf_counter() - started)
+        return self._merge_usage(response, escalated) if isinstance(escalated, dict) else escalated
+
+    async def agenerate_record(self, prompt: str, context: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """結構化輸出模式：評分紀錄沒有信心分數，只在格式錯誤或分數接近界線時交給大模型"""
+        started = time.perf_counter()
+        with tracer.span("cascade.small", model=getattr(self.small, "model_name", None), structured=True):
+            response = await self.small.agenerate_record(prompt, context)
+        self._record("small", time.perf_counter() - started)
+        record = response.get("record")
+        if record is None:
+            reason = "malformed_record"
+        elif any(abs(record.score - boundary) <= self.margin for boundary in self.boundaries):
+            reason = "near_boundary"
+        else:
+            response.setdefault("usage", {})["tier"] = "small"
+            return response
+        with self._lock:
+            self.escalations[reason] += 1
+        tracer.event("cascade.escalate", reason=reason, small_score=record.score if record is not None else None)
+        started = time.perf_counter()
+        with tracer.span("cascade.large", model=getattr(self.large, "model_name", None), reason=reason, structured=True):
+            escalated = await self.large.agenerate_record(prompt, context)
+        self._record("large", time.perf_counter() - started)
+        return self._merge_usage(response, escalated)
+
+    def summary(self) -> str:
+        with self._lock:
+            small, large = self.tier_calls["small"], self.tier_calls["large"]
+            lines = [f"分級評分：小模型 {small} 次（平均 {self.tier_seconds['small'] / max(1, small):.2f} 秒），"
+                     f"交給大模型 {large} 次（平均 {self.tier_seconds['large'] / max(1, large):.2f} 秒）"]
+            if self.escalations:
+                lines.append("交給大模型的原因：" + "，".join(f"{reason} {count}" for reason, count in self.escalations.most_common()))
+        return "\n".join(lines)
+
+    def close(self) -> None:
+        print(self.summary())
+        self.small.close()
+        self.large.close()
@@ -1,19 +1,44 @@
 import google.generativeai as genai
 from google.generativeai import types
+from google.generativeai import caching
+import datetime
+import time
+import urllib.request
 from dotenv import load_dotenv
 import os
 import json
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional
 from pprint import pprint
+from model.base import AgentBase
+from model.retry import MalformedResponse, RateLimiter, RetryPolicy, acall_with_retry, call_with_retry
+from model.streaming import StreamProgress, tool_requirements
 
 load_dotenv()
 
-class AgentGemini:
+# Gemini Batch API（google.generativeai SDK 尚未提供，直接呼叫 REST）
+BATCH_API_URL = "https://generativelanguage.googleapis.com/v1beta"
+BATCH_DONE_STATES = ("BATCH_STATE_SUCCEEDED", "BATCH_STATE_FAILED", "BATCH_STATE_CANCELLED", "BATCH_STATE_EXPIRED")
+
+class AgentGemini(AgentBase):
     def __init__(self):
         genai.configure(api_key=os.getenv('GEMINI_API_KEY'))
-        self.model = genai.GenerativeModel(os.getenv('GEMINI_MODEL_NAME'))
+        self.model_name = os.getenv('GEMINI_MODEL_NAME')
+        self.model = genai.GenerativeModel(self.model_name)
         self.tools = None
         self.gemini_tools = None
+        self.config = types.GenerationConfig()
+        # 系統提示的伺服器端快取 (CachedContent)，評分標準只需上傳一次
+        self.cached_content = None
+        # 結構化輸出用的模型：快取內容含有工具宣告，不能與 response_schema 一起使用，另外以 system_instruction 建立
+        self.record_model = None
+        self.cache_ttl = datetime.timedelta(seconds=int(os.getenv('GEMINI_CACHE_TTL', '3600')))
+        # 429 / 逾時 / 5xx / MALFORMED_FUNCTION_CALL 會以指數退避重新送出請求；GEMINI_RPM / GEMINI_TPM 為用戶端限流
+        self.retry_policy = RetryPolicy.from_env('GEMINI')
+        self.rate_limiter = RateLimiter.from_env('GEMINI')
+        # 離線批次工作的輪詢間隔（秒）
+        self.batch_poll_interval = int(os.getenv('GEMINI_BATCH_POLL_INTERVAL', '30'))
+        # 提前停止串流時找不到底層串流的警告只印一次
+        self._stream_cancel_warned = False
 
     def set_tools(self, tools: list):
         """設置可用的工具列表"""
@@ -48,7 +73,82 @@ class AgentGemini:
             
         # 創建 Gemini 工具配置
         self.gemini_tools = types.Tool(function_declarations=function_declarations)
-        self.config = types.GenerationConfig()
+
+    def set_system_prompt(self, system_prompt: str) -> None:
+        """
+        設置系統提示，並建立一次 Gemini CachedContent（含工具宣告），之後每位學生的請求只需傳送自己的內容。
+        若模型或提示長度不支援快取（例如低於最小 token 數），改用一般的 system_instruction。
+        """
+        self.system_prompt = system_prompt
+        self.record_model = None
+        self.close()
+        try:
+            self.cached_content = caching.CachedContent.create(
+                model=self.model_name,
+                display_name="teach_assistant_rubric",
+                system_instruction=system_prompt,
+                tools=[self.gemini_tools] if self.gemini_tools else None,
+                ttl=self.cache_ttl,
+            )
+            self.model = genai.GenerativeModel.from_cached_content(self.cached_content, generation_config=self.config)
+            print(f"已建立 Gemini 快取內容：{self.cached_content.name}（TTL {self.cache_ttl}）")
+        except Exception as e:
+            print(f"無法建立 Gemini 快取內容，改用一般的系統提示：{e}")
+            self.cached_content = None
+            self.model = genai.GenerativeModel(self.model_name, system_instruction=system_prompt)
+
+    def close(self) -> None:
+        """刪除伺服器端的快取內容，避免在 TTL 到期前持續計費"""
+        if self.cached_content is not None:
+            try:
+                self.cached_content.delete()
+            except Exception as e:
+                print(f"刪除 Gemini 快取內容失敗：{e}")
+            self.cached_content = None
+
+    def cache_identity(self) -> Dict[str, Any]:
+        return {
+            "backend": "gemini",
+            "model": self.model_name,
+            "generation_config": repr(getattr(self, 'config', None)),
+        }
+
+    @staticmethod
+    def _to_contents(prompt: str, context: Optional[Dict[str, Any]] = None) -> list:
+        """
+        將對話歷史與本次提示轉成 Gemini 的多輪 contents。
+        工具調用轉成 function_call，工具結果轉成 function_response；相鄰同角色的訊息會合併，維持 user/model 交替。
+        """
+        contents = []
+
+        def append(role: str, part: Any) -> None:
+            if contents and contents[-1]["role"] == role:
+                contents[-1]["parts"].append(part)
+            else:
+                contents.append({"role": role, "parts": [part]})
+
+        for message in (context or {}).get("history", []):
+            if message["role"] == "assistant":
+                if message.get("content"):
+                    append("model", message["content"])
+                for tc in message.get("tool_calls", []):
+                    append("model", {"function_call": {"name": tc["tool"], "args": tc["parameters"]}})
+            elif message["role"] == "tool":
+                append("user", {"function_response": {"name": message["tool"], "response": {"result": message["content"]}}})
+            else:
+                append("user", message["content"])
+        append("user", prompt)
+        return contents
+
+    def _request_kwargs(self, prompt: str, context: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        kwargs = {
+            "contents": self._to_contents(prompt, context),
+            "generation_config": self.config,
+        }
+        # 使用快取內容時，工具宣告已經包含在快取中
+        if self.cached_content is None:
+            kwargs["tools"] = [self.gemini_tools] if self.gemini_tools else None
+        return kwargs
 
     def generate_text(self, prompt: str, context: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """
@@ -61,12 +161,218 @@ class AgentGemini:
         Returns:
             包含回應和工具調用的字典
         """
-        # 發送請求
-        response = self.model.generate_content(
-            contents=prompt,
-            generation_config=self.config,
-            tools=[self.gemini_tools] if self.gemini_tools else None
+        kwargs = self._request_kwargs(prompt, context)
+
+        def call() -> Dict[str, Any]:
+            response = self.model.generate_content(**kwargs)
+            return self._with_usage(self._parse_response(response), response)
+
+        try:
+            return call_with_retry(call, self.retry_policy, self.rate_limiter,
+                                   self.estimate_request_tokens(prompt, context), "gemini")
+        except MalformedResponse as e:
+            return self._malformed_error(e)
+
+    async def agenerate_text(self, prompt: str, context: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """非同步版本的 generate_text，使用 Gemini 原生的非同步客戶端，不會阻塞事件迴圈"""
+        kwargs = self._request_kwargs(prompt, context)
+
+        async def call() -> Dict[str, Any]:
+            if self.streaming:
+                return await self._astream(kwargs)
+            response = await self.model.generate_content_async(**kwargs)
+            return self._with_usage(self._parse_response(response), response)
+
+        try:
+            return await acall_with_retry(call, self.retry_policy, self.rate_limiter,
+                                          self.estimate_request_tokens(prompt, context), "gemini")
+        except MalformedResponse as e:
+            return self._malformed_error(e)
+
+    async def agenerate_record(self, prompt: str, context: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        結構化輸出：以 response_schema 限制 Gemini 只能輸出符合 GradingRecord 的 JSON。
+        快取內容中含有工具宣告，Gemini 不接受工具與 response_schema 同時使用，因此這個請求不使用快取內容，
+        改以只帶 system_instruction、沒有工具的模型送出。任何錯誤都回傳 record 為 None，由呼叫端改用工具調用評分。
+        """
+        # 與 AgentBase 相同，只有結構化輸出模式需要 grading_record，不在載入後端時匯入
+        from grading_record import STRUCTURED_INSTRUCTION, gemini_schema, parse_record
+
+        if self.record_model is None:
+            self.record_model = genai.GenerativeModel(self.model_name, system_instruction=getattr(self, 'system_prompt', None))
+        kwargs = {
+            "contents": self._to_contents(prompt + "\n\n" + STRUCTURED_INSTRUCTION, context),
+            "generation_config": types.GenerationConfig(
+                response_mime_type="application/json",
+                response_schema=gemini_schema(),
+            ),
+        }
+
+        async def call() -> Dict[str, Any]:
+            response = await self.record_model.generate_content_async(**kwargs)
+            try:
+                text = response.text
+            except ValueError as e:
+                # 沒有任何文字內容（例如被安全設定擋下）
+                raise MalformedResponse(f"Gemini 沒有回傳評分紀錄：{e}") from e
+            # 格式錯誤時拋出 MalformedResponse，由 acall_with_retry 重新送出
+            return self._with_usage({"record": parse_record(text), "response": text, "tool_calls": []}, response)
+
+        try:
+            return await acall_with_retry(call, self.retry_policy, self.rate_limiter,
+                                          self.estimate_request_tokens(prompt, context), "gemini")
+        except MalformedResponse as e:
+            return dict(self._malformed_error(e), record=None)
+        except Exception as e:
+            # 重試用盡的 API 錯誤（配額、權限、schema 不被接受等）
+            return {"record": None, "response": "", "error": f"Gemini 結構化輸出失敗：{e}", "tool_calls": []}
+
+    async def _astream(self, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        串流生成：收到參數齊全的 write_grading_report / unzip_folder 調用就停止讀取並關閉串流。
+        google.generativeai SDK 沒有 thinking 預算的設定，max_thinking_tokens 對 Gemini 沒有作用。
+        """
+        progress = StreamProgress("gemini", tool_requirements(self.tools))
+        response = await self.model.generate_content_async(**kwargs, stream=True)
+        # 自己持有的非同步產生器，提前停止時以 aclose() 結束迭代
+        chunks = response.__aiter__()
+        last = None
+        early_stop = False
+        finished = False
+        try:
+            async for chunk in chunks:
+                last = chunk
+                candidate = chunk.candidates[0] if chunk.candidates else None
+                if candidate is None:
+                    continue
+                for part in getattr(candidate.content, 'parts', []):
+                    if getattr(part, 'function_call', None):
+                        progress.add_tool_call(part.function_call.name, part.function_call.args)
+                    elif getattr(part, 'text', None):
+                        progress.feed(text=part.text)
+                if not progress.tool_calls and candidate.finish_reason == 10:
+                    # MALFORMED_FUNCTION_CALL：重新送出請求（見 acall_with_retry）
+                    raise MalformedResponse("MALFORMED_FUNCTION_CALL")
+                if progress.dispatchable() is not None:
+                    early_stop = not candidate.finish_reason
+                    break
+            else:
+                finished = True
+        finally:
+            await chunks.aclose()
+            if not finished:
+                await self._cancel_stream(response)
+
+        text = "".join(progress.text)
+        if progress.tool_calls:
+            call = progress.dispatchable() or progress.tool_calls[0]
+            result = {"response": text or call["tool"], "tool_calls": [call]}
+        else:
+            try:
+                result = json.loads(text)
+            except json.JSONDecodeError:
+                result = {"response": text, "tool_calls": []}
+        if not isinstance(result, dict):
+            return result
+        result = self._with_usage(result, last)
+        result["usage"] = dict(result.get("usage") or {}, **progress.usage(early_stop))
+        return result
+
+    async def _cancel_stream(self, response) -> None:
+        """
+        提前停止時讓伺服器停止傳送。SDK 沒有公開取消串流的方法，只能關閉底層的串流（私有屬性 _iterator）；
+        SDK 改版後找不到時印出警告，停止讀取仍然有效，但伺服器會把剩下的內容生成完。
+        """
+        stream = getattr(response, '_iterator', None)
+        close = getattr(stream, 'aclose', None) or getattr(stream, 'cancel', None)
+        if close is None:
+            if not self._stream_cancel_warned:
+                print("警告：google.generativeai 的串流回應沒有可以關閉的底層串流，提前停止時伺服器仍會繼續生成")
+                self._stream_cancel_warned = True
+            return
+        closing = close()
+        if hasattr(closing, '__await__'):
+            await closing
+
+    @staticmethod
+    def _malformed_error(e: MalformedResponse) -> Dict[str, Any]:
+        return {
+            "response": "重試次數已達上限",
+            "error": str(e),
+            "tool_calls": []
+        }
+
+    @staticmethod
+    def _with_usage(result: Any, response) -> Any:
+        """把 usage_metadata 的 token 數加到回應的 "usage"，供追蹤記錄使用"""
+        usage = getattr(response, "usage_metadata", None)
+        if isinstance(result, dict) and usage is not None:
+            result["usage"] = {
+                "input_tokens": usage.prompt_token_count,
+                "output_tokens": usage.candidates_token_count,
+                "cached_tokens": usage.cached_content_token_count,
+            }
+        return result
+
+    def _batch_request(self, method: str, path: str, body: Optional[dict] = None) -> dict:
+        request = urllib.request.Request(
+            f"{BATCH_API_URL}/{path}",
+            data=json.dumps(body).encode('utf-8') if body is not None else None,
+            method=method,
+            headers={"Content-Type": "application/json", "x-goog-api-key": os.getenv('GEMINI_API_KEY', '')}
         )
+        with urllib.request.urlopen(request, timeout=60) as response:
+            return json.loads(response.read().decode('utf-8'))
+
+    def run_batch_job(self, prompts: List[str]) -> List[Optional[Dict[str, Any]]]:
+        """
+        以 Gemini Batch API 送出離線批次工作（費用約為一般請求的一半，但可能需要數分鐘到數小時），
+        每個提示各自是一個請求，要求以 JSON 回應。輪詢到工作結束後依序回傳解析後的回應，失敗的請求回傳 None。
+        """
+        model = self.model_name if self.model_name.startswith("models/") else f"models/{self.model_name}"
+        requests = []
+        for index, prompt in enumerate(prompts):
+            request = {
+                "contents": [{"role": "user", "parts": [{"text": prompt}]}],
+                "generation_config": {"response_mime_type": "application/json"},
+            }
+            if self.system_prompt:
+                request["system_instruction"] = {"parts": [{"text": self.system_prompt}]}
+            requests.append({"request": request, "metadata": {"key": str(index)}})
+        operation = self._batch_request("POST", f"{model}:batchGenerateContent", {
+            "batch": {
+                "display_name": "teach_assistant_batch",
+                "input_config": {"requests": {"requests": requests}},
+            }
+        })
+        name = operation["name"]
+        print(f"已送出 Gemini 離線批次工作：{name}（{len(prompts)} 個請求）")
+        state = operation.get("metadata", {}).get("state")
+        while not operation.get("done") and state not in BATCH_DONE_STATES:
+            time.sleep(self.batch_poll_interval)
+            operation = self._batch_request("GET", name)
+            state = operation.get("metadata", {}).get("state")
+            print(f"Gemini 離線批次工作 {name} 狀態：{state}")
+        if state not in (None, "BATCH_STATE_SUCCEEDED") or "error" in operation:
+            raise RuntimeError(f"Gemini 離線批次工作失敗：{state} {operation.get('error', '')}")
+
+        output = operation.get("response") or operation.get("metadata", {}).get("output") or {}
+        inlined = output.get("inlinedResponses", {})
+        if isinstance(inlined, dict):
+            inlined = inlined.get("inlinedResponses", [])
+        results: List[Optional[Dict[str, Any]]] = [None] * len(prompts)
+        for position, entry in enumerate(inlined):
+            index = int(entry.get("metadata", {}).get("key", position))
+            if "response" not in entry or index >= len(prompts):
+                continue
+            candidates = entry["response"].get("candidates") or [{}]
+            parts = candidates[0].get("content", {}).get("parts", [])
+            text = "".join(part.get("text", "") for part in parts)
+            results[index] = {"response": text, "tool_calls": []}
+        return results
+
+    def _parse_response(self, response) -> Dict[str, Any]:
+        """將 Gemini 回應解析為 {"response", "tool_calls"} 格式"""
         # pprint(response)
         
         # 檢查是否有函數調用
@@ -74,57 +380,49 @@ class AgentGemini:
         # print(response.candidates[0])
         # print(response)
 
-        max_try = 3
-        current_try = 0
-        thinking = ""
-        while current_try < max_try:
-            try:
-                function_call = None
-                text_response = None
-                    
-                candidate = response.candidates[0]
-                # 安全地檢查 parts
-                parts = getattr(candidate.content, 'parts', [])   
-                # 檢查所有 parts 中的 function_call
-                for part in parts:
-                    if hasattr(part, 'function_call') and part.function_call:
-                        function_call = part.function_call
-                    if hasattr(part, 'text') and part.text:
-                        text_response = part.text
-                        
-                if function_call:
-                    return {
-                        "response": text_response if text_response is not None else function_call.name,
-                        "tool_calls": [{
-                            "tool": function_call.name,
-                            "parameters": function_call.args
-                        }]
-                    }
-                elif candidate.finish_reason == 10:
-                    current_try += 1
-                    if current_try >= max_try:
-                        return {
-                            "response": "重試次數已達上限",
-                            "error": "MALFORMED_FUNCTION_CALL"
-                        }
-                    print(f"遇到 MALFORMED_FUNCTION_CALL，正在進行第 {current_try} 次重試...")
-                    continue
-                else:
-                    # 如果不是函數調用，嘗試解析 JSON 回應
-                    try:
-                        result = json.loads(response.text)
-                        return result
-                    except json.JSONDecodeError:
-                        # 如果不是 JSON 格式，返回純文字回應
-                        return {
-                            "response": response.text,
-                            "tool_calls": []
-                        }      
-            except Exception as e:
-                print("================== GEMINI response ==================")
-                print(response.candidates[0].finish_reason)
-                print(response)     
-                current_try += 1       
+        try:
+            candidate = response.candidates[0]
+            # 安全地檢查 parts
+            parts = getattr(candidate.content, 'parts', [])
+        except Exception as e:
+            print("================== GEMINI response ==================")
+            print(response)
+            raise MalformedResponse(f"無法解析 Gemini 回應：{e}") from e
+
+        function_call = None
+        text_response = None
+        # 檢查所有 parts 中的 function_call
+        for part in parts:
+            if hasattr(part, 'function_call') and part.function_call:
+                function_call = part.function_call
+            if hasattr(part, 'text') and part.text:
+                text_response = part.text
+
+        if function_call:
+            return {
+                "response": text_response if text_response is not None else function_call.name,
+                "tool_calls": [{
+                    "tool": function_call.name,
+                    "parameters": function_call.args
+                }]
+            }
+        if candidate.finish_reason == 10:
+            # MALFORMED_FUNCTION_CALL：重新送出請求（見 generate_text / agenerate_text）
+            raise MalformedResponse("MALFORMED_FUNCTION_CALL")
+        try:
+            text = response.text
+        except ValueError:
+            # 沒有任何文字內容（例如被安全設定擋下）
+            text = text_response or ""
+        # 如果不是函數調用，嘗試解析 JSON 回應
+        try:
+            return json.loads(text)
+        except json.JSONDecodeError:
+            # 如果不是 JSON 格式，返回純文字回應
+            return {
+                "response": text,
+                "tool_calls": []
+            }
 
 if __name__ == "__main__":
     agent = AgentGemini()
@@ -0,0 +1,159 @@
+# model/host_pool.py
+import asyncio
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import List, Optional
+
+import httpx
+import ollama
+
+from model.retry import is_retryable, status_code
+from tracing import tracer
+
+
+class OllamaHost:
+    """
+    一台 Ollama 伺服器：各自的同步與非同步客戶端（httpx 連線池保持 keep-alive 連線），
+    以及排程與斷路器使用的狀態。
+    """
+
+    def __init__(self, url: str, timeout: float, max_connections: int = 16):
+        self.url = url
+        limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections,
+                              keepalive_expiry=300)
+        self.client = ollama.Client(host=url, timeout=timeout, limits=limits)
+        self.async_client = ollama.AsyncClient(host=url, timeout=timeout, limits=limits)
+        # 目前正在處理的請求數（最少未完成請求排程）
+        self.outstanding = 0
+        # 連續失敗次數；達到門檻時斷路，open_until 之前不分派請求
+        self.failures = 0
+        self.open_until = 0.0
+        # 斷路時間結束後只放行一個請求試探 (half-open)，成功才恢復
+        self.probing = False
+        self.requests = 0
+
+    def available(self, now: float) -> bool:
+        return now >= self.open_until and not self.probing
+
+    def __repr__(self) -> str:
+        return f"OllamaHost({self.url!r}, outstanding={self.outstanding}, failures={self.failures})"
+
+
+class HostPool:
+    """
+    多台 Ollama 伺服器的負載平衡：每個請求分派給目前未完成請求最少的健康主機，
+    逾時或連線錯誤連續 failure_threshold 次就斷路 cooldown 秒，之後以一個請求試探是否恢復。
+    所有主機都斷路時改用最早恢復的主機，而不是直接失敗。
+    """
+
+    def __init__(self, urls: List[str], timeout: float = 50, failure_threshold: int = 2, cooldown: float = 30,
+                 max_connections: int = 16):
+        if not urls:
+            raise ValueError("至少需要一台 Ollama 主機")
+        self.hosts = [OllamaHost(url, timeout, max_connections) for url in urls]
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._next = 0
+
+    @classmethod
+    def from_env(cls, timeout: float) -> "HostPool":
+        """
+        讀取 OLLAMA_HOSTS（以逗號分隔的多台主機），沒有設定時使用 OLLAMA_HOST；
+        OLLAMA_FAILURE_THRESHOLD、OLLAMA_COOLDOWN 為斷路器設定，OLLAMA_MAX_CONNECTIONS 為每台主機的連線池大小
+        """
+        hosts = os.getenv('OLLAMA_HOSTS') or os.getenv('OLLAMA_HOST', 'http://localhost:11434')
+        return cls(
+            [url.strip() for url in hosts.split(',') if url.strip()],
+            timeout=timeout,
+            failure_threshold=int(os.getenv('OLLAMA_FAILURE_THRESHOLD', '2')),
+            cooldown=float(os.getenv('OLLAMA_COOLDOWN', '30')),
+            max_connections=int(os.getenv('OLLAMA_MAX_CONNECTIONS', '16')),
+        )
+
+    def _pick(self) -> OllamaHost:
+        now = time.monotonic()
+        with self._lock:
+            candidates = [host for host in self.hosts if host.available(now)]
+            if not candidates:
+                candidates = [min(self.hosts, key=lambda host: host.open_until)]
+            # 未完成請求數相同時輪流分派，避免總是選到第一台
+            start = self._next
+            self._next = (self._next + 1) % len(self.hosts)
+            order = {id(host): (index - start) % len(self.hosts) for index, host in enumerate(self.hosts)}
+            host = min(candidates, key=lambda h: (h.outstanding, order[id(h)]))
+            if host.open_until and now >= host.open_until:
+                host.probing = True
+            host.outstanding += 1
+            host.requests += 1
+            return host
+
+    @contextmanager
+    def lease(self):
+        """取得一台主機處理一個請求，區塊結束時依成功或失敗更新主機的狀態"""
+        host = self._pick()
+        try:
+            yield host
+        except BaseException as e:
+            self._release(host, e)
+            raise
+        else:
+            self._release(host, None)
+
+    def _release(self, host: OllamaHost, error: Optional[BaseException]) -> None:
+        with self._lock:
+            host.outstanding -= 1
+            host.probing = False
+            if error is None or not self._host_fault(error):
+                host.failures = 0
+                host.open_until = 0.0
+                return
+            host.failures += 1
+            if host.failures < self.failure_threshold:
+                return
+            now = time.monotonic()
+            already_open = host.open_until > now
+            host.open_until = now + self.cooldown
+            if already_open:
+                # 斷路前已經送出的請求陸續失敗，只延長斷路時間
+                return
+        tracer.event("ollama.circuit_open", host=host.url, failures=host.failures, cooldown=self.cooldown,
+                     error=f"{type(error).__name__}: {error}"[:200])
+        print(f"Ollama 主機 {host.url} 連續失敗 {host.failures} 次，{self.cooldown:.0f} 秒內不再分派請求")
+
+    @staticmethod
+    def _host_fault(error: BaseException) -> bool:
+        """逾時、連線錯誤與伺服器錯誤是主機的問題；參數錯誤或中途取消不影響主機的健康狀態"""
+        if isinstance(error, (asyncio.CancelledError, GeneratorExit, KeyboardInterrupt)):
+            return False
+        code = status_code(error)
+        if code is not None:
+            return code >= 500
+        return is_retryable(error)
+
+    def _warm_host(self, host: OllamaHost, model: str, keep_alive: str, num_ctx: Optional[int]) -> None:
+        started = time.perf_counter()
+        try:
+            with tracer.span("ollama.warm_up", host=host.url, model=model):
+                # 空白的提示只會載入模型，不會生成任何內容
+                host.client.generate(model=model, prompt="", keep_alive=keep_alive,
+                                     options={"num_ctx": num_ctx} if num_ctx else None)
+            print(f"Ollama 主機 {host.url} 已載入 {model}（{time.perf_counter() - started:.1f} 秒）")
+        except Exception as e:
+            with self._lock:
+                host.failures = self.failure_threshold
+                host.open_until = time.monotonic() + self.cooldown
+            print(f"Ollama 主機 {host.url} 無法載入 {model}，{self.cooldown:.0f} 秒內不分派請求：{e}")
+
+    async def warm_up(self, model: str, keep_alive: str, num_ctx: Optional[int] = None) -> None:
+        """
+        同時在每台主機載入模型（並以相同的 num_ctx 配置 KV cache），第一位學生不必等模型載入；
+        無法連線或沒有這個模型的主機先斷路，等 cooldown 後再試探。
+        """
+        await asyncio.gather(*[asyncio.to_thread(self._warm_host, host, model, keep_alive, num_ctx)
+                               for host in self.hosts])
+
+    def summary(self) -> str:
+        return "，".join(f"{host.url} {host.requests} 次" for host in self.hosts)
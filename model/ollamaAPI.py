@@ -5,24 +5,45 @@ import os
 import json
 from typing import Dict, Any, Optional
 from pprint import pprint
+from model.base import AgentBase
+from conversation import estimate_tokens
+from model.retry import RateLimiter, RetryPolicy, acall_with_retry, call_with_retry
+from model.host_pool import HostPool
+from model.streaming import StreamProgress, tool_requirements
+from tracing import tracer
 
 load_dotenv()
 
-class AgentOllama:
+class AgentOllama(AgentBase):
     def __init__(self):
-        # 初始化 Ollama 客戶端
-        host = os.getenv('OLLAMA_HOST', 'http://localhost:11434')
-        self.client = ollama.Client(host=host, timeout =50)
+        # 單次請求的逾時秒數；逾時與連線錯誤會以指數退避重試（重試時可能分派到另一台主機）
+        timeout = float(os.getenv('OLLAMA_TIMEOUT', '50'))
+        # 一台或多台 Ollama 主機（OLLAMA_HOSTS），每台各有保持連線的同步與非同步客戶端
+        self.hosts = HostPool.from_env(timeout)
+        self.retry_policy = RetryPolicy.from_env('OLLAMA')
+        self.rate_limiter = RateLimiter.from_env('OLLAMA')
         # 你的 Log 顯示是用 qwen3:32b，請確保環境變數 MODEL_NAME 設為此值
         self.model_name = os.getenv('OLLAMA_MODEL_NAME', 'qwen3:32b') 
         self.tools = None
         self.ollama_tools = None
+        self.options = {
+            "temperature": 0.1, # 降低溫度讓工具調用更精確
+            "repeat_penalty": 1.2,
+        }
+        # num_ctx 依實際提示長度決定（見 _context_size），不再固定配置 16K 的 KV cache
+        self.min_ctx = int(os.getenv('OLLAMA_MIN_CTX', '4096'))
+        self.max_ctx = int(os.getenv('OLLAMA_MAX_CTX', '32768'))
+        # 預留給模型輸出（包含 thinking）的 token 數
+        self.output_reserve = int(os.getenv('OLLAMA_OUTPUT_RESERVE', '4096'))
+        # 讓模型在學生之間保持載入，系統提示（評分標準）的 KV cache 才能被下一位學生重複使用
+        self.keep_alive = os.getenv('OLLAMA_KEEP_ALIVE', '30m')
 
     def set_tools(self, tools: list):
         """
         設置可用的工具列表
         參考 gemini.py 的邏輯，手動將 MCP 工具轉換為 Ollama (OpenAI compatible) 格式
         """
+        self.tools = tools
         self.ollama_tools = []
         for tool in tools:
             # 建立基本的函數定義結構
@@ -54,88 +75,243 @@ class AgentOllama:
                 "function": function_def
             })
 
+    async def warm_up(self) -> None:
+        """在每台主機預先載入模型，num_ctx 與只有系統提示時的請求相同，避免第一個請求重新載入"""
+        messages = [{'role': 'system', 'content': self.system_prompt}] if self.system_prompt else []
+        await self.hosts.warm_up(self.model_name, self.keep_alive, self._context_size(messages))
+
+    def close(self) -> None:
+        if len(self.hosts.hosts) > 1:
+            print(f"Ollama 主機分派：{self.hosts.summary()}")
+
+    def cache_identity(self) -> Dict[str, Any]:
+        return {"backend": "ollama", "model": self.model_name, "options": self.options}
+
+    def _context_size(self, messages: list) -> int:
+        """
+        依提示長度選擇 num_ctx：估計的輸入 token 加上輸出預留，向上取到 2 的次方，並限制在 [min_ctx, max_ctx]。
+        取 2 的次方是為了讓不同學生大多落在同一個大小，避免 Ollama 因 num_ctx 改變而重新載入模型、丟掉前綴的 KV cache。
+        """
+        needed = self.output_reserve + sum(estimate_tokens(m.get('content') or '') + 8 for m in messages)
+        size = self.min_ctx
+        while size < needed and size < self.max_ctx:
+            size *= 2
+        return min(size, self.max_ctx)
+
+    @staticmethod
+    def _to_ollama_message(message: Dict[str, Any]) -> Dict[str, Any]:
+        """將 Conversation 的訊息轉成 Ollama 原生的對話訊息"""
+        if message["role"] == "assistant":
+            converted = {'role': 'assistant', 'content': message.get("content", "")}
+            if message.get("tool_calls"):
+                converted['tool_calls'] = [
+                    {'function': {'name': tc["tool"], 'arguments': tc["parameters"]}}
+                    for tc in message["tool_calls"]
+                ]
+            return converted
+        if message["role"] == "tool":
+            return {'role': 'tool', 'content': message["content"], 'tool_name': message["tool"]}
+        return {'role': 'user', 'content': message["content"]}
+
+    def _chat_kwargs(self, prompt: str, context: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        messages = []
+        # 系統提示固定放在最前面，Ollama 會重複使用相同前綴的 KV cache
+        if self.system_prompt:
+            messages.append({'role': 'system', 'content': self.system_prompt})
+        # 之前的對話（包含工具調用與工具結果）以原生的多輪訊息傳送
+        if context:
+            messages.extend(self._to_ollama_message(m) for m in context.get("history", []))
+        messages.append({'role': 'user', 'content': prompt})
+
+        options = dict(self.options)
+        options["num_ctx"] = self._context_size(messages)
+
+        return {
+            "model": self.model_name,
+            "messages": messages,
+            "stream": False,
+            "tools": self.ollama_tools if self.ollama_tools else None,
+            "options": options,
+            "keep_alive": self.keep_alive
+        }
+
     def generate_text(self, prompt: str, context: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """
         生成回應，處理 Ollama Object 回傳格式
         """
-        messages = [{'role': 'user', 'content': prompt}]
-        
-        # 如果有上下文 (例如之前的對話歷史)，可以在這裡加入
-        # if context: ...
-        
-        max_try = 3
-        current_try = 0
-        thinking = ""
-
-        while current_try < max_try:
-            try:
-                # 發送請求到 Ollama
-                response: ChatResponse = self.client.chat(
-                    model=self.model_name,
-                    messages=messages,
-                    stream=False,
-                    tools=self.ollama_tools if self.ollama_tools else None,
-                    options={
-                        "temperature": 0.1, # 降低溫度讓工具調用更精確
-                        "num_ctx": 16384,    # 確保上下文長度足夠
-                        "repeat_penalty": 1.2,
-                    }
-                )
-                # pprint(response)
-                # --- 針對你提供的格式進行解析 ---
-                # response 是一個 ChatResponse 物件
-                # response.message 是一個 Message 物件
-                # with open("ollama_response_log.txt", "a", encoding="utf-8") as log_file:
-                #     log_file.write(response, ensure_ascii=False, indent=2)
-                #     log_file.write("\n\n====================\n\n")
-                message = response.message
-                
-                content = message.thinking or ""
-                tool_calls = getattr(message, 'tool_calls', []) # 這是 Object 的 list，不是 dict
-                
-                # 1. 檢查是否有原生的工具調用 (Tool Calls)
-                if tool_calls:
-                    formatted_tool_calls = []
-                    for tc in tool_calls:
-                        # tc.function 是一個物件，包含 name 和 arguments
-                        formatted_tool_calls.append({
-                            "tool": tc.function.name,
-                            "parameters": tc.function.arguments # Ollama 庫通常會自動解析 JSON 參數為 dict
-                        })
-                    
-                    return {
-                        "response": content, # 可能會有思維過程或空字串
-                        "tool_calls": formatted_tool_calls
-                    }
-                
-                # 2. 如果沒有工具調用，嘗試解析內容是否為 JSON (為了相容某些 Prompt 寫法)
-                # 你的 Log 顯示 content 是一大段 Markdown 文字，這通常會進入這裡並回傳純文字
-                try:
-                    # 嘗試解析 JSON (有些 Prompt 要求直接輸出 JSON 字串)
-                    # 只有當內容看起來像 JSON 時才嘗試
-                    if content.strip().startswith('{') and content.strip().endswith('}'):
-                        result = json.loads(content)
-                        return result
-                except json.JSONDecodeError:
-                    pass
-
-                # 3. 回傳一般文字回應
-                return {
-                    "response": content,
-                    "tool_calls": []
-                }
+        kwargs = self._chat_kwargs(prompt, context)
+
+        def call() -> Dict[str, Any]:
+            # 發送請求到目前未完成請求最少的 Ollama 主機
+            with self.hosts.lease() as host:
+                response: ChatResponse = host.client.chat(**kwargs)
+            return self._with_usage(self._parse_response(response), response)
+
+        try:
+            return call_with_retry(call, self.retry_policy, self.rate_limiter,
+                                   self.estimate_request_tokens(prompt, context), "ollama")
+        except Exception as e:
+            return self._report_error(e)
+
+    async def agenerate_text(self, prompt: str, context: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """非同步版本的 generate_text，使用 ollama.AsyncClient"""
+        kwargs = self._chat_kwargs(prompt, context)
+
+        async def call() -> Dict[str, Any]:
+            with self.hosts.lease() as host:
+                if self.streaming:
+                    return await self._astream(host.async_client, kwargs)
+                response: ChatResponse = await host.async_client.chat(**kwargs)
+            return self._with_usage(self._parse_response(response), response)
+
+        try:
+            return await acall_with_retry(call, self.retry_policy, self.rate_limiter,
+                                          self.estimate_request_tokens(prompt, context), "ollama")
+        except Exception as e:
+            return self._report_error(e)
+
+    async def agenerate_record(self, prompt: str, context: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """結構化輸出：以 format= 傳入 GradingRecord 的 JSON schema，Ollama 會限制輸出只能是符合 schema 的 JSON"""
+        # 與 AgentBase 相同，只有結構化輸出模式需要 grading_record，不在載入後端時匯入
+        from grading_record import STRUCTURED_INSTRUCTION, json_schema, parse_record
+
+        kwargs = self._chat_kwargs(prompt + "\n\n" + STRUCTURED_INSTRUCTION, context)
+        kwargs.update(tools=None, format=json_schema())
+
+        async def call() -> Dict[str, Any]:
+            with self.hosts.lease() as host:
+                response: ChatResponse = await host.async_client.chat(**kwargs)
+            content = response.message.content or ""
+            # 格式錯誤時拋出 MalformedResponse，由 acall_with_retry 重新送出
+            record = parse_record(content)
+            return self._with_usage({"record": record, "response": content, "tool_calls": []}, response)
+
+        try:
+            return await acall_with_retry(call, self.retry_policy, self.rate_limiter,
+                                          self.estimate_request_tokens(prompt, context), "ollama")
+        except Exception as e:
+            return dict(self._report_error(e), record=None)
+
+    async def _astream(self, client: ollama.AsyncClient, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        串流生成：逐塊累積 thinking、文字與工具調用，收到參數齊全的 write_grading_report / unzip_folder
+        就關閉連線（Ollama 在用戶端斷線時停止生成），不必等模型把剩下的文字生成完。
+        thinking 超過 max_thinking_tokens 時中斷，改以關閉 thinking 的方式重新送出同一個請求。
+        """
+        progress = StreamProgress("ollama", tool_requirements(self.tools), self.max_thinking_tokens)
+        stream = await client.chat(**dict(kwargs, stream=True))
+        last = None
+        early_stop = False
+        try:
+            async for chunk in stream:
+                last = chunk
+                message = chunk.message
+                progress.feed(thinking=message.thinking, text=message.content)
+                for tc in message.tool_calls or []:
+                    progress.add_tool_call(tc.function.name, tc.function.arguments)
+                if progress.dispatchable() is not None or progress.thinking_exceeded():
+                    early_stop = not chunk.done
+                    break
+        finally:
+            await stream.aclose()
+
+        if early_stop and progress.thinking_exceeded():
+            tracer.event("model.thinking_cap", backend="ollama", thinking_tokens=progress.thinking_tokens,
+                         limit=self.max_thinking_tokens)
+            print(f"thinking 超過 {self.max_thinking_tokens} tokens，改為不使用 thinking 重新生成")
+            return await self._astream(client, dict(kwargs, think=False))
+
+        thinking = "".join(progress.thinking)
+        if progress.tool_calls:
+            result = {"response": thinking, "tool_calls": progress.tool_calls}
+        else:
+            # 與非串流模式相同：沒有工具調用時，thinking 內容可能是直接輸出的 JSON
+            result = self._parse_text(thinking)
+        if not isinstance(result, dict):
+            return result
+        done = last is not None and last.done
+        result["usage"] = dict(
+            progress.usage(early_stop),
+            input_tokens=getattr(last, "prompt_eval_count", None) if done else None,
+            # 提前結束時伺服器不會回報 eval_count，改用已收到的內容估計
+            output_tokens=getattr(last, "eval_count", None) if done else progress.thinking_tokens + progress.text_tokens,
+            server_seconds=(getattr(last, "total_duration", None) or 0) / 1e9 or None if done else None,
+        )
+        return result
+
+    @staticmethod
+    def _with_usage(result: Any, response: ChatResponse) -> Any:
+        """
+        把 token 數與伺服器端計時加到回應的 "usage"，供追蹤記錄使用。
+        非串流模式下以模型載入加上提示處理的時間作為首個 token 的時間 (ttft)。
+        """
+        if isinstance(result, dict):
+            durations = [getattr(response, name, None) for name in ("load_duration", "prompt_eval_duration")]
+            result["usage"] = {
+                "input_tokens": getattr(response, "prompt_eval_count", None),
+                "output_tokens": getattr(response, "eval_count", None),
+                "ttft": sum(d for d in durations if d) / 1e9 if any(durations) else None,
+                "server_seconds": (getattr(response, "total_duration", None) or 0) / 1e9 or None,
+            }
+        return result
+
+    def _report_error(self, e: Exception) -> Dict[str, Any]:
+        """印出錯誤資訊（重試次數用盡或無法重試的錯誤），回傳錯誤回應"""
+        tracer.event("model.error", backend="ollama", error=f"{type(e).__name__}: {e}"[:300])
+        print(f"================== OLLAMA Error ==================")
+        print(f"Error type: {type(e)}")
+        print(f"Error message: {str(e)}")
+        return {
+            "response": f"Error calling Ollama: {str(e)}",
+            "tool_calls": []
+        }
+
+    def _parse_response(self, response: ChatResponse) -> Dict[str, Any]:
+        """將 Ollama 回應解析為 {"response", "tool_calls"} 格式"""
+        # pprint(response)
+        # --- 針對你提供的格式進行解析 ---
+        # response 是一個 ChatResponse 物件
+        # response.message 是一個 Message 物件
+        # with open("ollama_response_log.txt", "a", encoding="utf-8") as log_file:
+        #     log_file.write(response, ensure_ascii=False, indent=2)
+        #     log_file.write("\n\n====================\n\n")
+        message = response.message
+
+        content = message.thinking or ""
+        tool_calls = getattr(message, 'tool_calls', []) # 這是 Object 的 list，不是 dict
+
+        # 1. 檢查是否有原生的工具調用 (Tool Calls)
+        if tool_calls:
+            formatted_tool_calls = []
+            for tc in tool_calls:
+                # tc.function 是一個物件，包含 name 和 arguments
+                formatted_tool_calls.append({
+                    "tool": tc.function.name,
+                    "parameters": tc.function.arguments # Ollama 庫通常會自動解析 JSON 參數為 dict
+                })
+
+            return {
+                "response": content, # 可能會有思維過程或空字串
+                "tool_calls": formatted_tool_calls
+            }
+
+        return self._parse_text(content)
+
+    @staticmethod
+    def _parse_text(content: str) -> Dict[str, Any]:
+        # 2. 如果沒有工具調用，嘗試解析內容是否為 JSON (為了相容某些 Prompt 寫法)
+        # 你的 Log 顯示 content 是一大段 Markdown 文字，這通常會進入這裡並回傳純文字
+        try:
+            # 嘗試解析 JSON (有些 Prompt 要求直接輸出 JSON 字串)
+            # 只有當內容看起來像 JSON 時才嘗試
+            if content.strip().startswith('{') and content.strip().endswith('}'):
+                result = json.loads(content)
+                return result
+        except json.JSONDecodeError:
+            pass
 
-            except Exception as e:
-                print(f"================== OLLAMA Error (Try {current_try + 1}/{max_try}) ==================")
-                print(f"Error type: {type(e)}")
-                print(f"Error message: {str(e)}")
-                # 如果是物件存取錯誤，印出 dir 來看屬性
-                if 'response' in locals():
-                    print(f"Response object dir: {dir(response)}")
-                
-                current_try += 1
-                if current_try >= max_try:
-                    return {
-                        "response": f"Error calling Ollama: {str(e)}",
-                        "tool_calls": []
-                    }
\ No newline at end of file
+        # 3. 回傳一般文字回應
+        return {
+            "response": content,
+            "tool_calls": []
+        }
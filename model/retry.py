@@ -0,0 +1,214 @@
+# model/retry.py
+import asyncio
+import os
+import random
+import re
+import threading
+import time
+from typing import Any, Awaitable, Callable, Optional
+
+from tracing import tracer
+
+try:
+    import httpx  # ollama 的相依套件，連線與逾時錯誤都是 httpx.TransportError
+except ImportError:
+    httpx = None
+
+# 可以重試的 HTTP 狀態碼：逾時、衝突、限流與伺服器錯誤；其他 4xx（金鑰錯誤、參數錯誤、模型不存在）直接失敗
+RETRYABLE_STATUS = {408, 409, 425, 429, 500, 502, 503, 504}
+
+
+class MalformedResponse(Exception):
+    """模型回應無法解析（例如 Gemini 的 MALFORMED_FUNCTION_CALL），重新送出請求可能會成功"""
+
+
+def status_code(exc: BaseException) -> Optional[int]:
+    """取出例外中的 HTTP 狀態碼：ollama.ResponseError.status_code、google api_core 的 code、httpx 的 response"""
+    for attr in ("status_code", "code"):
+        value = getattr(exc, attr, None)
+        if isinstance(value, int) and not isinstance(value, bool):
+            return int(value)
+    value = getattr(getattr(exc, "response", None), "status_code", None)
+    return value if isinstance(value, int) else None
+
+
+def is_retryable(exc: BaseException) -> bool:
+    if isinstance(exc, MalformedResponse):
+        return True
+    code = status_code(exc)
+    if code is not None:
+        return code in RETRYABLE_STATUS
+    if isinstance(exc, (TimeoutError, asyncio.TimeoutError, ConnectionError)):
+        return True
+    return httpx is not None and isinstance(exc, httpx.TransportError)
+
+
+def retry_after(exc: BaseException) -> Optional[float]:
+    """伺服器建議的等待秒數：Retry-After 標頭，或 Gemini 429 錯誤中的 retry_delay / "retry in Ns" """
+    headers = getattr(getattr(exc, "response", None), "headers", None)
+    if headers is not None:
+        value = headers.get("retry-after")
+        if value:
+            try:
+                return float(value)
+            except ValueError:
+                pass
+    text = str(exc)
+    match = re.search(r"retry in ([\d.]+)\s*s", text, re.I) or re.search(r"retry_delay\s*\{\s*seconds:\s*(\d+)", text)
+    return float(match.group(1)) if match else None
+
+
+class RetryPolicy:
+    """
+    指數退避加上隨機抖動的重試策略：第 n 次失敗後等待 base_delay * 2^(n-1) 的一半到全部之間的隨機秒數，
+    不超過 max_delay；伺服器有提供建議等待時間時至少等待該時間。
+    """
+
+    def __init__(self, max_attempts: int = 3, base_delay: float = 2.0, max_delay: float = 60.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    @classmethod
+    def from_env(cls, prefix: str) -> "RetryPolicy":
+        """讀取 <prefix>_MAX_RETRIES、<prefix>_RETRY_BASE_DELAY、<prefix>_RETRY_MAX_DELAY"""
+        return cls(
+            max_attempts=int(os.getenv(f"{prefix}_MAX_RETRIES", "3")),
+            base_delay=float(os.getenv(f"{prefix}_RETRY_BASE_DELAY", "2")),
+            max_delay=float(os.getenv(f"{prefix}_RETRY_MAX_DELAY", "60")),
+        )
+
+    def should_retry(self, exc: BaseException, attempt: int) -> bool:
+        return attempt < self.max_attempts and is_retryable(exc)
+
+    def delay(self, attempt: int, hint: Optional[float] = None) -> float:
+        backoff = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        delay = random.uniform(backoff / 2, backoff)
+        if hint is not None:
+            delay = max(delay, hint + random.uniform(0, self.base_delay / 2))
+        return delay
+
+
+class TokenBucket:
+    """容量為 capacity、每 period 秒補滿一次的 token bucket；允許預支成負值，由呼叫端等待到補回為止"""
+
+    def __init__(self, capacity: float, period: float = 60.0):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.level = capacity
+        self.updated = time.monotonic()
+
+    def take(self, amount: float, now: float) -> float:
+        """扣除 amount，回傳需要等待的秒數"""
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+        self.level -= min(amount, self.capacity)
+        return -self.level / self.rate if self.level < 0 else 0.0
+
+
+class RateLimiter:
+    """
+    用戶端限流：同時限制每分鐘請求數 (RPM) 與每分鐘 token 數 (TPM)，0 表示不限制。
+    每次請求先預約額度，額度不足的請求依預約順序等待，同時批改多位學生時可以用滿配額而不觸發伺服器端的 429。
+    """
+
+    def __init__(self, requests_per_minute: float = 0, tokens_per_minute: float = 0):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute > 0 else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute > 0 else None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, prefix: str) -> "RateLimiter":
+        """讀取 <prefix>_RPM 與 <prefix>_TPM"""
+        return cls(float(os.getenv(f"{prefix}_RPM", "0")), float(os.getenv(f"{prefix}_TPM", "0")))
+
+    @property
+    def enabled(self) -> bool:
+        return self.requests is not None or self.tokens is not None
+
+    def _reserve(self, tokens: int) -> float:
+        with self._lock:
+            now = time.monotonic()
+            wait = 0.0
+            if self.requests is not None:
+                wait = max(wait, self.requests.take(1, now))
+            if self.tokens is not None:
+                wait = max(wait, self.tokens.take(tokens, now))
+            return wait
+
+    def _report(self, wait: float, tokens: int) -> None:
+        tracer.event("rate_limit.wait", seconds=round(wait, 3), tokens=tokens)
+
+    async def acquire(self, tokens: int = 0) -> None:
+        if not self.enabled:
+            return
+        wait = self._reserve(tokens)
+        if wait > 0:
+            self._report(wait, tokens)
+            await asyncio.sleep(wait)
+
+    def acquire_sync(self, tokens: int = 0) -> None:
+        if not self.enabled:
+            return
+        wait = self._reserve(tokens)
+        if wait > 0:
+            self._report(wait, tokens)
+            time.sleep(wait)
+
+    def settle(self, estimated: int, result: Any) -> None:
+        """回應中有實際用量（輸入 + 輸出 token）時，補扣與預估值之間的差額"""
+        usage = result.get("usage") if isinstance(result, dict) else None
+        if self.tokens is None or not usage:
+            return
+        actual = (usage.get("input_tokens") or 0) + (usage.get("output_tokens") or 0)
+        if actual:
+            with self._lock:
+                self.tokens.level -= actual - estimated
+
+
+def _on_retry(label: str, policy: RetryPolicy, attempt: int, exc: BaseException) -> float:
+    delay = policy.delay(attempt, retry_after(exc))
+    tracer.event("model.retry", backend=label, attempt=attempt, delay=round(delay, 3),
+                 status=status_code(exc), error=f"{type(exc).__name__}: {exc}"[:300])
+    print(f"{label} 請求失敗（第 {attempt}/{policy.max_attempts} 次）：{type(exc).__name__}: {exc}，{delay:.1f} 秒後重試")
+    return delay
+
+
+async def acall_with_retry(call: Callable[[], Awaitable[Any]], policy: RetryPolicy, limiter: Optional[RateLimiter] = None,
+                           tokens: int = 0, label: str = "model") -> Any:
+    """每次嘗試前先向 limiter 取得額度，可重試的錯誤依 policy 等待後重新送出請求，其餘錯誤直接拋出"""
+    attempt = 0
+    while True:
+        attempt += 1
+        if limiter is not None:
+            await limiter.acquire(tokens)
+        try:
+            result = await call()
+        except Exception as e:
+            if not policy.should_retry(e, attempt):
+                raise
+            await asyncio.sleep(_on_retry(label, policy, attempt, e))
+            continue
+        if limiter is not None:
+            limiter.settle(tokens, result)
+        return result
+
+
+def call_with_retry(call: Callable[[], Any], policy: RetryPolicy, limiter: Optional[RateLimiter] = None,
+                    tokens: int = 0, label: str = "model") -> Any:
+    """acall_with_retry 的同步版本"""
+    attempt = 0
+    while True:
+        attempt += 1
+        if limiter is not None:
+            limiter.acquire_sync(tokens)
+        try:
+            result = call()
+        except Exception as e:
+            if not policy.should_retry(e, attempt):
+                raise
+            time.sleep(_on_retry(label, policy, attempt, e))
+            continue
+        if limiter is not None:
+            limiter.settle(tokens, result)
+        return result
@@ -0,0 +1,86 @@
+# model/streaming.py
+import time
+from typing import Any, Dict, List, Optional
+
+from conversation import estimate_tokens
+from tracing import current_student
+
+# 收到這些工具調用（且參數齊全）就可以停止生成，main.py 只會處理第一個這類調用
+DISPATCH_TOOLS = ("write_grading_report", "unzip_folder")
+# 每生成多少 token 印出一次進度
+PROGRESS_EVERY = 512
+
+
+def tool_requirements(tools: Optional[list]) -> Dict[str, List[str]]:
+    """MCP 工具的必要參數：{工具名稱: [參數名稱, ...]}"""
+    requirements = {}
+    for tool in tools or []:
+        schema = getattr(tool, 'inputSchema', None) or {}
+        requirements[tool.name] = list(schema.get('required', []))
+    return requirements
+
+
+class StreamProgress:
+    """
+    串流生成時逐塊累積 thinking、文字與工具調用，並判斷何時可以提前結束：
+    收到參數齊全的 write_grading_report / unzip_folder 調用，或 thinking 超過 max_thinking_tokens。
+    """
+
+    def __init__(self, label: str, requirements: Dict[str, List[str]], max_thinking_tokens: int = 0):
+        self.label = label
+        self.requirements = requirements
+        self.max_thinking_tokens = max_thinking_tokens
+        self.started = time.perf_counter()
+        self.first_token: Optional[float] = None
+        self.thinking: List[str] = []
+        self.text: List[str] = []
+        self.tool_calls: List[Dict[str, Any]] = []
+        self.thinking_tokens = 0
+        self.text_tokens = 0
+        self.chunks = 0
+        self._reported = 0
+
+    def feed(self, thinking: Optional[str] = None, text: Optional[str] = None) -> None:
+        if not thinking and not text:
+            return
+        if self.first_token is None:
+            self.first_token = time.perf_counter()
+        self.chunks += 1
+        if thinking:
+            self.thinking.append(thinking)
+            self.thinking_tokens += estimate_tokens(thinking)
+        if text:
+            self.text.append(text)
+            self.text_tokens += estimate_tokens(text)
+        generated = self.thinking_tokens + self.text_tokens
+        if generated - self._reported >= PROGRESS_EVERY:
+            self._reported = generated
+            print(f"{current_student.get() or ''} {self.label} 生成中：thinking {self.thinking_tokens} / 文字 {self.text_tokens} tokens，"
+                  f"{time.perf_counter() - self.started:.1f} 秒")
+
+    def add_tool_call(self, name: str, arguments: Any) -> None:
+        if self.first_token is None:
+            self.first_token = time.perf_counter()
+        self.tool_calls.append({"tool": name, "parameters": arguments})
+
+    def dispatchable(self) -> Optional[Dict[str, Any]]:
+        """第一個可以立即執行的工具調用（名稱在 DISPATCH_TOOLS 中且必要參數齊全）"""
+        for call in self.tool_calls:
+            if call["tool"] in DISPATCH_TOOLS:
+                parameters = call["parameters"] or {}
+                if all(key in parameters for key in self.requirements.get(call["tool"], [])):
+                    return call
+        return None
+
+    def thinking_exceeded(self) -> bool:
+        return 0 < self.max_thinking_tokens <= self.thinking_tokens and not self.tool_calls
+
+    def usage(self, early_stop: bool) -> Dict[str, Any]:
+        """串流的計時與 token 數：首個 token 的時間、生成時間、是否提前結束"""
+        now = time.perf_counter()
+        return {
+            "ttft": round(self.first_token - self.started, 3) if self.first_token is not None else None,
+            "stream_seconds": round(now - self.started, 3),
+            "thinking_tokens": self.thinking_tokens,
+            "early_stop": early_stop,
+        }
@@ -0,0 +1,171 @@
+# prescreen.py
+import ast
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from file_collector import SOURCE_EXTENSIONS, SubmissionManifest
+from tools.extract import _pool_context
+from tracing import tracer
+
+# 模型要求解壓縮 (KEEP) 幾次後仍沒有程式碼，就依評分標準的零分條件 4 直接給 0 分
+MAX_EXTRACT_ATTEMPTS = 2
+
+
+def _submitted_files(manifest: SubmissionManifest, limit: int = 5) -> str:
+    names = [os.path.basename(entry.rel_path) for entry in manifest.entries]
+    if not names:
+        return "沒有任何檔案"
+    listed = "、".join(names[:limit])
+    return listed + (f" 等 {len(names)} 個檔案" if len(names) > limit else "")
+
+
+def zero_score_reason(manifest: SubmissionManifest, archive_errors: Optional[List[str]] = None,
+                      extract_attempts: int = 0) -> Optional[str]:
+    """
+    在本機檢查評分標準中機械性的「零分條件」，符合時回傳寫在評語中的原因，不需要呼叫模型。
+
+    1. 沒有程式碼也沒有壓縮檔（例如只繳交截圖）
+    2. 有程式碼副檔名的檔案，但內容全部是空的或是二進位資料
+    3. 程式碼只可能在壓縮檔裡，但壓縮檔無法讀取（虛擬檔案系統模式），或模型已經嘗試解壓縮 MAX_EXTRACT_ATTEMPTS 次仍沒有程式碼
+    """
+    code = [e for e in manifest.entries if e.kind in ('c', 'h', 'cpp', 'py') and e.content is not None]
+    if any(e.content.strip() for e in code) or any(e.truncated for e in code):
+        return None
+    if manifest.archives:
+        # 程式碼可能還在壓縮檔裡，只有確定無法解壓縮時才給 0 分
+        if archive_errors:
+            return "零分：經多次嘗試仍無法讀取檔案，檔案可能損毀或格式錯誤（" + "；".join(archive_errors) + "）。"
+        if extract_attempts >= MAX_EXTRACT_ATTEMPTS:
+            return f"零分：經多次嘗試仍無法讀取檔案，檔案可能損毀或格式錯誤（{'、'.join(manifest.archives)}）。"
+        return None
+    if code:
+        return f"零分：程式碼檔案內容為空（{'、'.join(e.rel_path for e in code)}），視為未繳交程式碼。"
+    named_code = [e.rel_path for e in manifest.entries if os.path.splitext(e.rel_path.lower())[1] in SOURCE_EXTENSIONS]
+    if named_code:
+        return f"零分：程式碼檔案無法讀取或為二進位資料（{'、'.join(named_code)}），視為未繳交程式碼。"
+    return f"零分：未檢測到程式碼檔案或壓縮檔，視為未繳交（繳交內容：{_submitted_files(manifest)}）。"
+
+
+class _Metrics(ast.NodeVisitor):
+    def __init__(self):
+        self.functions = 0
+        self.classes = 0
+        self.loops = 0
+        self.branches = 0
+        self.calls = set()
+        self.depth = 0
+        self.max_depth = 0
+
+    def _nested(self, node) -> None:
+        self.depth += 1
+        self.max_depth = max(self.max_depth, self.depth)
+        self.generic_visit(node)
+        self.depth -= 1
+
+    def visit_FunctionDef(self, node) -> None:
+        self.functions += 1
+        self.generic_visit(node)
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def visit_ClassDef(self, node) -> None:
+        self.classes += 1
+        self.generic_visit(node)
+
+    def visit_For(self, node) -> None:
+        self.loops += 1
+        self._nested(node)
+
+    visit_While = visit_For
+    visit_AsyncFor = visit_For
+
+    def visit_If(self, node) -> None:
+        self.branches += 1
+        self._nested(node)
+
+    def visit_Call(self, node) -> None:
+        if isinstance(node.func, ast.Name):
+            self.calls.add(node.func.id)
+        self.generic_visit(node)
+
+
+def analyze_python(rel_path: str, content: str) -> Dict:
+    """以 ast.parse 檢查單一 Python 檔案：語法錯誤的位置，或函數、迴圈、判斷式數量等基本指標"""
+    lines = [line for line in content.splitlines() if line.strip() and not line.lstrip().startswith('#')]
+    result = {"path": rel_path, "lines": len(lines)}
+    try:
+        tree = ast.parse(content, filename=rel_path)
+    except SyntaxError as e:
+        result["syntax_error"] = {"line": e.lineno, "column": e.offset, "message": e.msg,
+                                  "text": (e.text or "").strip()[:120]}
+        return result
+    except ValueError as e:  # 例如內容含有 NUL 字元
+        result["syntax_error"] = {"line": None, "column": None, "message": str(e), "text": ""}
+        return result
+    metrics = _Metrics()
+    metrics.visit(tree)
+    result.update(functions=metrics.functions, classes=metrics.classes, loops=metrics.loops,
+                  branches=metrics.branches, max_nesting=metrics.max_depth,
+                  uses_input="input" in metrics.calls, uses_print="print" in metrics.calls)
+    return result
+
+
+def analyze_files(files: List[Tuple[str, str]]) -> List[Dict]:
+    return [analyze_python(rel_path, content) for rel_path, content in files]
+
+
+def format_facts(results: List[Dict]) -> str:
+    """把靜態分析結果寫成提示中的條列事實"""
+    lines = []
+    for result in results:
+        error = result.get("syntax_error")
+        if error:
+            where = f"第 {error['line']} 行第 {error['column']} 欄" if error["line"] else "無法解析"
+            text = f"：{error['text']}" if error["text"] else ""
+            lines.append(f"- {result['path']}：語法錯誤，{where}，{error['message']}{text}（程式無法執行）")
+            continue
+        used = [name for name, flag in (("input()", result["uses_input"]), ("print()", result["uses_print"])) if flag]
+        lines.append(
+            f"- {result['path']}：語法正確，{result['lines']} 行程式碼，函數 {result['functions']} 個，"
+            f"迴圈 {result['loops']} 個，判斷式 {result['branches']} 個，最深巢狀 {result['max_nesting']} 層"
+            + (f"，使用 {'、'.join(used)}" if used else "，未使用 input() 或 print()")
+        )
+    return "\n".join(lines)
+
+
+class StaticAnalyzer:
+    """
+    在行程池中對 Python 檔案執行 ast.parse，解析不會佔用事件迴圈所在的 CPU，
+    多位學生同時批改時可以平行處理。行程池在第一次使用時才建立，無法使用時改在目前的行程中執行。
+    """
+
+    def __init__(self, max_workers: Optional[int] = None):
+        self.max_workers = max_workers or min(4, os.cpu_count() or 1)
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    async def analyze(self, manifest: SubmissionManifest) -> str:
+        files = [(e.rel_path, e.content) for e in manifest.entries if e.kind == 'py' and e.content is not None]
+        if not files:
+            return ""
+        with tracer.span("prescreen.ast", files=len(files)) as span:
+            try:
+                if self._pool is None:
+                    # 與解壓縮的行程池相同，不以 fork 複製有事件迴圈與執行緒的主程式
+                    self._pool = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=_pool_context())
+                results = await asyncio.get_running_loop().run_in_executor(self._pool, analyze_files, files)
+            except Exception as e:
+                print(f"無法使用行程池進行靜態分析，改在目前的行程中執行：{e}")
+                results = analyze_files(files)
+            span.set(syntax_errors=sum(1 for r in results if "syntax_error" in r))
+        return format_facts(results)
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+
+# 整個程式共用的靜態分析器
+analyzer = StaticAnalyzer()
@@ -0,0 +1,186 @@
+# prompt_builder.py
+from typing import Dict, List, Optional, Tuple
+
+from conversation import estimate_tokens
+from tracing import tracer
+
+# 程式碼區段的順序與標題；other 為非程式碼的文字檔，只有在預算還有剩時才放進提示
+SECTIONS = [
+    ("c", "C 檔案"),
+    ("cpp", "CPP 檔案"),
+    ("h", "標頭檔"),
+    ("py", "Python 檔案"),
+    ("makefile", "Makefile 檔案"),
+    ("other", "其他檔案"),
+]
+
+
+class BuiltPrompt:
+    """組合完成的提示與預算使用情形"""
+
+    def __init__(self, text: str, tokens: int, budget: int, truncated: List[str], omitted: List[str]):
+        self.text = text
+        self.tokens = tokens
+        self.budget = budget
+        self.truncated = truncated  # 內容被截斷的檔案
+        self.omitted = omitted      # 因預算不足完全省略的檔案
+
+    def summary(self) -> str:
+        message = f"提示約 {self.tokens} / {self.budget} tokens"
+        if self.truncated:
+            message += f"，截斷 {len(self.truncated)} 個檔案"
+        if self.omitted:
+            message += f"，省略 {len(self.omitted)} 個檔案"
+        return message
+
+
+def truncate_text(content: str, max_tokens: int) -> Tuple[str, bool]:
+    """
+    將內容限制在 max_tokens 內：保留開頭約 2/3 與結尾約 1/3 的行，中間以明確的標記取代。
+
+    Returns:
+        (處理後的內容, 是否有截斷)
+    """
+    if estimate_tokens(content) <= max_tokens:
+        return content, False
+    lines = content.split('\n')
+    head_budget = max_tokens * 2 // 3
+    tail_budget = max_tokens - head_budget
+    head, used = [], 0
+    for line in lines:
+        cost = estimate_tokens(line) + 1
+        if used + cost > head_budget:
+            break
+        head.append(line)
+        used += cost
+    tail, used = [], 0
+    for line in reversed(lines[len(head):]):
+        cost = estimate_tokens(line) + 1
+        if used + cost > tail_budget:
+            break
+        tail.append(line)
+        used += cost
+    tail.reverse()
+    if not head and not tail:
+        # 單一超長行（例如壓縮過的資料），直接以字元截斷
+        return content[:max_tokens] + f"\n... [已截斷，原始內容約 {estimate_tokens(content)} tokens] ...", True
+    first_omitted = len(head) + 1
+    last_omitted = len(lines) - len(tail)
+    marker = f"... [已省略第 {first_omitted}-{last_omitted} 行，共 {len(lines)} 行，原始內容約 {estimate_tokens(content)} tokens] ..."
+    return '\n'.join(head + [marker] + tail), True
+
+
+class PromptBuilder:
+    """
+    在 token 預算內組合單一學生的提示。
+
+    程式碼檔案優先於其他檔案，單一檔案超過 max_file_tokens 時會截斷，
+    剩餘預算不足時檔案會被省略並在提示中留下標記，讓模型知道內容不完整。
+    """
+
+    # 其他檔案（非程式碼）每個最多佔用的 token 數
+    max_other_file_tokens = 500
+    # 檔案結構最多列出的項目數
+    max_structure_entries = 200
+
+    def __init__(self, max_tokens: int = 12000, max_file_tokens: int = 4000):
+        self.max_tokens = max_tokens
+        self.max_file_tokens = max_file_tokens
+
+    def build(self, student_id: str, student_name: str, file_structure: List[str],
+              files: Dict[str, List[Tuple[str, str]]], output_path: Optional[str],
+              no_code_hint: Optional[str] = None, facts: Optional[str] = None) -> BuiltPrompt:
+        """
+        Args:
+            files: {"c" | "cpp" | "h" | "py" | "makefile" | "other": [(相對路徑, 內容), ...]}
+            output_path: 評分報告的輸出路徑；批次評分時為 None，不在提示中要求輸出路徑
+            no_code_hint: 沒有任何程式碼時要放在程式碼區段的說明
+            facts: 本機檢查的結果（語法錯誤位置、基本指標與測試執行結果），放在程式碼之前
+        """
+        with tracer.span("prompt.build") as span:
+            built = self._build(student_id, student_name, file_structure, files, output_path, no_code_hint, facts)
+            span.set(tokens=built.tokens, budget=built.budget, truncated=len(built.truncated), omitted=len(built.omitted))
+        return built
+
+    def _build(self, student_id: str, student_name: str, file_structure: List[str],
+               files: Dict[str, List[Tuple[str, str]]], output_path: Optional[str],
+               no_code_hint: Optional[str], facts: Optional[str] = None) -> BuiltPrompt:
+        structure = file_structure[:self.max_structure_entries]
+        if len(file_structure) > len(structure):
+            structure.append(f"...（另有 {len(file_structure) - len(structure)} 個項目未列出）")
+        facts_block = f"本機檢查結果（實際解析與執行程式得到的事實）：\n{facts}\n\n" if facts else ""
+        header = f"""請評分以下學生的作業：
+
+學號：{student_id}\n
+姓名：{student_name}\n
+
+檔案結構:\n
+{chr(10).join(structure)}
+
+{facts_block}程式碼：
+"""
+        footer = ""
+        if output_path is not None:
+            footer = f"""
+
+請確保評分報告的輸出路徑為：{output_path}
+            """
+        remaining = self.max_tokens - estimate_tokens(header) - estimate_tokens(footer)
+        truncated = []
+        omitted = []
+
+        body = ""
+        if no_code_hint is not None:
+            body = no_code_hint
+        else:
+            for kind, title in SECTIONS:
+                entries = []
+                for rel_path, content in files.get(kind, []):
+                    per_file = self.max_other_file_tokens if kind == "other" else self.max_file_tokens
+                    limit = min(per_file, remaining)
+                    if limit < 50:
+                        omitted.append(rel_path)
+                        entries.append(f"檔案：{rel_path}\n[因提示長度上限已省略此檔案]")
+                        continue
+                    text, was_truncated = truncate_text(content, limit)
+                    if was_truncated:
+                        truncated.append(rel_path)
+                    entry = f"檔案：{rel_path}\n內容：\n{text}\n"
+                    remaining -= estimate_tokens(entry)
+                    entries.append(entry)
+                if entries:
+                    body += f"\n\n{title}：\n" + "\n---\n".join(entries)
+
+        text = header + body + footer
+        return BuiltPrompt(text, estimate_tokens(text), self.max_tokens, truncated, omitted)
+
+    def build_diff(self, student_id: str, student_name: str, reference: dict, output_path: str) -> BuiltPrompt:
+        """
+        近似重複作業的提示：不附上完整程式碼，只附上已評分作業的評分報告與兩份程式碼的差異，請模型依差異調整評分。
+
+        Args:
+            reference: {"student": 已評分作業的資料夾名稱, "similarity": 相似度, "report": 評分報告, "diff": unified diff}
+        """
+        with tracer.span("prompt.build", mode="diff") as span:
+            report, report_truncated = truncate_text(reference["report"], self.max_other_file_tokens * 2)
+            diff, diff_truncated = truncate_text(reference["diff"] or "（程式碼只有空白、註解或名稱不同）", self.max_file_tokens)
+            text = f"""請評分以下學生的作業：
+
+學號：{student_id}\n
+姓名：{student_name}\n
+
+這份作業與 {reference["student"]} 的作業高度相似（相似度約 {reference["similarity"]:.0%}），該作業已完整評分，評分報告如下：
+{report}
+
+兩份作業程式碼的差異如下（unified diff，- 為已評分的作業，+ 為這位學生的作業）：
+{diff}
+
+請依評分標準判斷這些差異對功能與品質的影響並調整分數與評語；差異不影響功能時可給相同的分數。
+評語請針對這位學生的作業撰寫，並使用 write_grading_report 工具輸出評分報告。
+
+請確保評分報告的輸出路徑為：{output_path}
+            """
+            truncated = [name for name, was_truncated in (("評分報告", report_truncated), ("差異", diff_truncated)) if was_truncated]
+            built = BuiltPrompt(text, estimate_tokens(text), self.max_tokens, truncated, [])
+            span.set(tokens=built.tokens, budget=built.budget, truncated=len(built.truncated), omitted=0)
+        return built
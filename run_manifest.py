@@ -0,0 +1,119 @@
+# run_manifest.py
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from typing import Any, Dict, List, Optional, Set
+
+
+def rubric_hash(rubric: str) -> str:
+    return hashlib.sha256(rubric.encode('utf-8')).hexdigest()
+
+
+class RunManifest:
+    """
+    以 SQLite 記錄每位學生的批改狀態，取代只靠「grading_report.txt 是否存在」判斷是否批改過。
+
+    每位學生（以班級壓縮檔名稱 + 學生資料夾名稱識別）記錄：作業內容雜湊、解壓縮方式、評分標準雜湊、模型、
+    嘗試次數、耗時、token 數、分數、報告路徑與錯誤訊息。狀態為 pending → grading → done / failed，
+    程式中斷時停在 grading 的學生，下次以 --incremental 執行時會重新批改。
+    """
+
+    def __init__(self, path: str = '.cache/run_manifest.sqlite'):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS submissions ("
+            "archive TEXT NOT NULL, student TEXT NOT NULL, "
+            "content_hash TEXT, extraction TEXT, rubric_hash TEXT, model TEXT, "
+            "status TEXT NOT NULL DEFAULT 'pending', attempts INTEGER NOT NULL DEFAULT 0, "
+            "latency REAL, input_tokens INTEGER, output_tokens INTEGER, score REAL, "
+            "report_path TEXT, error TEXT, updated REAL, "
+            "PRIMARY KEY (archive, student))"
+        )
+        self._conn.commit()
+        self.archive: Optional[str] = None
+        self.fingerprints: Dict[str, str] = {}
+        self.rubric_hash: Optional[str] = None
+        self.model: Optional[str] = None
+
+    def begin(self, archive: str, fingerprints: Dict[str, str], rubric: str, model_identity: Dict[str, Any]) -> None:
+        """設定這次執行的班級壓縮檔、每位學生的內容雜湊、評分標準與模型，並為新出現的學生建立 pending 紀錄"""
+        self.archive = archive
+        self.fingerprints = fingerprints
+        self.rubric_hash = rubric_hash(rubric)
+        self.model = json.dumps(model_identity, sort_keys=True, ensure_ascii=False, default=str)
+        self._conn.executemany(
+            "INSERT OR IGNORE INTO submissions (archive, student, content_hash, updated) VALUES (?, ?, ?, ?)",
+            [(archive, student, digest, time.time()) for student, digest in fingerprints.items()]
+        )
+        self._conn.commit()
+
+    def plan(self) -> Set[str]:
+        """
+        需要批改的學生：沒有完成紀錄、上次中斷或失敗、作業內容改變、評分標準或模型改變，或報告已被刪除。
+        只讀取資料庫與檢查報告是否存在，不需要走訪或讀取學生資料夾。
+        """
+        rows = {row["student"]: row for row in self._conn.execute(
+            "SELECT * FROM submissions WHERE archive = ?", (self.archive,))}
+        todo = set()
+        for student, digest in self.fingerprints.items():
+            row = rows.get(student)
+            if (row is None or row["status"] != "done" or row["content_hash"] != digest
+                    or row["rubric_hash"] != self.rubric_hash or row["model"] != self.model
+                    or not row["report_path"] or not os.path.exists(row["report_path"])):
+                todo.add(student)
+        return todo
+
+    def start(self, student: str, extraction: str) -> None:
+        """開始批改一位學生：狀態改為 grading 並累加嘗試次數"""
+        self._conn.execute(
+            "INSERT INTO submissions (archive, student, content_hash, extraction, rubric_hash, model, status, attempts, error, updated) "
+            "VALUES (?, ?, ?, ?, ?, ?, 'grading', 1, NULL, ?) "
+            "ON CONFLICT (archive, student) DO UPDATE SET content_hash = excluded.content_hash, "
+            "extraction = excluded.extraction, rubric_hash = excluded.rubric_hash, model = excluded.model, "
+            "status = 'grading', attempts = attempts + 1, error = NULL, updated = excluded.updated",
+            (self.archive, student, self.fingerprints.get(student), extraction, self.rubric_hash, self.model, time.time())
+        )
+        self._conn.commit()
+
+    def finish(self, student: str, status: str, latency: Optional[float] = None, usage: Optional[Dict[str, int]] = None,
+               score: Optional[float] = None, report_path: Optional[str] = None, error: Optional[str] = None) -> None:
+        """記錄批改結果；沒有提供的欄位保留原本的值"""
+        usage = usage or {}
+        self._conn.execute(
+            "INSERT INTO submissions (archive, student, content_hash, rubric_hash, model, status, updated) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (archive, student) DO UPDATE SET status = excluded.status, updated = excluded.updated",
+            (self.archive, student, self.fingerprints.get(student), self.rubric_hash, self.model, status, time.time())
+        )
+        self._conn.execute(
+            "UPDATE submissions SET latency = COALESCE(?, latency), input_tokens = COALESCE(?, input_tokens), "
+            "output_tokens = COALESCE(?, output_tokens), score = COALESCE(?, score), "
+            "report_path = COALESCE(?, report_path), error = ? WHERE archive = ? AND student = ?",
+            (latency, usage.get("input_tokens") or None, usage.get("output_tokens") or None, score,
+             report_path, error, self.archive, student)
+        )
+        self._conn.commit()
+
+    def failures(self, archive: Optional[str] = None) -> List[sqlite3.Row]:
+        """尚未完成（pending / grading / failed）的學生"""
+        query = "SELECT * FROM submissions WHERE status != 'done'"
+        params = ()
+        if archive is not None:
+            query += " AND archive = ?"
+            params = (archive,)
+        return self._conn.execute(query + " ORDER BY archive, student", params).fetchall()
+
+    def summary(self) -> str:
+        counts = dict(self._conn.execute(
+            "SELECT status, COUNT(*) FROM submissions WHERE archive = ? GROUP BY status", (self.archive,)).fetchall())
+        return "執行紀錄：" + "，".join(f"{status} {count}" for status, count in sorted(counts.items()))
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
@@ -0,0 +1,300 @@
+# similarity.py
+import difflib
+import json
+import keyword
+import os
+import re
+import sqlite3
+import time
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+# 小於 2^32 的最大質數；雜湊值與 MinHash 參數都小於它，a * x + b 不會超過 uint64
+PRIME = 4294967291
+
+C_KEYWORDS = {
+    'auto', 'break', 'case', 'char', 'const', 'continue', 'default', 'do', 'double', 'else', 'enum', 'extern',
+    'float', 'for', 'goto', 'if', 'inline', 'int', 'long', 'register', 'return', 'short', 'signed', 'sizeof',
+    'static', 'struct', 'switch', 'typedef', 'union', 'unsigned', 'void', 'volatile', 'while', 'bool', 'true',
+    'false', 'class', 'public', 'private', 'protected', 'new', 'delete', 'namespace', 'using', 'template',
+    'typename', 'this', 'virtual', 'include', 'define', 'ifdef', 'ifndef', 'endif', 'NULL', 'nullptr',
+}
+# 保留名稱的標準函式庫函數；其餘識別字一律視為同一個符號，只改變數名稱的抄襲仍會被找出
+LIBRARY_NAMES = {
+    'main', 'printf', 'scanf', 'puts', 'gets', 'fgets', 'getchar', 'putchar', 'malloc', 'calloc', 'realloc',
+    'free', 'strlen', 'strcpy', 'strcmp', 'strcat', 'memset', 'memcpy', 'sqrt', 'pow', 'abs', 'fopen', 'fclose',
+    'std', 'cout', 'cin', 'endl', 'string', 'vector',
+    'print', 'input', 'range', 'len', 'str', 'list', 'dict', 'set', 'open', 'append', 'sorted', 'sum', 'min', 'max',
+}
+PYTHON_KEYWORDS = set(keyword.kwlist)
+
+C_COMMENT_RE = re.compile(r'/\*.*?\*/|//[^\n]*', re.S)
+HASH_COMMENT_RE = re.compile(r'#[^\n]*')
+TOKEN_RE = re.compile(r"""
+    "(?:\\.|[^"\\\n])*" | '(?:\\.|[^'\\\n])*'   # 字串與字元常數
+  | [A-Za-z_]\w*                               # 識別字與關鍵字
+  | \d[\w.]*                                   # 數字
+  | ->|\+\+|--|&&|\|\||<<=?|>>=?|[-+*/%&|^!=<>]=
+  | \S
+""", re.X)
+
+
+def normalize_tokens(source: str, python: bool = False) -> List[str]:
+    """
+    去除註解與空白後切成 token：關鍵字、運算子與常用函式庫函數保留原樣，
+    其他識別字換成 ID、數字換成 NUM、字串換成 STR，只改空白、註解或變數名稱的作業會得到相同的 token。
+    """
+    source = HASH_COMMENT_RE.sub(' ', source) if python else C_COMMENT_RE.sub(' ', source)
+    keywords = PYTHON_KEYWORDS if python else C_KEYWORDS
+    tokens = []
+    for token in TOKEN_RE.findall(source):
+        first = token[0]
+        if first == '"' or first == "'":
+            tokens.append('STR')
+        elif first.isdigit():
+            tokens.append('NUM')
+        elif first.isalpha() or first == '_':
+            tokens.append(token if token in keywords or token in LIBRARY_NAMES else 'ID')
+        else:
+            tokens.append(token)
+    return tokens
+
+
+def submission_tokens(source_files: List[Tuple[str, str]]) -> List[str]:
+    """整份作業（依路徑排序的所有程式碼檔案）的 token"""
+    tokens = []
+    for rel_path, content in sorted(source_files):
+        lower = rel_path.lower()
+        tokens.extend(normalize_tokens(content, python=lower.endswith('.py') or lower.endswith('makefile')))
+    return tokens
+
+
+class MinHasher:
+    """
+    以 k 個連續 token 為一個 shingle，用 num_perm 組 (a * x + b) mod PRIME 的雜湊函數計算 MinHash 簽章。
+    兩份作業簽章中相同位置相等的比例即為 shingle 集合 Jaccard 相似度的估計值。
+    """
+
+    def __init__(self, num_perm: int = 128, shingle_size: int = 5, seed: int = 1):
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, PRIME, size=num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, PRIME, size=num_perm, dtype=np.uint64)
+
+    @property
+    def params(self) -> str:
+        return f"minhash:{self.num_perm}:{self.shingle_size}"
+
+    def shingles(self, tokens: List[str]) -> np.ndarray:
+        """每個 shingle 的雜湊值（去除重複）"""
+        if not tokens:
+            return np.empty(0, dtype=np.uint64)
+        ids = np.fromiter((zlib.crc32(token.encode('utf-8')) for token in tokens), dtype=np.uint64, count=len(tokens))
+        k = min(self.shingle_size, len(ids))
+        windows = np.lib.stride_tricks.sliding_window_view(ids, k)
+        hashes = np.zeros(len(windows), dtype=np.uint64)
+        for column in range(k):
+            # 以 2^64 為模的多項式雜湊，溢位時自然回繞
+            hashes = hashes * np.uint64(1000003) + windows[:, column]
+        return np.unique(hashes % np.uint64(PRIME))
+
+    def signature(self, source_files: List[Tuple[str, str]], chunk: int = 4096) -> Optional[np.ndarray]:
+        """整份作業的 MinHash 簽章 (uint32)；沒有任何程式碼時回傳 None"""
+        shingles = self.shingles(submission_tokens(source_files))
+        if not len(shingles):
+            return None
+        signature = np.full(self.num_perm, PRIME, dtype=np.uint64)
+        for start in range(0, len(shingles), chunk):
+            block = shingles[start:start + chunk]
+            values = (self.a[:, None] * block[None, :] + self.b[:, None]) % np.uint64(PRIME)
+            np.minimum(signature, values.min(axis=1), out=signature)
+        return signature.astype(np.uint32)
+
+
+def similar_pairs(signatures: np.ndarray, threshold: float, bands: int = 16,
+                  max_bucket: int = 32) -> List[Tuple[int, int, float]]:
+    """
+    LSH：把簽章切成 bands 段，任一段完全相同的兩份作業成為候選，再以整個簽章估計相似度，
+    只回傳相似度 >= threshold 的 (i, j, 相似度)。只比較候選配對，作業數量很多時也不需要兩兩比較。
+    """
+    count, num_perm = signatures.shape
+    if count < 2:
+        return []
+    rows = num_perm // bands
+    multipliers = np.random.default_rng(0).integers(1, 2 ** 63, size=rows, dtype=np.uint64)
+    candidates = set()
+    for band in range(bands):
+        chunk = signatures[:, band * rows:(band + 1) * rows].astype(np.uint64)
+        keys = (chunk * multipliers[None, :]).sum(axis=1)
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+        starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+        ends = np.r_[starts[1:], count]
+        for start, end in zip(starts, ends):
+            if end - start < 2:
+                continue
+            members = np.sort(order[start:end])
+            if len(members) > max_bucket:
+                # 很大的桶子只和第一份作業比較，避免候選配對數量隨人數平方成長
+                candidates.update((int(members[0]), int(member)) for member in members[1:])
+                continue
+            for x in range(len(members)):
+                for y in range(x + 1, len(members)):
+                    candidates.add((int(members[x]), int(members[y])))
+    if not candidates:
+        return []
+    pairs = np.array(sorted(candidates), dtype=np.int64)
+    scores = (signatures[pairs[:, 0]] == signatures[pairs[:, 1]]).mean(axis=1)
+    keep = scores >= threshold
+    return [(int(i), int(j), float(score)) for (i, j), score in zip(pairs[keep], scores[keep])]
+
+
+class Cluster:
+    """一組高度相似的作業：representative 完整評分，其餘成員與它比對差異"""
+
+    def __init__(self, representative: str, members: Dict[str, float]):
+        self.representative = representative
+        self.members = members  # {學生資料夾名稱: 與代表作業的相似度}
+
+    def to_dict(self) -> dict:
+        return {
+            "representative": self.representative,
+            "members": [{"student": name, "similarity": round(score, 3)} for name, score in sorted(self.members.items())],
+        }
+
+
+def cluster_signatures(signatures: Dict[str, np.ndarray], threshold: float, bands: int = 16,
+                       max_medoid: int = 500) -> List[Cluster]:
+    """
+    把相似度 >= threshold 的作業連成群組（相似關係遞移），每組以與其他成員平均相似度最高的作業為代表。
+    """
+    names = sorted(signatures)
+    if len(names) < 2:
+        return []
+    # 完全相同的簽章（直接複製的作業）先合併，只對不同的簽章做 LSH
+    unique, inverse, counts = np.unique(np.stack([signatures[name] for name in names]), axis=0,
+                                        return_inverse=True, return_counts=True)
+    inverse = inverse.ravel()
+    parent = list(range(len(unique)))
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i, j, _ in similar_pairs(unique, threshold, bands):
+        parent[find(i)] = find(j)
+    groups: Dict[int, List[int]] = {}
+    for i in range(len(unique)):
+        groups.setdefault(find(i), []).append(i)
+
+    by_signature: Dict[int, List[int]] = {}
+    for n, index in enumerate(inverse.tolist()):
+        by_signature.setdefault(index, []).append(n)
+
+    clusters = []
+    for indices in groups.values():
+        size = int(counts[indices].sum())
+        if size < 2:
+            continue
+        block = unique[indices]
+        if len(indices) <= max_medoid:
+            # 代表作業：與群組內所有作業（依份數加權）平均相似度最高的簽章
+            scores = np.stack([(block == row).mean(axis=1) for row in block])
+            leader = indices[int(np.argmax(scores @ counts[indices]))]
+        else:
+            leader = indices[int(np.argmax(counts[indices]))]
+        similarity = (block == unique[leader]).mean(axis=1).tolist()
+        representative = names[by_signature[leader][0]]
+        clusters.append(Cluster(representative, {
+            names[n]: score for index, score in zip(indices, similarity)
+            for n in by_signature[index] if names[n] != representative
+        }))
+    clusters.sort(key=lambda c: c.representative)
+    return clusters
+
+
+class SimilarityIndex:
+    """
+    以 SQLite 保存每份作業的 MinHash 簽章（以壓縮檔名稱 + 學生資料夾名稱識別），
+    讓這學期的作業也能和之前學期或其他班級的作業比對。
+    """
+
+    def __init__(self, path: str = '.cache/similarity_index.sqlite', params: str = ''):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS signatures ("
+            "archive TEXT NOT NULL, student TEXT NOT NULL, signature BLOB NOT NULL, updated REAL, "
+            "PRIMARY KEY (archive, student))"
+        )
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'params'").fetchone()
+        if row is None or row[0] != params:
+            # 簽章參數改變後舊的簽章無法比較，全部清除
+            self._conn.execute("DELETE FROM signatures")
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('params', ?)", (params,))
+        self._conn.commit()
+
+    def store(self, archive: str, signatures: Dict[str, np.ndarray]) -> None:
+        now = time.time()
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO signatures (archive, student, signature, updated) VALUES (?, ?, ?, ?)",
+            [(archive, student, signature.tobytes(), now) for student, signature in signatures.items()]
+        )
+        self._conn.commit()
+
+    def cross_matches(self, archive: str, signatures: Dict[str, np.ndarray], threshold: float,
+                      bands: int = 16) -> List[dict]:
+        """這次的作業與索引中其他壓縮檔的作業相似度 >= threshold 的配對"""
+        others = [(row[0], row[1], np.frombuffer(row[2], dtype=np.uint32))
+                  for row in self._conn.execute("SELECT archive, student, signature FROM signatures WHERE archive != ?", (archive,))]
+        if not others or not signatures:
+            return []
+        names = sorted(signatures)
+        matrix = np.stack([signatures[name] for name in names] + [signature for _, _, signature in others])
+        matches = []
+        for i, j, score in similar_pairs(matrix, threshold, bands):
+            if i < len(names) <= j:
+                other_archive, other_student, _ = others[j - len(names)]
+                matches.append({"student": names[i], "archive": other_archive, "other": other_student,
+                                "similarity": round(score, 3)})
+        return sorted(matches, key=lambda m: (m["student"], -m["similarity"]))
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+def source_text(source_files: List[Tuple[str, str]]) -> List[str]:
+    """依路徑排序合併所有程式碼檔案，每個檔案前加上路徑，供 source_diff 使用"""
+    lines = []
+    for rel_path, content in sorted(source_files):
+        lines.append(f"=== 檔案：{rel_path.replace(os.sep, '/')} ===")
+        lines.extend(content.replace('\r\n', '\n').split('\n'))
+    return lines
+
+
+def source_diff(reference_files: List[Tuple[str, str]], source_files: List[Tuple[str, str]]) -> str:
+    """已評分作業與這份作業的 unified diff（- 為已評分的作業，+ 為這份作業）"""
+    return '\n'.join(difflib.unified_diff(
+        source_text(reference_files), source_text(source_files),
+        fromfile='已評分的作業', tofile='這位學生的作業', lineterm='', n=2
+    ))
+
+
+def write_report(path: str, threshold: float, clusters: List[Cluster], cross_matches: List[dict]) -> None:
+    """寫出相似作業報告（JSON），可作為抄襲的參考訊號"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({
+            "threshold": threshold,
+            "clusters": [cluster.to_dict() for cluster in clusters],
+            "cross_archive": cross_matches,
+        }, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,48 @@
+import io
+import tarfile
+import zipfile
+
+from archive_vfs import ArchiveReader
+from file_collector import FileCollector
+from tools.extract import ExtractLimits
+
+MB = 1024 * 1024
+
+
+def _tar_gz(files):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as archive:
+        for name, data in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+def _read(tmp_path, files, limits=None):
+    source = tmp_path / "class.zip"
+    with zipfile.ZipFile(source, "w") as archive:
+        # 第二位學生讓 hw/ 成為放學生資料夾的最上層
+        archive.writestr("hw/222_B/main.py", b"print(2)\n")
+        for name, data in files.items():
+            archive.writestr(name, data)
+    reader = ArchiveReader(lambda: FileCollector(), limits=limits)
+    return {submission.name: submission for submission, _ in reader.read_class_archive(str(source), str(tmp_path / "v"))}
+
+
+def test_nested_tar_members_over_ratio_are_skipped(tmp_path):
+    nested = _tar_gz({"bomb.txt": b"\0" * (20 * MB), "main.py": b"print(1)\n"})
+    submission = _read(tmp_path, {"hw/111_A/sub.tar": nested})["111_A"]
+
+    entries = {entry.rel_path: entry for entry in submission.manifest.entries}
+    assert set(entries) == {"sub/main.py"}
+    assert entries["sub/main.py"].content == "print(1)\n"
+    assert any("bomb.txt" in error and "壓縮比" in error for error in submission.errors)
+
+
+def test_member_count_limit_applies_in_memory(tmp_path):
+    files = {f"hw/111_A/{index}.py": b"print(1)\n" for index in range(5)}
+    submission = _read(tmp_path, files, ExtractLimits(max_members=3))["111_A"]
+
+    assert len(submission.manifest.entries) == 3
+    assert submission.budget.skipped_count == 2
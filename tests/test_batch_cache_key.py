@@ -0,0 +1,64 @@
+import asyncio
+import os
+
+from benchmarks.fake_backend import FakeAgent
+from grading_cache import GradingCache
+from main import grade_single_student, make_student_state, prepare_batch_item
+
+
+class RecordingClient:
+    """只記錄工具調用的 MCP 客戶端"""
+
+    def __init__(self):
+        self.calls = []
+
+    async def call_tool(self, tool_name, arguments):
+        self.calls.append((tool_name, arguments))
+        return "ok"
+
+
+def _student(tmp_path, name="111_A"):
+    folder = tmp_path / name
+    folder.mkdir()
+    (folder / "main.py").write_text("n = int(input())\nprint(n * 2)\n", encoding="utf-8")
+    return str(folder)
+
+
+def _cache(tmp_path):
+    return GradingCache(str(tmp_path / "cache.sqlite"))
+
+
+def test_batch_hits_report_cached_by_single_grading(tmp_path):
+    folder, cache = _student(tmp_path), _cache(tmp_path)
+    model = FakeAgent(latency=0)
+    asyncio.run(grade_single_student(folder, model, RecordingClient(), make_student_state(folder), cache))
+    assert model.calls == 1
+
+    item = asyncio.run(prepare_batch_item(folder, model, make_student_state(folder), cache))
+    assert item is None
+
+
+def test_single_grading_hits_report_cached_by_batch(tmp_path):
+    folder, cache = _student(tmp_path), _cache(tmp_path)
+    model = FakeAgent(latency=0)
+    item = asyncio.run(prepare_batch_item(folder, model, make_student_state(folder), cache))
+    assert item is not None
+    cache.put(item.cache_key, {"score": 70, "comments": "批次評分"})
+
+    client = RecordingClient()
+    asyncio.run(grade_single_student(folder, model, client, make_student_state(folder), cache))
+    assert model.calls == 0
+    assert client.calls[0][1]["score"] == 70
+
+
+def test_diff_grading_is_not_reused_by_batch(tmp_path):
+    folder, cache = _student(tmp_path), _cache(tmp_path)
+    model = FakeAgent(latency=0)
+    state = make_student_state(folder)
+    state.reference = {"student": "222_B", "similarity": 0.95, "report": "分數：90", "diff": ""}
+    asyncio.run(grade_single_student(folder, model, RecordingClient(), state, cache))
+    assert model.calls == 1
+    assert not os.path.exists(os.path.join(folder, "grading_report.txt"))
+
+    item = asyncio.run(prepare_batch_item(folder, model, make_student_state(folder), cache))
+    assert item is not None
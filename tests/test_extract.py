@@ -0,0 +1,45 @@
+import io
+import os
+import zipfile
+
+from tools.extract import ExtractLimits, _plan_members, _stream_members, extract_archive
+
+KB = 1024
+
+
+def test_oversized_member_refunds_budget(tmp_path):
+    # 第一個成員宣告 800 KB 但實際更大，被拒絕後歸還的額度要讓後面 600 KB 的成員可以寫出
+    budget = ExtractLimits(max_total_mb=1).budget()
+    contents = {"lying.bin": b"x" * (900 * KB), "main.py": b"y" * (600 * KB)}
+    members = [("lying.bin", False, False, 800 * KB, 800 * KB, "lying.bin"),
+               ("main.py", False, False, 600 * KB, 600 * KB, "main.py")]
+    target = str(tmp_path / "out")
+    _stream_members("hw.zip", budget, _plan_members("hw.zip", target, budget, members),
+                    lambda member: io.BytesIO(contents[member]))
+
+    assert not os.path.exists(os.path.join(target, "lying.bin"))
+    with open(os.path.join(target, "main.py"), "rb") as f:
+        assert f.read() == contents["main.py"]
+    assert budget.written == 600 * KB
+    assert budget.members == 1
+    assert any("lying.bin" in record for record in budget.skipped)
+
+
+def test_corrupt_zip_member_refunds_budget(tmp_path):
+    source = str(tmp_path / "hw.zip")
+    with zipfile.ZipFile(source, "w", zipfile.ZIP_STORED) as archive:
+        archive.writestr("broken.bin", b"a" * (800 * KB))
+        archive.writestr("main.py", b"print(1)\n" * (60 * KB))
+    # 破壞第一個成員的內容，讀到結尾時 CRC 檢查失敗
+    with open(source, "r+b") as f:
+        data = f.read()
+        f.seek(data.index(b"a" * 1024) + 1024)
+        f.write(b"b")
+
+    budget = ExtractLimits(max_total_mb=1).budget()
+    target = str(tmp_path / "out")
+    assert extract_archive(source, target, budget) == ""
+
+    assert not os.path.exists(os.path.join(target, "broken.bin"))
+    assert os.path.getsize(os.path.join(target, "main.py")) == 9 * 60 * KB
+    assert budget.members == 1
@@ -0,0 +1,544 @@
+# tools/extract.py
+import logging
+import multiprocessing
+import os
+import re
+import tarfile
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+import py7zr
+import rarfile
+
+ARCHIVE_EXTENSIONS = ('.zip', '.rar', '.tar', '.7z')
+# Windows 上 WinRAR 的預設安裝位置
+WINRAR_UNRAR = "C:\\Program Files\\WinRAR\\UnRAR.exe"
+
+
+@lru_cache(maxsize=None)
+def configure_rar_tool() -> bool:
+    """
+    設定 rarfile 使用的外部解壓縮程式：UNRAR_TOOL 環境變數 > Windows 上的 WinRAR >
+    PATH 中的 unrar、unar、bsdtar 或 7z（rarfile 的預設值，Linux 上安裝任一個即可）。
+    找不到可用的程式時回傳 False，RAR 壓縮檔會在解壓縮時各自失敗，不影響其他格式。只會設定一次。
+    """
+    tool = os.getenv('UNRAR_TOOL') or (WINRAR_UNRAR if os.path.exists(WINRAR_UNRAR) else "")
+    if tool:
+        rarfile.UNRAR_TOOL = tool
+    try:
+        rarfile.tool_setup(force=True)
+    except rarfile.RarCannotExec:
+        logging.warning("找不到可以解壓縮 RAR 的程式（unrar、unar、bsdtar 或 7z），RAR 壓縮檔將無法解壓縮")
+        return False
+    return True
+
+
+# 串流複製時每次讀取的大小，記憶體用量與檔案大小無關
+CHUNK_BYTES = 1024 * 1024
+# 小於這個大小的檔案不檢查壓縮比（空白很多的小型文字檔壓縮比本來就很高）
+RATIO_MIN_BYTES = 1024 * 1024
+# 每次解壓縮工作最多保留的略過紀錄筆數，其餘只計數
+MAX_SKIPPED_RECORDS = 50
+
+
+class ExtractLimits:
+    """
+    解壓縮的上限，避免壓縮炸彈或意外的超大作業用完批改主機的記憶體或磁碟：
+    每位學生（包含所有巢狀壓縮檔）最多寫出 max_total_mb 與 max_members 個檔案，
+    單一檔案超過 1 MB 且壓縮比高於 max_ratio 時略過；班級壓縮檔本身改用 max_class_mb 與 max_class_members。
+    巢狀壓縮檔的層數由 expand_nested_archives 的 max_depth 限制。
+    """
+
+    def __init__(self, max_total_mb: int = 512, max_members: int = 5000, max_ratio: float = 200,
+                 max_class_mb: int = 8192, max_class_members: int = 200000):
+        self.max_total_mb = max_total_mb
+        self.max_members = max_members
+        self.max_ratio = max_ratio
+        self.max_class_mb = max_class_mb
+        self.max_class_members = max_class_members
+
+    def budget(self) -> "ExtractBudget":
+        """一位學生的額度"""
+        return ExtractBudget(self.max_total_mb * 1024 * 1024, self.max_members, self.max_ratio)
+
+    def class_budget(self) -> "ExtractBudget":
+        """班級壓縮檔（外層）的額度"""
+        return ExtractBudget(self.max_class_mb * 1024 * 1024, self.max_class_members, self.max_ratio)
+
+
+class ExtractBudget:
+    """一次解壓縮工作已經寫出的大小與檔案數量，以及因為超過上限或路徑不安全而略過的檔案"""
+
+    def __init__(self, max_bytes: int, max_members: int, max_ratio: float):
+        self.max_bytes = max_bytes
+        self.max_members = max_members
+        self.max_ratio = max_ratio
+        self.written = 0
+        self.members = 0
+        self.skipped: List[str] = []
+        self.skipped_count = 0
+
+    def skip(self, archive: str, name: str, reason: str, count: int = 1) -> None:
+        self.skipped_count += count
+        if len(self.skipped) < MAX_SKIPPED_RECORDS:
+            self.skipped.append(f"{os.path.basename(archive)}/{name}：{reason}")
+
+    def check(self, size: int, compressed: int) -> str:
+        """依壓縮檔宣告的大小判斷能否解壓縮這個檔案，不能時回傳原因"""
+        if self.written + size > self.max_bytes:
+            return f"解壓縮後的總大小超過 {self.max_bytes // (1024 * 1024)} MB"
+        if size > RATIO_MIN_BYTES and size / max(1, compressed) > self.max_ratio:
+            return f"壓縮比 {size / max(1, compressed):.0f} 超過 {self.max_ratio:g}"
+        return ""
+
+    def charge(self, size: int, compressed: int) -> str:
+        """檢查檔案數量、大小與壓縮比，可以解壓縮時以宣告的大小佔用額度並回傳空字串，不能時回傳原因"""
+        if self.members >= self.max_members:
+            return f"檔案數量超過 {self.max_members} 個"
+        reason = self.check(size, compressed)
+        if not reason:
+            self.written += size
+            self.members += 1
+        return reason
+
+    def refund(self, size: int) -> None:
+        """歸還已經佔用額度、但沒有寫出的成員（實際大小超過宣告的大小或讀取失敗）"""
+        self.written = max(0, self.written - size)
+        self.members = max(0, self.members - 1)
+
+
+def _member_path(target_path: str, name: str) -> Optional[str]:
+    """壓縮檔成員在 target_path 中的路徑；絕對路徑、磁碟代號或包含 .. 的路徑回傳 None"""
+    normalized = name.replace('\\', '/')
+    parts = [part for part in normalized.split('/') if part not in ('', '.')]
+    # 只拒絕真正的磁碟代號（C:）；檔名中的冒號（例如 Homework 11:26.py）在 Windows 上會換成底線
+    if not parts or normalized.startswith('/') or '..' in parts or re.match(r'^[A-Za-z]:$', parts[0]):
+        return None
+    if os.name == 'nt':
+        # 與 zipfile 相同，把 Windows 不允許的字元換成底線
+        parts = [re.sub(r'[<>:"|?*]', '_', part) for part in parts]
+    return os.path.join(target_path, *parts)
+
+
+def _plan_members(source_path: str, target_path: str, budget: ExtractBudget, members: list):
+    """
+    依上限決定要解壓縮哪些成員，建立目錄並逐一產生 (名稱, 成員, 目標路徑, 宣告的大小)。
+    members 為 (名稱, 是否為目錄, 是否為符號連結, 宣告的大小, 壓縮後的大小, 成員) 的列表。
+    以產生器逐一決定，交給 _stream_members 時前一個成員寫出失敗歸還的額度可以讓後面的成員使用。
+    """
+    for index, (name, is_dir, is_link, size, compressed, member) in enumerate(members):
+        if budget.members >= budget.max_members:
+            budget.skip(source_path, f"其餘 {len(members) - index} 個項目", f"檔案數量超過 {budget.max_members} 個",
+                        count=len(members) - index)
+            break
+        path = _member_path(target_path, name)
+        if path is None:
+            budget.skip(source_path, name, "路徑不安全（絕對路徑或包含 ..）")
+            continue
+        if is_link:
+            budget.skip(source_path, name, "符號連結")
+            continue
+        if is_dir:
+            os.makedirs(path, exist_ok=True)
+            continue
+        # 先以宣告的大小佔用額度，實際寫出時不能超過宣告的大小
+        reason = budget.charge(size, compressed)
+        if reason:
+            budget.skip(source_path, name, reason)
+            continue
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        yield name, member, path, size
+
+
+def _copy_member(source, path: str, size: int) -> str:
+    """以固定大小的區塊把成員寫到 path，超過宣告的大小時刪除寫到一半的檔案並回傳原因"""
+    written = 0
+    with open(path, 'wb') as target:
+        while True:
+            chunk = source.read(CHUNK_BYTES)
+            if not chunk:
+                return ""
+            written += len(chunk)
+            if written > size:
+                break
+            target.write(chunk)
+    os.remove(path)
+    return "實際大小超過壓縮檔宣告的大小"
+
+
+def _stream_members(source_path: str, budget: ExtractBudget, planned, open_member) -> None:
+    for name, member, path, size in planned:
+        try:
+            with open_member(member) as source:
+                reason = _copy_member(source, path, size)
+            if reason:
+                budget.refund(size)
+                budget.skip(source_path, name, reason)
+        except Exception as e:
+            budget.refund(size)
+            logging.warning(f"解壓縮檔案 {name} 時發生錯誤：{str(e)}")
+            if os.path.isfile(path):
+                os.remove(path)
+
+
+def _is_zip_symlink(info: zipfile.ZipInfo) -> bool:
+    return (info.external_attr >> 16) & 0o170000 == 0o120000
+
+
+def extract_archive(source_path: str, target_path: str, budget: Optional[ExtractBudget] = None) -> str:
+    """
+    依副檔名解壓縮單一壓縮檔，失敗時回傳錯誤訊息，成功時回傳空字串。
+    每個檔案以固定大小的區塊串流寫出，超過 budget 上限或路徑不安全的檔案略過並記錄在 budget.skipped。
+    """
+    if budget is None:
+        budget = ExtractLimits().budget()
+    # 確保目標目錄存在
+    os.makedirs(target_path, exist_ok=True)
+
+    # 根據副檔名選擇解壓縮方法
+    if source_path.lower().endswith('.zip'):
+        with zipfile.ZipFile(source_path, 'r') as zip_ref:
+            members = [(info.filename, info.is_dir(), _is_zip_symlink(info), info.file_size, info.compress_size, info)
+                       for info in zip_ref.infolist()]
+            _stream_members(source_path, budget, _plan_members(source_path, target_path, budget, members), zip_ref.open)
+
+    elif source_path.lower().endswith('.rar'):
+        configure_rar_tool()
+        with rarfile.RarFile(source_path, 'r') as rar_ref:
+            members = [(info.filename, info.is_dir(), info.is_symlink(), info.file_size, info.compress_size, info)
+                       for info in rar_ref.infolist()]
+            _stream_members(source_path, budget, _plan_members(source_path, target_path, budget, members), rar_ref.open)
+
+    elif source_path.lower().endswith('.7z'): # 新增對 .7z 的處理
+        with py7zr.SevenZipFile(source_path, 'r') as z_ref:
+            # 固實壓縮 (solid) 沒有個別檔案壓縮後的大小，以整個壓縮檔的大小計算壓縮比
+            archive_size = os.path.getsize(source_path)
+            entries = z_ref.list()
+            members = [(entry.filename, entry.is_directory, entry.is_symlink, entry.uncompressed or 0,
+                        entry.compressed or archive_size, entry.filename) for entry in entries]
+            planned = list(_plan_members(source_path, target_path, budget, members))
+            # py7zr 會依宣告的大小以區塊解壓縮到磁碟；有略過的檔案時只解壓縮允許的檔案
+            if len(planned) == sum(1 for entry in entries if not entry.is_directory):
+                z_ref.extractall(path=target_path)
+            elif planned:
+                z_ref.extract(path=target_path, targets=[name for name, _, _, _ in planned])
+
+    elif source_path.lower().endswith('.tar'):
+        with tarfile.open(source_path, 'r:*') as tar_ref:
+            # tar 沒有個別檔案壓縮後的大小（整個 tar 可能再以 gzip 等壓縮），以整個壓縮檔的大小計算壓縮比
+            archive_size = os.path.getsize(source_path)
+            members = []
+            for info in tar_ref.getmembers():
+                if info.isfile() or info.isdir() or info.issym() or info.islnk():
+                    members.append((info.name, info.isdir(), info.issym() or info.islnk(), info.size, archive_size, info))
+                else:
+                    # 裝置檔、FIFO 等不是一般檔案的成員
+                    budget.skip(source_path, info.name, "不是一般檔案")
+            _stream_members(source_path, budget, _plan_members(source_path, target_path, budget, members), tar_ref.extractfile)
+
+    else:
+        return f"錯誤：不支援的檔案格式 {os.path.splitext(source_path)[1]}"
+    return ""
+
+
+def nested_target_path(archive_path: str, claimed: set) -> str:
+    """
+    決定巢狀壓縮檔要展開到的資料夾：與壓縮檔同名（去掉副檔名）的同層資料夾。
+    若該名稱已被一般檔案佔用，或同一層有另一個同名壓縮檔（例如 a.zip 與 a.7z）已使用，則加上 _2、_3... 後綴。
+    已存在的同名資料夾會被重複使用，因此重新執行時結果不變。
+    """
+    base = os.path.splitext(archive_path)[0]
+    candidate = base
+    index = 2
+    while candidate in claimed or (os.path.exists(candidate) and not os.path.isdir(candidate)):
+        candidate = f"{base}_{index}"
+        index += 1
+    claimed.add(candidate)
+    return candidate
+
+
+def _is_archive(file_name: str) -> bool:
+    return file_name.lower().endswith(ARCHIVE_EXTENSIONS) and not file_name.startswith('._')
+
+
+def _remove_expanded(archive_path: str, budget: Optional[ExtractBudget] = None) -> None:
+    """
+    刪除已經展開的壓縮檔。壓縮檔本身是以 budget 解壓縮出來的（巢狀壓縮檔）時，歸還它佔用的額度
+    （額度計算的是磁碟上解壓縮出來的總大小）；沒有計入額度的壓縮檔不傳 budget，只刪除檔案。
+    """
+    if budget is not None:
+        budget.written = max(0, budget.written - os.path.getsize(archive_path))
+    os.remove(archive_path)
+
+
+def expand_nested_archives(root_path: str, max_depth: int, budget: Optional[ExtractBudget] = None) -> Tuple[list, list]:
+    """
+    將 root_path 底下的 zip/rar/tar/7z 壓縮檔就地展開（解壓縮到同名資料夾後刪除壓縮檔），
+    展開出來的壓縮檔會繼續展開，最多 max_depth 層。macOS 產生的 __MACOSX 資料夾會被略過。
+    所有層共用同一份 budget，略過的檔案記錄在 budget.skipped。
+
+    Returns:
+        (成功展開的壓縮檔列表, 失敗訊息列表)
+    """
+    if budget is None:
+        budget = ExtractLimits().budget()
+    expanded = []
+    errors = []
+    search_roots = [root_path]
+    for _ in range(max_depth):
+        archives = []
+        for search_root in search_roots:
+            for root, dirs, files in os.walk(search_root):
+                dirs[:] = sorted(d for d in dirs if d != '__MACOSX')
+                for file_name in sorted(files):
+                    if _is_archive(file_name):
+                        archives.append(os.path.join(root, file_name))
+        if not archives:
+            break
+
+        claimed = set()
+        search_roots = []
+        for archive_path in archives:
+            nested_target = nested_target_path(archive_path, claimed)
+            try:
+                error = extract_archive(archive_path, nested_target, budget)
+            except Exception as e:
+                error = f"解壓縮過程發生錯誤：{str(e)}"
+            if error:
+                errors.append(f"{archive_path}：{error}")
+                continue
+            _remove_expanded(archive_path, budget)
+            expanded.append(archive_path)
+            search_roots.append(nested_target)
+    return expanded, errors
+
+
+class ArchiveResult:
+    """班級壓縮檔中一個項目（學生資料夾或學生壓縮檔）的解壓縮結果"""
+
+    def __init__(self, name: str, path: str, source: Optional[str] = None):
+        self.name = name
+        # 學生資料夾；學生壓縮檔無法解壓縮時仍是壓縮檔本身
+        self.path = path
+        # 學生繳交的壓縮檔，學生直接繳交資料夾時為 None
+        self.source = source
+        self.seconds = 0.0
+        # 學生壓縮檔本身無法解壓縮（更深層的巢狀壓縮檔失敗不算，只會列在 errors）
+        self.failed = False
+        self.expanded: List[str] = []
+        self.errors: List[str] = []
+        # 超過解壓縮上限或路徑不安全而略過的檔案（最多 MAX_SKIPPED_RECORDS 筆）與總數
+        self.skipped: List[str] = []
+        self.skipped_count = 0
+        self.bytes_written = 0
+
+    def to_dict(self) -> Dict:
+        return {"name": self.name, "path": self.path, "source": self.source, "seconds": round(self.seconds, 3),
+                "failed": self.failed, "expanded": len(self.expanded), "errors": self.errors,
+                "bytes_written": self.bytes_written, "skipped_count": self.skipped_count, "skipped": self.skipped}
+
+
+def _extract_entry(name: str, source: Optional[str], target: str, max_depth: int,
+                   limits: Optional[ExtractLimits] = None) -> ArchiveResult:
+    """在工作行程中執行：解壓縮一位學生的壓縮檔（source 為 None 時只展開資料夾內的巢狀壓縮檔）"""
+    started = time.perf_counter()
+    result = ArchiveResult(name, target, source)
+    budget = (limits or ExtractLimits()).budget()
+    if source is not None:
+        try:
+            error = extract_archive(source, target, budget)
+        except Exception as e:
+            error = f"解壓縮過程發生錯誤：{str(e)}"
+        if error:
+            result.path = source
+            result.failed = True
+            result.errors.append(f"{source}：{error}")
+        else:
+            # 學生的壓縮檔是以班級的額度解壓縮出來的，沒有計入這位學生的額度
+            _remove_expanded(source)
+            result.expanded.append(source)
+    if max_depth > 0 and not result.failed:
+        expanded, errors = expand_nested_archives(target, max_depth, budget)
+        result.expanded += expanded
+        result.errors += errors
+    result.skipped, result.skipped_count, result.bytes_written = budget.skipped, budget.skipped_count, budget.written
+    result.seconds = time.perf_counter() - started
+    return result
+
+
+# 自動決定行程數量時，學生數量少於這個值就依序解壓縮（啟動工作行程的時間比解壓縮本身還久）
+MIN_PARALLEL_JOBS = 16
+
+
+def default_workers() -> int:
+    # 容器中可用的 CPU 可能少於 os.cpu_count()
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+    return min(8, cpus or 1)
+
+
+def _pool_context():
+    # 不以 fork 複製主程式（主程式有事件迴圈與其他執行緒），Windows 沒有 forkserver 時改用 spawn
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return multiprocessing.get_context(method)
+
+
+def extract_many(jobs: List[Tuple[str, Optional[str], str, int]], workers: int = 0,
+                 limits: Optional[ExtractLimits] = None) -> List[ArchiveResult]:
+    """
+    批次解壓縮：jobs 為 (名稱, 壓縮檔或 None, 目標資料夾, 巢狀展開層數)，以 workers 個行程同時處理
+    （0 表示依 CPU 數量決定，1 表示在目前的行程依序處理）。回傳與 jobs 相同順序的結果，
+    單一壓縮檔失敗只會記錄在對應的結果中。每個項目各自有一份 limits 的額度。
+    """
+    if not workers:
+        workers = default_workers() if len(jobs) >= MIN_PARALLEL_JOBS else 1
+    if workers <= 1 or len(jobs) <= 1:
+        return [_extract_entry(*job, limits) for job in jobs]
+    results: List[Optional[ArchiveResult]] = [None] * len(jobs)
+    try:
+        with ProcessPoolExecutor(max_workers=min(workers, len(jobs)), mp_context=_pool_context()) as executor:
+            futures = {executor.submit(_extract_entry, *job, limits): index for index, job in enumerate(jobs)}
+            for future in as_completed(futures):
+                index = futures[future]
+                try:
+                    results[index] = future.result()
+                except BrokenProcessPool:
+                    raise
+                except Exception as e:
+                    name, source, target, _ = jobs[index]
+                    result = ArchiveResult(name, source or target, source)
+                    result.failed = source is not None
+                    result.errors.append(f"{source or target}：解壓縮過程發生錯誤：{str(e)}")
+                    results[index] = result
+    except BrokenProcessPool as e:
+        # 工作行程無法啟動或異常結束，還沒完成的項目改在目前的行程依序處理
+        logging.warning(f"解壓縮行程池無法使用，改為依序解壓縮：{e}")
+    return [result or _extract_entry(*job, limits) for result, job in zip(results, jobs)]
+
+
+class ExtractionManifest:
+    """整個班級壓縮檔的解壓縮結果：作業根目錄與每位學生的資料夾"""
+
+    def __init__(self, source: str, root: str):
+        self.source = source
+        self.root = root
+        self.students: List[ArchiveResult] = []
+        # 學生資料夾外層另外展開的壓縮檔
+        self.outer: List[str] = []
+        # 班級壓縮檔本身略過的檔案（各學生略過的檔案在 students 中）
+        self.skipped: List[str] = []
+        self.skipped_count = 0
+        # 班級壓縮檔本身無法解壓縮的原因
+        self.error = ""
+        self.workers = 1
+        self.seconds = 0.0
+
+    def failures(self) -> List[ArchiveResult]:
+        return [student for student in self.students if student.failed]
+
+    def summary(self, slowest: int = 3) -> str:
+        if self.error:
+            return self.error
+        archives = len(self.outer) + sum(len(student.expanded) for student in self.students)
+        lines = [f"成功解壓縮 {self.source} 到 {self.root}：{len(self.students)} 位學生，展開 {archives} 個壓縮檔"
+                 f"（{self.workers} 個行程，{self.seconds:.2f} 秒）"]
+        timed = sorted((student for student in self.students if student.expanded), key=lambda s: -s.seconds)[:slowest]
+        if timed:
+            lines.append("最慢的學生壓縮檔：" + "，".join(f"{student.name} {student.seconds:.2f} 秒" for student in timed))
+        errors = [error for student in self.students for error in student.errors]
+        if errors:
+            lines.append("以下壓縮檔無法解壓縮：\n" + "\n".join(errors))
+        skipped_count = self.skipped_count + sum(student.skipped_count for student in self.students)
+        if skipped_count:
+            skipped = self.skipped + [f"{student.name}：{record}" for student in self.students for record in student.skipped]
+            lines.append(f"超過解壓縮上限或路徑不安全而略過 {skipped_count} 個檔案：\n" + "\n".join(skipped[:MAX_SKIPPED_RECORDS]))
+        return "\n".join(lines)
+
+    def to_dict(self) -> Dict:
+        return {"source": self.source, "root": self.root, "error": self.error, "workers": self.workers,
+                "seconds": round(self.seconds, 3), "outer": self.outer,
+                "skipped_count": self.skipped_count, "skipped": self.skipped, "students": [student.to_dict() for student in self.students]}
+
+
+def _homework_root(target_path: str, expand: bool, budget: ExtractBudget) -> Tuple[str, List[str]]:
+    """
+    班級壓縮檔外層常包一層（或多層）資料夾，往下找到真正放學生資料夾的目錄；
+    expand 為 True 時，外層只有一個壓縮檔（壓縮檔裡再包整班的壓縮檔）也會先展開。
+    回傳 (作業根目錄, 展開的外層壓縮檔)
+    """
+    root = target_path
+    expanded = []
+    while True:
+        entries = [name for name in os.listdir(root) if name != '__MACOSX']
+        if len(entries) != 1:
+            return root, expanded
+        path = os.path.join(root, entries[0])
+        if os.path.isfile(path) and expand and _is_archive(entries[0]):
+            target = nested_target_path(path, set())
+            try:
+                error = extract_archive(path, target, budget)
+            except Exception as e:
+                error = str(e)
+            if error:
+                # 交給 extract_class 當成一位學生的壓縮檔處理，錯誤會記錄在清單中
+                return root, expanded
+            _remove_expanded(path, budget)
+            expanded.append(path)
+            path = target
+        elif not os.path.isdir(path):
+            return root, expanded
+        root = path
+
+
+def extract_class(source_path: str, target_path: str, recursive: bool = True, max_depth: int = 3,
+                  workers: int = 0, limits: Optional[ExtractLimits] = None) -> ExtractionManifest:
+    """
+    解壓縮整個班級壓縮檔：先解壓縮外層，再把每位學生的壓縮檔（或學生資料夾中的巢狀壓縮檔）分派給行程池同時展開。
+    recursive 為 False 時只解壓縮外層，學生壓縮檔保持原狀。外層使用 limits 的班級額度，每位學生各自使用一份學生額度。
+    """
+    started = time.perf_counter()
+    limits = limits or ExtractLimits()
+    budget = limits.class_budget()
+    manifest = ExtractionManifest(source_path, target_path)
+    if not os.path.exists(source_path):
+        manifest.error = f"錯誤：找不到來源檔案 {source_path}"
+        return manifest
+    try:
+        manifest.error = extract_archive(source_path, target_path, budget)
+    except Exception as e:
+        manifest.error = f"解壓縮過程發生錯誤：{str(e)}"
+    if manifest.error:
+        return manifest
+    root, outer = _homework_root(target_path, recursive, budget)
+    manifest.root, manifest.outer = root, outer
+    manifest.skipped, manifest.skipped_count = budget.skipped, budget.skipped_count
+
+    names = sorted(name for name in os.listdir(root) if name != '__MACOSX' and not name.startswith('._'))
+    jobs = []
+    claimed = set()
+    if recursive:
+        # 目標資料夾在父行程中決定，同名的壓縮檔（a.zip 與 a.7z）不會同時寫入同一個資料夾
+        for name in names:
+            path = os.path.join(root, name)
+            if os.path.isfile(path) and _is_archive(name):
+                target = nested_target_path(path, claimed)
+                jobs.append((os.path.basename(target), path, target, max_depth - 1))
+        for name in names:
+            path = os.path.join(root, name)
+            if os.path.isdir(path) and path not in claimed:
+                jobs.append((name, None, path, max_depth))
+        if not workers:
+            workers = default_workers() if len(jobs) >= MIN_PARALLEL_JOBS else 1
+        manifest.workers = min(workers, max(1, len(jobs)))
+        manifest.students = extract_many(jobs, workers, limits)
+    # 沒有分派的項目：不展開巢狀壓縮檔時的學生資料夾與學生壓縮檔
+    handled = {student.name for student in manifest.students}
+    handled |= {os.path.basename(student.source) for student in manifest.students if student.source}
+    manifest.students += [ArchiveResult(name, os.path.join(root, name)) for name in names if name not in handled
+                          and (os.path.isdir(os.path.join(root, name)) or _is_archive(name))]
+    manifest.students.sort(key=lambda student: student.name)
+    manifest.seconds = time.perf_counter() - started
+    return manifest
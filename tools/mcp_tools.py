@@ -1,59 +1,39 @@
 from mcp.server.fastmcp import FastMCP
 import os
-import zipfile
-import rarfile
-import shutil
-import logging
-import py7zr  # 導入 py7zr 函式庫
+from extract import ExtractLimits, configure_rar_tool, expand_nested_archives, extract_archive
+from sandbox import DEFAULT_TEST_CASES, SANDBOX_AVAILABLE, SANDBOX_UNAVAILABLE, format_results, load_test_suite, sandbox
+import write_report
 
-# 設定 rarfile 的 unrar 工具路徑
-rarfile.UNRAR_TOOL = "C:\\Program Files\\WinRAR\\UnRAR.exe"
+# 設定 rarfile 的 unrar 工具（UNRAR_TOOL 環境變數、WinRAR 或 PATH 中的 unrar/unar/bsdtar/7z）
+configure_rar_tool()
 
 # 創建 FastMCP 實例
 mcp = FastMCP("Teaching Assistant")
 
+
 @mcp.tool()
-def unzip_folder(source_path: str, target_path: str) -> str:
-    """解壓縮資料夾，支援 ZIP、RAR 和 7z 格式"""
+def unzip_folder(source_path: str, target_path: str, recursive: bool = False, max_depth: int = 3) -> str:
+    """解壓縮資料夾，支援 ZIP、RAR、TAR 和 7z 格式。recursive 為 True 時會把解壓縮後的巢狀壓縮檔就地展開，最多 max_depth 層"""
     try:
         # 檢查來源檔案是否存在
         if not os.path.exists(source_path):
             return f"錯誤：找不到來源檔案 {source_path}"
-        
-        # 確保目標目錄存在
-        os.makedirs(target_path, exist_ok=True)
-        
-        # 根據副檔名選擇解壓縮方法
-        if source_path.lower().endswith('.zip'):
-            with zipfile.ZipFile(source_path, 'r') as zip_ref:
-                # 處理每個檔案
-                for file_info in zip_ref.infolist():
-                    try:
-                        # 解壓縮單一檔案
-                        zip_ref.extract(file_info, target_path)
-                    except Exception as e:
-                        logging.warning(f"解壓縮檔案 {file_info.filename} 時發生錯誤：{str(e)}")
-                        continue
-                        
-        elif source_path.lower().endswith('.rar'):
-            with rarfile.RarFile(source_path, 'r') as rar_ref:
-                # 處理每個檔案
-                for file_info in rar_ref.infolist():
-                    try:
-                        # 解壓縮單一檔案
-                        rar_ref.extract(file_info, target_path)
-                    except Exception as e:
-                        logging.warning(f"解壓縮檔案 {file_info.filename} 時發生錯誤：{str(e)}")
-                        continue
 
-        elif source_path.lower().endswith('.7z'): # 新增對 .7z 的處理
-            with py7zr.SevenZipFile(source_path, 'r') as z_ref:
-                z_ref.extractall(path=target_path)
+        # 以預設的解壓縮上限串流解壓縮，壓縮炸彈、超大的檔案或不安全的路徑會被略過
+        budget = ExtractLimits().budget()
+        error = extract_archive(source_path, target_path, budget)
+        if error:
+            return error
 
-        else:
-            return f"錯誤：不支援的檔案格式 {os.path.splitext(source_path)[1]}"
-        
-        return f"成功解壓縮 {source_path} 到 {target_path}"
+        message = f"成功解壓縮 {source_path} 到 {target_path}"
+        if recursive:
+            expanded, errors = expand_nested_archives(target_path, max_depth, budget)
+            message += f"，並展開 {len(expanded)} 個巢狀壓縮檔"
+            if errors:
+                message += "\n以下巢狀壓縮檔無法解壓縮：\n" + "\n".join(errors)
+        if budget.skipped_count:
+            message += f"\n超過解壓縮上限或路徑不安全而略過 {budget.skipped_count} 個檔案：\n" + "\n".join(budget.skipped)
+        return message
         
     except Exception as e:
         return f"解壓縮過程發生錯誤：{str(e)}"
@@ -61,31 +41,36 @@ def unzip_folder(source_path: str, target_path: str) -> str:
 @mcp.tool()
 def write_grading_report(student_id: str, student_name: str, score: int, comments: str, output_path: str) -> str:
     """寫入評分報告到指定路徑"""
-    try:
-        # 確保輸出目錄存在
-        output_dir = os.path.dirname(output_path)
-        os.makedirs(output_dir, exist_ok=True)
-        
-        # 格式化評分報告內容
-        report_content = f"""評分報告
-==========
+    return write_report.write_grading_report(student_id, student_name, score, comments, output_path)
 
-學號：{student_id}
-姓名：{student_name}
-分數：{score}
 
-評語：
-{comments}
-"""
-        
-        # 寫入檔案
-        with open(output_path, 'w', encoding='utf-8') as f:
-            f.write(report_content)
-        
-        return f"成功寫入評分報告到 {output_path}"
-        
+def run_python_tests(folder_path: str, test_cases_path: str = "") -> str:
+    """在沙箱中以作業定義的測試輸入實際執行資料夾中的 Python 程式（限制 CPU、記憶體與時間，不能使用網路），回傳每個測試是否通過與程式的輸出"""
+    if not SANDBOX_AVAILABLE:
+        return SANDBOX_UNAVAILABLE
+    try:
+        if not os.path.isdir(folder_path):
+            return f"錯誤：找不到資料夾 {folder_path}"
+        suite = load_test_suite(test_cases_path or DEFAULT_TEST_CASES)
+        files = []
+        for root, dirs, names in os.walk(folder_path):
+            dirs[:] = [d for d in dirs if d not in ('__MACOSX', '__pycache__')]
+            for name in names:
+                if name.lower().endswith('.py') and not name.startswith('._'):
+                    path = os.path.join(root, name)
+                    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+                        files.append((os.path.relpath(path, folder_path), f.read()))
+        results = sandbox.run_submission(files, suite)
+        if not results:
+            return "找不到可以執行的 Python 程式"
+        return format_results(results, suite.limits)
     except Exception as e:
-        return f"寫入評分報告時發生錯誤：{str(e)}"
+        return f"執行測試時發生錯誤：{str(e)}"
+
+
+# 不支援沙箱的平台（Windows）不提供這個工具，模型不會拿執行失敗的結果評分
+if SANDBOX_AVAILABLE:
+    mcp.tool()(run_python_tests)
 
 
 # def register_tools():
@@ -0,0 +1,279 @@
+# tools/sandbox.py
+import json
+import os
+import re
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+RUNNER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sandbox_runner.py")
+# 與 prompt/system_prompt_python.txt 對應的作業測試
+DEFAULT_TEST_CASES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "prompt", "test_cases_python.json")
+# 提示中每個測試最多附上的輸出字元數
+MAX_OUTPUT_CHARS = 600
+# 每位學生最多執行幾個程式進入點
+MAX_ENTRY_POINTS = 3
+# 沙箱依賴 POSIX 的 rlimit（resource）、行程群組（os.killpg）與 SIGXCPU，Windows 上無法執行
+SANDBOX_AVAILABLE = os.name == "posix"
+SANDBOX_UNAVAILABLE = (f"沙箱無法使用：目前的平台（{sys.platform}）不支援限制 CPU、記憶體與行程群組，"
+                       "沒有實際執行學生的程式，請只依原始碼評分，不要因此扣分")
+
+
+class SandboxUnavailable(RuntimeError):
+    """目前的平台無法在沙箱中執行學生的程式"""
+
+
+class Limits:
+    """單次執行的資源上限"""
+
+    def __init__(self, cpu_seconds: int = 2, memory_mb: int = 256, wall_seconds: float = 5, output_kb: int = 64):
+        self.cpu_seconds = cpu_seconds
+        self.memory_mb = memory_mb
+        self.wall_seconds = wall_seconds
+        self.output_kb = output_kb
+
+
+class TestCase:
+    """
+    作業定義的測試：stdin 為同一組資料的幾種輸入格式（例如每行一個數字、每行一列），依序嘗試到有一種通過為止；
+    expect 為輸出中必須出現的正規表示式。
+    """
+
+    def __init__(self, name: str, stdin: List[str], expect: List[str]):
+        self.name = name
+        self.stdin = stdin
+        self.expect = expect
+
+
+class TestSuite:
+    def __init__(self, cases: List[TestCase], limits: Limits, description: str = ""):
+        self.cases = cases
+        self.limits = limits
+        self.description = description
+
+
+@lru_cache(maxsize=None)
+def load_test_suite(path: str) -> TestSuite:
+    """
+    讀取作業的測試定義 (JSON)：
+        {"limits": {"cpu_seconds": 2, "memory_mb": 256, "wall_seconds": 5, "output_kb": 64},
+         "cases": [{"name": "...", "stdin": ["1\\n2\\n", "1 2\\n"], "expect": ["\\\\b3\\\\b"]}]}
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    cases = []
+    for case in data.get("cases", []):
+        stdin = case.get("stdin", "")
+        cases.append(TestCase(case["name"], [stdin] if isinstance(stdin, str) else list(stdin), list(case.get("expect", []))))
+    return TestSuite(cases, Limits(**data.get("limits", {})), data.get("description", ""))
+
+
+class CaseResult:
+    """單一測試的執行結果；status 為 passed / failed / error / timeout / skipped（前一個測試逾時）"""
+
+    def __init__(self, name: str, status: str, returncode: Optional[int], stdout: str, stderr: str,
+                 seconds: float, missing: List[str], variant: int):
+        self.name = name
+        self.status = status
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+        self.seconds = seconds
+        self.missing = missing
+        self.variant = variant
+
+    @property
+    def passed(self) -> bool:
+        return self.status == "passed"
+
+
+@lru_cache(maxsize=None)
+def network_isolation() -> Tuple[str, ...]:
+    """可以建立獨立的網路命名空間時，回傳執行命令的前綴（unshare -rn），否則只靠啟動程式停用 socket"""
+    if sys.platform != "linux" or shutil.which("unshare") is None:
+        return ()
+    try:
+        probe = subprocess.run(["unshare", "-rn", "true"], capture_output=True, timeout=5)
+    except (OSError, subprocess.SubprocessError):
+        return ()
+    return ("unshare", "-rn") if probe.returncode == 0 else ()
+
+
+def entry_points(files: List[Tuple[str, str]]) -> List[str]:
+    """要執行的 Python 檔案：會讀取輸入或在最上層執行程式的檔案優先，最多 MAX_ENTRY_POINTS 個"""
+    python = [(rel_path, content) for rel_path, content in files
+              if rel_path.lower().endswith('.py') and '__MACOSX' not in rel_path and content.strip()]
+    scored = sorted(python, key=lambda item: (
+        'input(' not in item[1],
+        '__main__' not in item[1],
+        os.path.basename(item[0]).lower() != 'main.py',
+        item[0],
+    ))
+    return [rel_path for rel_path, _ in scored[:MAX_ENTRY_POINTS]]
+
+
+def _read(path: str, limit: int) -> str:
+    with open(path, 'rb') as f:
+        return f.read(limit).decode('utf-8', errors='replace')
+
+
+class Sandbox:
+    """
+    以作業定義的測試輸入實際執行學生的 Python 程式。
+
+    每次執行都是獨立的子行程：有自己的暫存目錄，以 rlimit 限制 CPU 時間、記憶體與輸出大小，
+    超過牆鐘時間就終止整個行程群組，並盡可能在沒有網路的命名空間中執行。
+    同時執行的子行程數量以 max_workers 限制，多位學生同時批改時共用。
+    """
+
+    def __init__(self, max_workers: Optional[int] = None):
+        self.max_workers = max_workers or max(2, os.cpu_count() or 1)
+        self._slots = threading.BoundedSemaphore(self.max_workers)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def run_submission(self, files: List[Tuple[str, str]], suite: TestSuite) -> Dict[str, List[CaseResult]]:
+        """
+        Args:
+            files: [(相對路徑, 內容), ...]，整份作業的 Python 檔案，會寫到暫存目錄中執行
+
+        Returns:
+            {程式進入點: [每個測試的結果]}
+
+        Raises:
+            SandboxUnavailable: 不是 POSIX 平台，無法限制學生程式的資源
+        """
+        if not SANDBOX_AVAILABLE:
+            raise SandboxUnavailable(SANDBOX_UNAVAILABLE)
+        entries = entry_points(files)
+        if not entries or not suite.cases:
+            return {}
+        scratch = tempfile.mkdtemp(prefix="ta_sandbox_")
+        try:
+            source = os.path.join(scratch, "src")
+            for rel_path, content in files:
+                if not rel_path.lower().endswith('.py'):
+                    continue
+                path = os.path.join(source, rel_path)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'w', encoding='utf-8') as f:
+                    f.write(content)
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="sandbox")
+            futures = {entry: self._executor.submit(self._run_entry, scratch, entry, suite) for entry in entries}
+            return {entry: future.result() for entry, future in futures.items()}
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    def _run_entry(self, scratch: str, entry: str, suite: TestSuite) -> List[CaseResult]:
+        """依序執行所有測試；某種輸入格式通過後，之後的測試先嘗試同一種格式"""
+        results = []
+        preferred = 0
+        for index, case in enumerate(suite.cases):
+            if results and results[-1].status in ("timeout", "skipped"):
+                # 前一個測試逾時，這個程式多半每個測試都會逾時，不再佔用執行時間
+                results.append(CaseResult(case.name, "skipped", None, "", "", 0.0, list(case.expect), 0))
+                continue
+            order = sorted(range(len(case.stdin)), key=lambda v: v != preferred)
+            best = None
+            for variant in order:
+                result = self._run_case(scratch, entry, case, variant, suite.limits, f"{index}_{variant}")
+                if best is None or (result.returncode == 0 and best.returncode != 0):
+                    best = result
+                if result.passed:
+                    preferred = variant
+                    break
+                if result.status == "timeout":
+                    # 無窮迴圈與輸入格式無關，不再嘗試其他格式
+                    break
+            results.append(best)
+        return results
+
+    def _run_case(self, scratch: str, entry: str, case: TestCase, variant: int, limits: Limits, tag: str) -> CaseResult:
+        # 每次執行複製一份原始碼，學生程式寫出的檔案不會影響其他測試
+        workdir = os.path.join(scratch, f"run_{re.sub(r'[^0-9A-Za-z]', '_', entry)}_{tag}")
+        shutil.copytree(os.path.join(scratch, "src"), workdir)
+        stdout_path = os.path.join(scratch, f"{os.path.basename(workdir)}.out")
+        stderr_path = os.path.join(scratch, f"{os.path.basename(workdir)}.err")
+        command = list(network_isolation()) + [
+            # -I 會忽略 PYTHONIOENCODING 等環境變數，改以命令列參數固定使用 UTF-8 並且不寫入 .pyc
+            sys.executable, "-I", "-B", "-X", "utf8", RUNNER,
+            "--cpu", str(limits.cpu_seconds), "--memory", str(limits.memory_mb), "--fsize", str(limits.output_kb),
+            os.path.join(workdir, entry),
+        ]
+        env = {"PATH": "/usr/bin:/bin", "HOME": workdir, "LANG": "C.UTF-8"}
+        status = None
+        started = time.perf_counter()
+        with self._slots, open(stdout_path, 'wb') as stdout, open(stderr_path, 'wb') as stderr:
+            process = subprocess.Popen(command, cwd=workdir, env=env, stdin=subprocess.PIPE, stdout=stdout,
+                                       stderr=stderr, start_new_session=True)
+            try:
+                process.communicate(case.stdin[variant].encode('utf-8'), timeout=limits.wall_seconds)
+            except subprocess.TimeoutExpired:
+                os.killpg(process.pid, signal.SIGKILL)
+                process.wait()
+                status = "timeout"
+        seconds = time.perf_counter() - started
+        output = _read(stdout_path, limits.output_kb * 1024)
+        errors = _read(stderr_path, 8 * 1024)
+        missing = [pattern for pattern in case.expect if not re.search(pattern, output, re.M)]
+        if status is None:
+            if process.returncode in (-signal.SIGXCPU, -signal.SIGKILL):
+                status = "timeout"  # 超過 CPU 時間上限
+            elif process.returncode != 0:
+                status = "error"
+            else:
+                status = "failed" if missing else "passed"
+        return CaseResult(case.name, status, process.returncode, output, errors, seconds, missing, variant)
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+
+def _last_line(text: str) -> str:
+    lines = [line for line in text.strip().splitlines() if line.strip()]
+    return lines[-1].strip()[:200] if lines else ""
+
+
+def _excerpt(text: str) -> str:
+    text = text.strip()
+    if len(text) > MAX_OUTPUT_CHARS:
+        text = text[:MAX_OUTPUT_CHARS] + f"...（已截斷，共 {len(text)} 字元）"
+    return text.replace('\n', '\n    ')
+
+
+def format_results(results: Dict[str, List[CaseResult]], limits: Optional[Limits] = None) -> str:
+    """把執行結果寫成提示或工具回應中的條列事實"""
+    lines = []
+    for entry, cases in results.items():
+        passed = sum(1 for case in cases if case.passed)
+        lines.append(f"- {entry}：通過 {passed} / {len(cases)} 個測試")
+        for case in cases:
+            if case.status == "passed":
+                detail = "通過"
+            elif case.status == "timeout":
+                detail = f"逾時（超過 CPU {limits.cpu_seconds if limits else '?'} 秒或執行 {limits.wall_seconds if limits else '?'} 秒的上限，可能是無窮迴圈）"
+            elif case.status == "skipped":
+                detail = "未執行（前一個測試逾時）"
+            elif case.status == "error":
+                detail = f"執行錯誤（結束代碼 {case.returncode}）：{_last_line(case.stderr) or '沒有錯誤訊息'}"
+            else:
+                detail = "輸出中找不到預期的結果 " + "、".join(case.missing)
+            lines.append(f"  - 測試「{case.name}」（輸入格式 {case.variant + 1}）：{detail}")
+            if case.stdout.strip():
+                lines.append(f"    輸出：{_excerpt(case.stdout)}")
+    return "\n".join(lines)
+
+
+# 整個程式共用的沙箱
+sandbox = Sandbox()
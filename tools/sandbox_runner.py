@@ -0,0 +1,57 @@
+# tools/sandbox_runner.py
+"""
+在沙箱中執行單一學生程式的啟動程式：先設定資源上限並停用網路，再以 runpy 執行學生的程式。
+
+    python -I sandbox_runner.py --cpu 2 --memory 256 --fsize 64 main.py
+"""
+import argparse
+import os
+import resource
+import runpy
+import socket
+import sys
+
+
+class _BlockedSocket:
+    def __init__(self, *args, **kwargs):
+        raise OSError("沙箱中不允許使用網路")
+
+
+def _blocked(*args, **kwargs):
+    raise OSError("沙箱中不允許使用網路")
+
+
+def _limit(kind: int, value: int, hard: int = None) -> None:
+    try:
+        resource.setrlimit(kind, (value, value if hard is None else hard))
+    except (ValueError, OSError):
+        pass
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cpu", type=int, default=2, help="CPU 時間上限（秒）")
+    parser.add_argument("--memory", type=int, default=256, help="位址空間上限 (MB)")
+    parser.add_argument("--fsize", type=int, default=64, help="寫出檔案（含標準輸出）的大小上限 (KB)")
+    parser.add_argument("entry")
+    args = parser.parse_args()
+
+    # CPU 時間超過軟上限時收到 SIGXCPU 結束，硬上限多留一秒
+    _limit(resource.RLIMIT_CPU, args.cpu, args.cpu + 1)
+    _limit(resource.RLIMIT_AS, args.memory * 1024 * 1024)
+    _limit(resource.RLIMIT_FSIZE, args.fsize * 1024)
+    _limit(resource.RLIMIT_NOFILE, 64)
+    _limit(resource.RLIMIT_CORE, 0)
+    # 沒有獨立網路命名空間時的第二道防線：學生程式 import socket 拿到的是同一個模組
+    socket.socket = _BlockedSocket
+    socket.create_connection = _blocked
+    socket.getaddrinfo = _blocked
+
+    entry = os.path.abspath(args.entry)
+    sys.argv = [entry]
+    sys.path.insert(0, os.path.dirname(entry))
+    runpy.run_path(entry, run_name="__main__")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,25 @@
 # tools.py
 
 import os
-import zipfile
-import rarfile
-from typing import List
+from typing import List, Optional
 
-def unzip_homework(zip_path: str, extract_to: str) -> str:
+try:
+    from extract import ExtractLimits, extract_archive
+except ImportError:  # 從專案根目錄以 tools.tools 匯入時
+    from tools.extract import ExtractLimits, extract_archive
+
+def unzip_homework(zip_path: str, extract_to: str, limits: Optional[ExtractLimits] = None) -> str:
     """
-    將指定的 ZIP 或 RAR 壓縮檔解壓縮到指定目錄。
+    將指定的 ZIP、RAR、TAR 或 7z 壓縮檔解壓縮到指定目錄。
+    與批改流程相同，經由 extract.extract_archive 以區塊串流寫出，並套用 limits 的大小、檔案數量與壓縮比上限。
     
     Args:
         zip_path: 壓縮檔的路徑。
         extract_to: 要解壓縮到的目標資料夾。
+        limits: 解壓縮上限，預設為 ExtractLimits()。
     
     Returns:
-        一個表示操作結果的字串。
+        一個表示操作結果的字串，包含被略過的檔案。
     """
     try:
         print(f"檢查檔案是否存在: {zip_path}")
@@ -23,50 +28,15 @@ def unzip_homework(zip_path: str, extract_to: str) -> str:
             return f"錯誤：找不到壓縮檔 {zip_path}"
             
         print(f"檔案存在，大小: {os.path.getsize(zip_path)} 位元組")
-        
-        if not os.path.exists(extract_to):
-            print(f"建立目標目錄: {extract_to}")
-            os.makedirs(extract_to)
-            
-        if zip_path.endswith('.zip'):
-            print("嘗試開啟 ZIP 檔案...")
-            with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-                print("成功開啟 ZIP 檔案，開始解壓縮...")
-                # 獲取所有檔案列表
-                file_list = zip_ref.namelist()
-                print(f"壓縮檔中包含 {len(file_list)} 個檔案")
-                
-                # 逐個解壓縮檔案
-                for file_name in file_list:
-                    try:
-                        # 處理檔案名稱中的特殊字元
-                        safe_name = file_name.replace('/', os.path.sep).replace('\\', os.path.sep)
-                        target_path = os.path.join(extract_to, safe_name)
-                        
-                        # 確保目標目錄存在
-                        target_dir = os.path.dirname(target_path)
-                        if not os.path.exists(target_dir):
-                            os.makedirs(target_dir)
-                            
-                        # 解壓縮檔案
-                        with zip_ref.open(file_name) as source, open(target_path, 'wb') as target:
-                            target.write(source.read())
-                            
-                    except Exception as e:
-                        print(f"解壓縮檔案 {file_name} 時發生錯誤: {e}")
-                        continue
-                        
-                print("解壓縮完成")
-        elif zip_path.endswith('.rar'):
-            print("嘗試開啟 RAR 檔案...")
-            with rarfile.RarFile(zip_path, 'r') as rar_ref:
-                print("成功開啟 RAR 檔案，開始解壓縮...")
-                rar_ref.extractall(extract_to)
-                print("解壓縮完成")
-        else:
-            return f"錯誤：不支援的壓縮檔格式 {zip_path}"
-            
-        return f"成功將 {zip_path} 解壓縮到 {extract_to}"
+        budget = (limits or ExtractLimits()).budget()
+        error = extract_archive(zip_path, extract_to, budget)
+        if error:
+            return error
+        print("解壓縮完成")
+        message = f"成功將 {zip_path} 解壓縮到 {extract_to}"
+        if budget.skipped_count:
+            message += f"\n超過解壓縮上限或路徑不安全而略過 {budget.skipped_count} 個檔案：\n" + "\n".join(budget.skipped)
+        return message
     except FileNotFoundError as e:
         print(f"FileNotFoundError: {e}")
         return f"錯誤：找不到壓縮檔 {zip_path}"
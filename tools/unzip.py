@@ -1,28 +1,36 @@
 # tools.py
 
 import os
-import zipfile
-from typing import List
+from typing import List, Optional
 
-def unzip_homework(zip_path: str, extract_to: str) -> str:
+try:
+    from extract import ExtractLimits, extract_archive
+except ImportError:  # 從專案根目錄以 tools.unzip 匯入時
+    from tools.extract import ExtractLimits, extract_archive
+
+def unzip_homework(zip_path: str, extract_to: str, limits: Optional[ExtractLimits] = None) -> str:
     """
-    將指定的 ZIP 壓縮檔解壓縮到指定目錄。
+    將指定的壓縮檔解壓縮到指定目錄，以區塊串流寫出並套用 limits 的大小、檔案數量與壓縮比上限。
     
     Args:
         zip_path: 壓縮檔的路徑。
         extract_to: 要解壓縮到的目標資料夾。
+        limits: 解壓縮上限，預設為 ExtractLimits()。
     
     Returns:
         一個表示操作結果的字串。
     """
     try:
-        if not os.path.exists(extract_to):
-            os.makedirs(extract_to)
-        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-            zip_ref.extractall(extract_to)
-        return f"成功將 {zip_path} 解壓縮到 {extract_to}"
-    except FileNotFoundError:
-        return f"錯誤：找不到壓縮檔 {zip_path}"
+        if not os.path.exists(zip_path):
+            return f"錯誤：找不到壓縮檔 {zip_path}"
+        budget = (limits or ExtractLimits()).budget()
+        error = extract_archive(zip_path, extract_to, budget)
+        if error:
+            return error
+        message = f"成功將 {zip_path} 解壓縮到 {extract_to}"
+        if budget.skipped_count:
+            message += f"\n超過解壓縮上限或路徑不安全而略過 {budget.skipped_count} 個檔案：\n" + "\n".join(budget.skipped)
+        return message
     except Exception as e:
         return f"解壓縮時發生錯誤: {e}"
 
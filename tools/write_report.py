@@ -0,0 +1,31 @@
+# tools/write_report.py
+import os
+
+
+def write_grading_report(student_id: str, student_name: str, score: int, comments: str, output_path: str) -> str:
+    """寫入評分報告到指定路徑；MCP 工具與結構化輸出模式（main.py 直接寫出）共用同一個格式"""
+    try:
+        # 確保輸出目錄存在
+        output_dir = os.path.dirname(output_path)
+        os.makedirs(output_dir, exist_ok=True)
+        
+        # 格式化評分報告內容
+        report_content = f"""評分報告
+==========
+
+學號：{student_id}
+姓名：{student_name}
+分數：{score}
+
+評語：
+{comments}
+"""
+        
+        # 寫入檔案
+        with open(output_path, 'w', encoding='utf-8') as f:
+            f.write(report_content)
+        
+        return f"成功寫入評分報告到 {output_path}"
+        
+    except Exception as e:
+        return f"寫入評分報告時發生錯誤：{str(e)}"
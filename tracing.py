@@ -0,0 +1,153 @@
+# tracing.py
+import contextvars
+import json
+import os
+import threading
+import time
+import unicodedata
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+# 目前正在批改的學生學號；asyncio 的每個任務各自擁有一份，asyncio.to_thread 也會自動帶到執行緒中
+current_student: contextvars.ContextVar = contextvars.ContextVar("current_student", default=None)
+
+# 模型 span 上會累計到總表的 token 欄位
+TOKEN_FIELDS = ("input_tokens", "output_tokens", "cached_tokens")
+
+
+def _pad(text: str, width: int, right: bool = False) -> str:
+    """依顯示寬度補空白（中文字佔兩格），讓總表的欄位對齊"""
+    shown = sum(2 if unicodedata.east_asian_width(ch) in ('W', 'F') else 1 for ch in text)
+    space = ' ' * max(0, width - shown)
+    return space + text if right else text + space
+
+
+class Span:
+    """一段計時的工作，例如解壓縮、收集檔案、組合提示、模型呼叫或工具調用"""
+
+    __slots__ = ('name', 'student', 'start', 'duration', 'status', 'attrs')
+
+    def __init__(self, name: str, student: Optional[str], attrs: Dict[str, Any]):
+        self.name = name
+        self.student = student
+        self.start = time.time()
+        self.duration = 0.0
+        self.status = "ok"
+        self.attrs = attrs
+
+    def set(self, **attrs) -> None:
+        self.attrs.update(attrs)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "student": self.student,
+            "start": round(self.start, 6),
+            "duration": round(self.duration, 6),
+            "status": self.status,
+            **self.attrs,
+        }
+
+
+class Tracer:
+    """
+    輕量的追蹤記錄：每個 span 結束時加入記憶體中的清單，指定 JSONL 檔案時同時逐行寫出。
+    批改結束後以 summary() 印出各階段的次數、時間與 token 統計。
+    """
+
+    def __init__(self):
+        self.spans: List[Span] = []
+        self._lock = threading.Lock()
+        self._file = None
+        self.path: Optional[str] = None
+
+    def reset(self) -> None:
+        """清除之前的 span（同一個程序中多次執行批改時使用）"""
+        with self._lock:
+            self.spans.clear()
+
+    def open(self, path: str) -> None:
+        """開始把 span 寫到 JSONL 檔案（每次執行覆寫）"""
+        self.close()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._file = open(path, 'w', encoding='utf-8')
+        self.path = path
+
+    @contextmanager
+    def span(self, name: str, **attrs):
+        """計時一段工作，區塊中可以用 span.set(...) 加上結果（例如 token 數）；發生例外時狀態為 error"""
+        span = Span(name, current_student.get(), attrs)
+        started = time.perf_counter()
+        try:
+            yield span
+        except BaseException as e:
+            span.status = "error"
+            span.attrs.setdefault("error", f"{type(e).__name__}: {e}"[:300])
+            raise
+        finally:
+            span.duration = time.perf_counter() - started
+            self._record(span)
+
+    def event(self, name: str, **attrs) -> None:
+        """記錄沒有持續時間的事件，例如重試"""
+        self._record(Span(name, current_student.get(), attrs))
+
+    def _record(self, span: Span) -> None:
+        with self._lock:
+            self.spans.append(span)
+            if self._file is not None:
+                self._file.write(json.dumps(span.to_dict(), ensure_ascii=False, default=str) + "\n")
+                self._file.flush()
+
+    def summary(self, slowest: int = 5) -> str:
+        """各種 span 的次數、總時間、平均、p95 與最大值，以及 token 總數與最慢的學生"""
+        with self._lock:
+            spans = list(self.spans)
+        if not spans:
+            return "追蹤記錄：沒有任何 span"
+        by_name = defaultdict(list)
+        tokens = defaultdict(int)
+        per_student = defaultdict(float)
+        for span in spans:
+            by_name[span.name].append(span)
+            for field in TOKEN_FIELDS:
+                value = span.attrs.get(field)
+                if isinstance(value, (int, float)):
+                    tokens[field] += value
+            if span.name == "student" and span.student:
+                per_student[span.student] += span.duration
+
+        headers = [("階段", 24), ("次數", 8), ("錯誤", 6), ("總時間(s)", 12), ("平均(s)", 10), ("p95(s)", 10), ("最大(s)", 10)]
+        lines = [_pad(headers[0][0], headers[0][1]) + "".join(_pad(title, width, right=True) for title, width in headers[1:])]
+        for name in sorted(by_name, key=lambda n: -sum(s.duration for s in by_name[n])):
+            durations = sorted(s.duration for s in by_name[name])
+            errors = sum(1 for s in by_name[name] if s.status != "ok")
+            total = sum(durations)
+            p95 = durations[min(len(durations) - 1, int(len(durations) * 0.95))]
+            lines.append(
+                f"{name:<24}{len(durations):>8}{errors:>6}{total:>12.2f}{total / len(durations):>10.3f}"
+                f"{p95:>10.3f}{durations[-1]:>10.3f}"
+            )
+        streamed = [s for s in by_name.get("model", []) if "early_stop" in s.attrs]
+        if streamed:
+            ttfts = [s.attrs["ttft"] for s in streamed if isinstance(s.attrs.get("ttft"), (int, float))]
+            lines.append(f"串流：{sum(1 for s in streamed if s.attrs['early_stop'])} / {len(streamed)} 次在工具調用完成後提前結束"
+                         + (f"，平均首個 token {sum(ttfts) / len(ttfts):.2f}s" if ttfts else ""))
+        if tokens:
+            lines.append("tokens：" + "，".join(f"{field} {tokens[field]}" for field in TOKEN_FIELDS if field in tokens))
+        if per_student:
+            top = sorted(per_student.items(), key=lambda item: -item[1])[:slowest]
+            lines.append("最慢的學生：" + "，".join(f"{student} {seconds:.1f}s" for student, seconds in top))
+        if self.path:
+            lines.append(f"完整追蹤記錄：{self.path}")
+        return "\n".join(lines)
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+# 整個程式共用的追蹤記錄
+tracer = Tracer()